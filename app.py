@@ -1,8 +1,22 @@
-import fbx
+try:
+    import fbx
+except ImportError:
+    # FBX SDK is optional when using the native FBX reader
+    fbx = None
 from core.SPA import SPA
 from core.ANM import ANM
+from core.Cache import Cache
+from core.Manifest import Manifest
+from core.Pack import Pack, PackWriter
+from core.FBX import FBX, unrollRotations
+from core.Track import dataToTracks
+from core.keyframes import reduceTrack, roundTrack, subtractTrackOffsets, mergeCurves
+import core.profiling as profiling
+import core.utils as ut
 import os, sys, glob
-import math
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 
 def getASCIIFormatIndex( pManager ):
     ''' Obtain the index of the ASCII export format. '''
@@ -92,13 +106,91 @@ def loadInitialFbx(fbxScene):
         keyIndex = rotZCurve.KeyAdd(time)[0]
         rotZCurve.KeySet(0, time, rotZ, fbx.FbxAnimCurveDef.eInterpolationConstant)
 
-def exportToFbx(path, fbxScene, inputClass):
-    inputName = os.path.basename(path)
-    inputObject = eval(inputClass.upper())(inputName)
-    stream = open(path, "rb")
-    inputObject.read(stream)
-
-    rootNode = fbxScene.GetRootNode()
+def readAnimation(path, cacheDir = None):
+    name, ext = os.path.splitext(os.path.basename(path))
+    with profiling.span('readAnimation', animation=os.path.basename(path)):
+        if cacheDir != None:
+            inputObject = Cache(cacheDir).load(path, eval(ext[1:].upper()))
+        else:
+            inputObject = eval(ext[1:].upper()).fromPath(path)
+    countKeysRead(inputObject)
+    return inputObject
+
+def readPackEntries(pack, entries):
+    inputObjects = []
+    for entry in entries:
+        with profiling.span('readAnimation', animation=entry['name']):
+            inputObject = pack.read(entry)
+        countKeysRead(inputObject)
+        inputObjects.append(inputObject)
+    return inputObjects
+
+def readArchive(path, jobs = 1):
+    '''
+    Animations of an archive (or any blob indexed by Pack), in archive order.
+    Each worker reads a run of entries, the archive is mapped once per worker
+    '''
+    pack = Pack.fromPath(path)
+    runSize = max(-(-len(pack.entries) // jobs), 1)
+    runs = [pack.entries[i:i + runSize] for i in range(0, len(pack.entries), runSize)]
+    return [inputObject for inputObjects in mapJobs(readPackEntries, [(pack, run) for run in runs], jobs) \
+        for inputObject in inputObjects]
+
+def countKeysRead(inputObject):
+    if profiling.enabled:
+        for boneName, track in inputObject.tracks.items():
+            profiling.count('keysRead', len(track.translationFrames) + len(track.rotationFrames), \
+                inputObject.name, boneName)
+
+def mapJobs(function, argsList, jobs = 1):
+    '''
+    Calls function for each args tuple, in a process pool when jobs > 1,
+    results are returned in input order whatever the worker count
+    '''
+    if jobs > 1 and len(argsList) > 1:
+        with ProcessPoolExecutor(jobs) as executor:
+            if not profiling.enabled:
+                return list(executor.map(function, *zip(*argsList)))
+            # Workers send back their spans and counters with each result
+            results = []
+            for result, events, counters in executor.map(profiling.runProfiled, \
+                [function] * len(argsList), *zip(*argsList)):
+                profiling.merge(events, counters)
+                results.append(result)
+            return results
+    return [function(*args) for args in argsList]
+
+def exportFolderToFbx(paths, fbxScene, jobs = 1, cacheDir = None):
+    # Decoding in parallel, animations are added to the scene in input order
+    nodeIndex = getNodeIndex(fbxScene)
+    for inputObject in mapJobs(readAnimation, [(path, cacheDir) for path in paths], jobs):
+        with profiling.span('addAnimation', animation=inputObject.name):
+            addAnimation(fbxScene, inputObject, nodeIndex)
+
+def exportToFbx(path, fbxScene, cacheDir = None, jobs = 1):
+    # Files other than ANM/SPA are read as archives of animations
+    if os.path.splitext(path)[1][1:].upper() in ('ANM', 'SPA'):
+        inputObjects = [readAnimation(path, cacheDir)]
+    else:
+        inputObjects = readArchive(path, jobs)
+    nodeIndex = getNodeIndex(fbxScene)
+    for inputObject in inputObjects:
+        with profiling.span('addAnimation', animation=inputObject.name):
+            addAnimation(fbxScene, inputObject, nodeIndex)
+
+def addAnimation(fbxScene, inputObject, nodeIndex = None):
+    '''
+    Adds a stack of the animation to the scene, nodeIndex is the
+    getNodeIndex of the scene, shared by the animations of an export
+    '''
+    # Native FBX documents add whole curves from the track arrays
+    if isinstance(fbxScene, FBX):
+        fbxScene.addAnimation(inputObject.name, inputObject.tracks)
+        return
+
+    inputName = inputObject.name
+    if nodeIndex == None:
+        nodeIndex = getNodeIndex(fbxScene)
     time = fbx.FbxTime()
     time.SetGlobalTimeMode(fbx.FbxTime.ePAL)
     time.SetFrame(0)
@@ -108,97 +200,197 @@ def exportToFbx(path, fbxScene, inputClass):
     animLayer = fbx.FbxAnimLayer.Create(fbxScene, "")
     animStack.AddMember(animLayer)
     
-    for boneName in inputObject.data:
-        node = rootNode.FindChild(boneName)
+    for boneName in inputObject.tracks:
+        # FindChild would give None, bones missing from the scene are skipped
+        # (and never decoded from lazily read files)
+        if boneName not in nodeIndex:
+            continue
+        track = inputObject.tracks[boneName]
+        node, restTranslation, restRotation = nodeIndex[boneName]
 
         # Getting TR curves
-        transXCurve = node.LclTranslation.GetCurve(animLayer, 'X', True)
-        transYCurve = node.LclTranslation.GetCurve(animLayer, 'Y', True)
-        transZCurve = node.LclTranslation.GetCurve(animLayer, 'Z', True)
+        transCurves = [node.LclTranslation.GetCurve(animLayer, axis, True) for axis in 'XYZ']
+        rotCurves = [node.LclRotation.GetCurve(animLayer, axis, True) for axis in 'XYZ']
+
+        # Adding the rest pose to every key at once
+        frames, translations = FBX.sortKeys(track.translationFrames, \
+            track.translations[:, :3] + restTranslation)
+        setCurveKeys(transCurves, time, frames.tolist(), translations.tolist())
+
+        frames, rotations = FBX.sortKeys(track.rotationFrames, \
+            track.rotations[:, :3] + restRotation)
+        setCurveKeys(rotCurves, time, frames.tolist(), rotations.tolist())
+
+def setCurveKeys(curves, time, frames, values):
+    '''
+    Keys empty X, Y, Z curves with sorted frames, the values of every key
+    are computed beforehand so that only KeyAdd and KeySet reach the SDK
+    '''
+    for curve in curves:
+        curve.KeyModifyBegin()
+
+    for frame, keyValues in zip(frames, values):
+        time.SetFrame(frame)
+        for curve, value in zip(curves, keyValues):
+            keyIndex = curve.KeyAdd(time)[0]
+            curve.KeySet(keyIndex, time, value, fbx.FbxAnimCurveDef.eInterpolationConstant)
+
+    for curve in curves:
+        curve.KeyModifyEnd()
+
+def getNodeIndex(fbxScene):
+    '''
+    Name -> (node, rest translation, rest rotation) of every node under
+    the root, None for native FBX documents
+    '''
+    if isinstance(fbxScene, FBX):
+        return None
+    return indexNodes(fbxScene.GetRootNode(), {})
+
+def indexNodes(node, nodeIndex):
+    # Same lookup order as the recursive FbxNode.FindChild: children first,
+    # then each child subtree, the first node of a name wins
+    children = [node.GetChild(i) for i in range(node.GetChildCount())]
+    for child in children:
+        if child.GetName() not in nodeIndex:
+            translation = child.LclTranslation.Get()
+            rotation = child.LclRotation.Get()
+            nodeIndex[child.GetName()] = (child, \
+                np.array([translation[0], translation[1], translation[2]]), \
+                np.array([rotation[0], rotation[1], rotation[2]]))
+    for child in children:
+        indexNodes(child, nodeIndex)
+    return nodeIndex
+
+def writeAnimation(path, outputName, outputClass, tracks, frameCount, offsetData = None, tolerance = 0):
+    buffer = encodeAnimation(outputName, outputClass, tracks, frameCount, offsetData, tolerance)
+    with profiling.span('write', animation=outputName):
+        with open(f'{path}/{outputName}', "wb") as stream:
+            stream.write(buffer)
+
+def encodeAnimation(outputName, outputClass, tracks, frameCount, offsetData = None, tolerance = 0):
+    if profiling.enabled:
+        keyCounts = getKeyCounts(tracks)
+        for boneName, keyCount in keyCounts.items():
+            profiling.count('keysRead', keyCount, outputName, boneName)
+    if offsetData != None or tolerance > 0:
+        with profiling.span('cleanData', animation=outputName):
+            tracks = cleanData(tracks, offsetData, tolerance)
+    if profiling.enabled:
+        for boneName, keyCount in getKeyCounts(tracks).items():
+            profiling.count('keysDropped', keyCounts[boneName] - keyCount, outputName, boneName)
+
+    outputObject = eval(outputClass.upper())(outputName)
+    with profiling.span('load', animation=outputName):
+        outputObject.load(tracks, frameCount)
+    with profiling.span('encode', animation=outputName):
+        return outputObject.encode()
+
+def getKeyCounts(tracks):
+    '''
+    Translation and rotation keys of each bone
+    '''
+    return {boneName: len(track) for boneName, track in tracks.items()}
+
+def importScene(path):
+    fbxManager = fbx.FbxManager.Create()
+    fbxScene = fbx.FbxScene.Create(fbxManager, '')
+    importer = fbx.FbxImporter.Create(fbxManager, '')
 
-        rotXCurve = node.LclRotation.GetCurve(animLayer, 'X', True)
-        rotYCurve = node.LclRotation.GetCurve(animLayer, 'Y', True)
-        rotZCurve = node.LclRotation.GetCurve(animLayer, 'Z', True)
-
-        transXCurve.KeyModifyBegin()
-        transYCurve.KeyModifyBegin()
-        transZCurve.KeyModifyBegin()
-
-        rotXCurve.KeyModifyBegin()
-        rotYCurve.KeyModifyBegin()
-        rotZCurve.KeyModifyBegin()
-
-        for frameNum in inputObject.data[boneName]:
-            time.SetFrame(frameNum)
-
-            if 'translation' in inputObject.data[boneName][frameNum]:
-                transX = node.LclTranslation.Get()[0]
-                transY = node.LclTranslation.Get()[1]
-                transZ = node.LclTranslation.Get()[2]
-
-                transX += inputObject.data[boneName][frameNum]['translation'][0]
-                transY += inputObject.data[boneName][frameNum]['translation'][1]
-                transZ += inputObject.data[boneName][frameNum]['translation'][2]
-
-                keyIndex = transXCurve.KeyAdd(time)[0]
-                transXCurve.KeySet(keyIndex, time, transX, fbx.FbxAnimCurveDef.eInterpolationConstant)
-                keyIndex = transYCurve.KeyAdd(time)[0]
-                transYCurve.KeySet(keyIndex, time, transY, fbx.FbxAnimCurveDef.eInterpolationConstant)
-                keyIndex = transZCurve.KeyAdd(time)[0]
-                transZCurve.KeySet(keyIndex, time, transZ, fbx.FbxAnimCurveDef.eInterpolationConstant)
-            
-            if 'rotation' in inputObject.data[boneName][frameNum]:
-                rotX = node.LclRotation.Get()[0]
-                rotY = node.LclRotation.Get()[1]
-                rotZ = node.LclRotation.Get()[2]
-            
-                rotX += inputObject.data[boneName][frameNum]['rotation'][0]
-                rotY += inputObject.data[boneName][frameNum]['rotation'][1]
-                rotZ += inputObject.data[boneName][frameNum]['rotation'][2]
-
-                keyIndex = rotXCurve.KeyAdd(time)[0]
-                rotXCurve.KeySet(keyIndex, time, rotX, fbx.FbxAnimCurveDef.eInterpolationConstant)
-                keyIndex = rotYCurve.KeyAdd(time)[0]
-                rotYCurve.KeySet(keyIndex, time, rotY, fbx.FbxAnimCurveDef.eInterpolationConstant)
-                keyIndex = rotZCurve.KeyAdd(time)[0]
-                rotZCurve.KeySet(keyIndex, time, rotZ, fbx.FbxAnimCurveDef.eInterpolationConstant)
-    
-        rotXCurve.KeyModifyEnd()
-        rotYCurve.KeyModifyEnd()
-        rotZCurve.KeyModifyEnd()
+    ios = fbx.FbxIOSettings.Create(fbxManager, fbx.IOSROOT)
+    importer.Initialize(path, -1, ios)
+    importer.Import(fbxScene)
+
+    return fbxManager, fbxScene, importer
+
+def getDefaultAnimData(outputClass, native = False, cacheDir = None):
+    '''
+    Animation data of the default pose, parsed once per T-pose file change
+    and kept in the cache folder (a temporary folder by default) across runs
+    '''
+    path = f"resources/fbx/{outputClass.lower()}_t_pose.fbx"
+    cache = Cache(cacheDir if cacheDir != None else Cache.defaultPath)
+    return cache.loadDefaultPose(path, 'native' if native else 'sdk', \
+        lambda path: parseDefaultAnimData(path, outputClass, native))
 
-        transXCurve.KeyModifyEnd()
-        transYCurve.KeyModifyEnd()
-        transZCurve.KeyModifyEnd()
+def parseDefaultAnimData(path, outputClass, native = False):
+    if native:
+        return getNativeAnimationData(FBX.fromPath(path), outputClass, False)
 
-def fbxExport(fbxInput, path, outputClass):
+    fbxManager, fbxScene, importer = importScene(path)
+    try:
+        return getAnimationData(fbxScene, importer, outputClass, False)
+    finally:
+        importer.Destroy()
+        fbxScene.Destroy()
+        fbxManager.Destroy()
+
+def fbxExport(fbxScene, importer, path, outputClass, jobs = 1, tolerance = 0, archiveName = None, manifestPath = None, \
+              cacheDir = None):
+    # fbxScene is either an SDK scene or a native FBX document
+    native = isinstance(fbxScene, FBX)
     defaultAnimData = None
     defaultName = ""
     try:
-        defaultAnimData = getAnimationData(f"resources/fbx/{outputClass.lower()}_t_pose.fbx", outputClass, False)
+        with profiling.span('getDefaultAnimData'):
+            defaultAnimData = getDefaultAnimData(outputClass, native, cacheDir)
         defaultName = list(defaultAnimData.keys())[0]
     except:
         pass
-    animData, frameCounts = getAnimationData(fbxInput, outputClass)
-
-    animData = roundData(animData)
-    for outputName in animData:
-        if defaultAnimData != None and defaultName != "":
-            animData[outputName] = cleanData(animData[outputName], defaultAnimData[defaultName])
-        outputObject = eval(outputClass.upper())(outputName)
-        stream = open(f'{path}/{outputName}', "wb")
-        outputObject.load(animData[outputName], frameCounts[outputName])
-        outputObject.write(stream)
-
-def getAnimationData(path, outputClass, withFrameCount = True):
-    fbxManager = fbx.FbxManager.Create()
-    fbxScene = fbx.FbxScene.Create(fbxManager, '')
-    importer = fbx.FbxImporter.Create(fbxManager, '')
-    
-    ios = fbx.FbxIOSettings.Create(fbxManager, fbx.IOSROOT)
-    importer.Initialize(path, -1, ios)
-    importer.Import(fbxScene)
-
+    with profiling.span('getAnimationData'):
+        if native:
+            animData, frameCounts = getNativeAnimationData(fbxScene, outputClass)
+        else:
+            animData, frameCounts = getAnimationData(fbxScene, importer, outputClass)
+
+    offsetData = None
+    if defaultAnimData != None and defaultName != "":
+        offsetData = defaultAnimData[defaultName]
+
+    outputNames = list(animData)
+    outputPaths = {outputName: os.path.join(path, outputName if archiveName == None else archiveName) \
+        for outputName in outputNames}
+    buffers = {}
+    if manifestPath != None:
+        # Animations extracted with the same keys as in the last export are not encoded again
+        manifest = Manifest(manifestPath)
+        with profiling.span('fingerprint'):
+            fingerprints = {outputName: manifest.getFingerprint(animData[outputName], \
+                frameCounts[outputName], (outputClass, tolerance, offsetData)) for outputName in outputNames}
+        unchanged = set(manifest.getUnchanged(fingerprints, outputPaths))
+        if archiveName != None and unchanged:
+            # Read before the archive is written again
+            pack = Pack.fromPath(os.path.join(path, archiveName))
+            buffers = {entry['name']: bytes(pack.getBuffer(entry)) for entry in pack.entries \
+                if entry['name'] in unchanged}
+            pack.close()
+            unchanged = set(buffers)
+        animData = {outputName: animData[outputName] for outputName in outputNames if outputName not in unchanged}
+
+    # Keys are cleaned and encoded in the track layout
+    with profiling.span('roundData'):
+        animData = roundData({outputName: dataToTracks(data) for outputName, data in animData.items()})
+
+    argsList = [(outputName, outputClass, animData[outputName], frameCounts[outputName], \
+        offsetData, tolerance) for outputName in animData]
+    if archiveName == None:
+        # Encoding and writing in parallel, each animation goes to its own file
+        mapJobs(writeAnimation, [(path, *args) for args in argsList], jobs)
+    else:
+        # Encoding in parallel, animations are added to the archive in input order
+        buffers.update(zip(animData, mapJobs(encodeAnimation, argsList, jobs)))
+        with profiling.span('writeArchive', path=archiveName):
+            with open(os.path.join(path, archiveName), "wb") as stream:
+                writer = PackWriter(stream, len(outputNames))
+                for outputName in outputNames:
+                    writer.add(outputName, buffers[outputName])
+                writer.close()
+
+    if manifestPath != None:
+        manifest.update(fingerprints, outputPaths)
+        manifest.save()
+
+def getAnimationData(fbxScene, importer, outputClass, withFrameCount = True):
     # Init selection criteria
     animStackClassIdCriteria = fbx.FbxCriteria.ObjectType(fbx.FbxAnimStack.ClassId)
     animLayerClassIdCriteria = fbx.FbxCriteria.ObjectType(fbx.FbxAnimLayer.ClassId)
@@ -227,7 +419,8 @@ def getAnimationData(path, outputClass, withFrameCount = True):
         lFilter.SetTestForPath(True)
         lFilter.SetForceAutoTangents(True)
         lFilter.SetQualityTolerance(0.25)
-        lFilter.Apply(animStack)
+        with profiling.span('unrollFilter', animation=outputName):
+            lFilter.Apply(animStack)
 
         if withFrameCount:
             takeInfo = importer.GetTakeInfo(i)
@@ -241,166 +434,269 @@ def getAnimationData(path, outputClass, withFrameCount = True):
         for j in range(animLayerCount):
             animLayer = animStack.GetSrcObject(animLayerClassIdCriteria, j)
             node = rootNode.FindChild(rootBoneName)
-            animData[outputName] = \
-                getNodeAnimationData(animData[outputName], node, animLayer)
+            with profiling.span('getNodeAnimationData', animation=outputName, bone=rootBoneName):
+                animData[outputName] = \
+                    getNodeAnimationData(animData[outputName], node, animLayer)
             
             for k in range(boneCount):
                 node = fbxScene.GetSrcObject(skeletonCriteria, k).GetNode()
-                animData[outputName] = \
-                    getNodeAnimationData(animData[outputName], node, animLayer)
-    
-    importer.Destroy()
-    fbxScene.Destroy()
-    fbxManager.Destroy()
+                with profiling.span('getNodeAnimationData', animation=outputName, bone=node.GetName()):
+                    animData[outputName] = \
+                        getNodeAnimationData(animData[outputName], node, animLayer)
+
+    if withFrameCount:
+        return animData, frameCounts
+    else:
+        return animData
+
+def getNativeAnimationData(document, outputClass, withFrameCount = True):
+    '''
+    Same output as getAnimationData, read with the native FBX reader
+    '''
+    animData = {}
+    frameCounts = {}
+
+    rootBoneName = eval(outputClass.upper()).boneList[0]
+    models = [document.findModel(rootBoneName)] + document.getSkeletonModels()
+    models = [model for model in models if model != None]
+
+    for i, animStack in enumerate(document.getAnimStacks()):
+        outputName = os.path.splitext(os.path.basename(document.getName(animStack)))[0]
+        if "|" in outputName:
+            outputName = outputName.split("|")[-1]
+        outputName += f".{outputClass.lower()}"
+        animData[outputName] = {rootBoneName: {0: {'translation': (0,0,0,1), 'rotation': (0,0,0)}}}
+
+        if withFrameCount:
+            startFrame, stopFrame = document.getTimeSpan(i, animStack)
+            frameCounts[outputName] = int(stopFrame - startFrame)
+
+        for animLayer in document.getAnimLayers(animStack):
+            for model in models:
+                with profiling.span('getNodeAnimationData', animation=outputName, bone=document.getName(model)):
+                    animData[outputName] = \
+                        getNativeNodeAnimationData(animData[outputName], document, model, animLayer)
 
     if withFrameCount:
         return animData, frameCounts
     else:
         return animData
 
+def getNativeNodeAnimationData(animData, document, model, animLayer):
+    nodeName = document.getName(model)
+    if nodeName not in animData:
+        animData[nodeName] = {}
+
+    # Like getNodeAnimationData, missing keys are evaluated from the keys
+    # of their curve, with the interpolation of these keys
+    tracks = []
+    for propertyName in ('Lcl Translation', 'Lcl Rotation'):
+        curves, defaults, attributes = document.getCurves(model, animLayer, propertyName)
+        if propertyName == 'Lcl Rotation':
+            curves = {axis: (frames, unrollRotations(values)) for axis, (frames, values) in curves.items()}
+        tracks.append(mergeCurves(curves, defaults, lambda axis, frames, curves=curves, attributes=attributes: \
+            FBX.evaluateCurve(*curves[axis], attributes[axis], frames)))
+    addNodeKeys(animData[nodeName], *tracks)
+
+    return animData
+
+def addNodeKeys(boneData, translationKeys, rotationKeys):
+    '''
+    Adds (frames, XYZ values) keys of translation and rotation curves to the
+    data[frame][dataType] layout, leaving out keys equal to zero
+    '''
+    frames, translations = translationKeys
+    for frame, (transX, transY, transZ) in zip(frames.tolist(), translations.tolist()):
+        translation = (transZ, transY, transX, 1)
+        if translation != (0,0,0,1):
+            if frame not in boneData:
+                boneData[frame] = {}
+            boneData[frame]['translation'] = translation
+
+    frames, rotations = rotationKeys
+    for frame, rotation in zip(frames.tolist(), rotations.tolist()):
+        rotation = tuple(rotation)
+        if rotation != (0,0,0):
+            if frame not in boneData:
+                boneData[frame] = {}
+            boneData[frame]['rotation'] = rotation
+
 # Remove position and rotation offsets from the default pose + cleaning redundant frames
-def cleanData(data, offsetData = None):
-    for boneName in data:
-        lastTransFrame = 0
-        lastRotFrame = 0
-
-        for frame in list(data[boneName].keys()):
-            if 'translation' in data[boneName][frame]:
-                if (frame > 0) and ('translation' in data[boneName][lastTransFrame]) and \
-                    math.isclose(data[boneName][frame]['translation'][0], data[boneName][lastTransFrame]['translation'][0], rel_tol=0.001) and \
-                    math.isclose(data[boneName][frame]['translation'][1], data[boneName][lastTransFrame]['translation'][1], rel_tol=0.001) and \
-                    math.isclose(data[boneName][frame]['translation'][2], data[boneName][lastTransFrame]['translation'][2], rel_tol=0.001):
-                    del data[boneName][frame]['translation']
-                else:
-                    lastTransFrame = frame
-            if 'rotation' in data[boneName][frame]:
-                if (frame > 0) and ('rotation' in data[boneName][lastRotFrame]) and \
-                    math.isclose(data[boneName][frame]['rotation'][0], data[boneName][lastRotFrame]['rotation'][0], rel_tol=0.001) and \
-                    math.isclose(data[boneName][frame]['rotation'][1], data[boneName][lastRotFrame]['rotation'][1], rel_tol=0.001) and \
-                    math.isclose(data[boneName][frame]['rotation'][2], data[boneName][lastRotFrame]['rotation'][2], rel_tol=0.001):
-                    del data[boneName][frame]['rotation']
-                else:
-                    lastRotFrame = frame
-            if data[boneName][frame] == {}:
-                del data[boneName][frame]
-        
+def cleanData(tracks, offsetData = None, tolerance = 0):
+    for boneName in tracks:
+        track = reduceTrack(tracks[boneName], tolerance)
+
         if offsetData != None:
-            for frame in list(data[boneName].keys()):
-                if 'translation' in data[boneName][frame]:
-                    if 0 in offsetData[boneName] and 'translation' in offsetData[boneName][0]:
-                        data[boneName][frame]['translation'] = tuple(map(lambda i, j: i - j, \
-                            data[boneName][frame]['translation'], offsetData[boneName][0]['translation']))
-                    if data[boneName][frame]['translation'] != (0,0,0,1):
-                            data[boneName][frame]['translation'] = (*data[boneName][frame]['translation'][:3],1)
-                    else:
-                        del data[boneName][frame]['translation']
-                if 'rotation' in data[boneName][frame]:
-                    if 0 in offsetData[boneName] and 'rotation' in offsetData[boneName][0]:
-                        data[boneName][frame]['rotation'] = tuple(map(lambda i, j: i - j, \
-                            data[boneName][frame]['rotation'], offsetData[boneName][0]['rotation']))
-                    if data[boneName][frame]['rotation'] == (0,0,0):
-                        del data[boneName][frame]['rotation']
-                if data[boneName][frame] == {}:
-                    del data[boneName][frame]
-    return data
+            offsets = offsetData[boneName][0] if 0 in offsetData[boneName] else {}
+            track = subtractTrackOffsets(track, offsets.get('translation'), offsets.get('rotation'))
+        tracks[boneName] = track
+    return tracks
 
 def roundData(data):
     for animName in data:
         for boneName in data[animName]:
-            for frame in data[animName][boneName]:
-                if 'translation' in data[animName][boneName][frame]:
-                    data[animName][boneName][frame]['translation'] = \
-                        tuple(map(lambda x: isinstance(x, float) and round(x, 4) or x, \
-                            data[animName][boneName][frame]['translation']))
-                if 'rotation' in data[animName][boneName][frame]:
-                    data[animName][boneName][frame]['rotation'] = \
-                        tuple(map(lambda x: isinstance(x, float) and round(x, 4) or x, \
-                            data[animName][boneName][frame]['rotation']))
+            data[animName][boneName] = roundTrack(data[animName][boneName])
     return data
 
 def getNodeAnimationData(animData, node, animLayer):
     if node.GetName() not in animData:
         animData[node.GetName()] = {}
-    
-    # Getting TR curves
-    transXCurve = node.LclTranslation.GetCurve(animLayer, 'X', True)
-    transYCurve = node.LclTranslation.GetCurve(animLayer, 'Y', True)
-    transZCurve = node.LclTranslation.GetCurve(animLayer, 'Z', True)
-
-    rotXCurve = node.LclRotation.GetCurve(animLayer, 'X', True)
-    rotYCurve = node.LclRotation.GetCurve(animLayer, 'Y', True)
-    rotZCurve = node.LclRotation.GetCurve(animLayer, 'Z', True)
-
-    for i in range(transXCurve.KeyGetCount()):
-        time = transXCurve.KeyGetTime(i)
-        time.SetGlobalTimeMode(fbx.FbxTime.ePAL)
-        frame = time.GetFrameCount()
-        translation = (transZCurve.KeyGetValue(i), transYCurve.KeyGetValue(i), transXCurve.KeyGetValue(i), 1)
-        if translation != (0,0,0,1):
-            if frame not in animData[node.GetName()]:
-                animData[node.GetName()][frame] = {}
-            animData[node.GetName()][frame]['translation'] = translation
-
-    for i in range(rotXCurve.KeyGetCount()):
-        time = rotXCurve.KeyGetTime(i)
-        time.SetGlobalTimeMode(fbx.FbxTime.ePAL)
-        frame = time.GetFrameCount()
-        rotation = (rotXCurve.KeyGetValue(i), rotYCurve.KeyGetValue(i), rotZCurve.KeyGetValue(i))
-        if rotation != (0,0,0):
-            if frame not in animData[node.GetName()]:
-                animData[node.GetName()][frame] = {}
-            animData[node.GetName()][frame]['rotation'] = rotation
+
+    # Keys of the X, Y and Z curves are merged on the union of their frames,
+    # curves without a key at one of them are only evaluated there
+    fbx.FbxTime.SetGlobalTimeMode(fbx.FbxTime.ePAL)
+    tracks = []
+    for property in (node.LclTranslation, node.LclRotation):
+        curves = {}
+        keys = {}
+        for axis in 'XYZ':
+            curve = property.GetCurve(animLayer, axis)
+            if curve != None:
+                curves[axis] = curve
+                keys[axis] = getCurveKeys(curve)
+        hasKeys = [axis in keys and len(keys[axis][0]) > 0 for axis in 'XYZ']
+        defaults = [0, 0, 0]
+        if any(hasKeys) and not all(hasKeys):
+            # Only read when an axis has no keys
+            value = property.Get()
+            defaults = [value[0], value[1], value[2]]
+        tracks.append(mergeCurves(keys, defaults, \
+            lambda axis, frames, curves=curves: evaluateCurve(curves[axis], frames)))
+    addNodeKeys(animData[node.GetName()], *tracks)
 
     return animData
 
-def handleInput(args):    
+def getCurveKeys(curve):
+    '''
+    Frames and values of the keys of an SDK curve
+    '''
+    keyCount = curve.KeyGetCount()
+    frames = [curve.KeyGetTime(i).GetFrameCount() for i in range(keyCount)]
+    values = [curve.KeyGetValue(i) for i in range(keyCount)]
+    return frames, values
+
+def evaluateCurve(curve, frames):
+    '''
+    Values of an SDK curve at the given frames, with its own interpolation
+    '''
+    time = fbx.FbxTime()
+    values = []
+    for frame in frames.tolist():
+        time.SetFrame(frame)
+        values.append(curve.Evaluate(time))
+    return values
+
+def parseOptions(argv):
+    '''
+    Splits --name=value options (other than --to) from positional arguments
+    '''
+    args = []
+    options = {}
+    for arg in argv:
+        if arg.startswith('--') and not arg.startswith('--to='):
+            name, value = arg[2:].split('=', 1) if '=' in arg else (arg[2:], '')
+            options[name] = value
+        else:
+            args.append(arg)
+    if 'jobs' in options and not (options['jobs'].isdecimal() and int(options['jobs']) >= 1):
+        raise Exception(f"--jobs needs a number of worker processes of at least 1, got '{options['jobs']}'")
+    return args, options
+
+def handleInput(args, options = {}):
+    if 'profile' not in options:
+        return convert(args, options)
+    # Report of the stage spans and counters, also written when the conversion fails
+    profiling.enable()
+    try:
+        convert(args, options)
+    finally:
+        profiling.writeReport(options['profile'] or 'profile.json')
+
+def convert(args, options = {}):
+    jobs = int(options.get('jobs', 1))
+    cacheDir = options.get('cache-dir')
+    tolerance = float(options.get('tolerance', 0))
     name, ext = os.path.splitext(os.path.basename(args[2]))
 
     if ext.lower() == '.fbx':
-        global fbxManager
-        fbxManager = fbx.FbxManager.Create()
-        fbxScene = fbx.FbxScene.Create(fbxManager, '')
-        importer = fbx.FbxImporter.Create(fbxManager, '')
-        
-        ios = fbx.FbxIOSettings.Create(fbxManager, fbx.IOSROOT)
-        importer.Initialize(args[2], -1, ios)
-        importer.Import(fbxScene)
+        outputFormat = args[1].split('=')[1]
+        fbxBackend = options.get('fbx-backend', 'sdk' if fbx != None else 'native')
+
+        with profiling.span('fbxImport', path=args[2]):
+            if fbxBackend == 'native':
+                # Every record is kept when the document is written back
+                fbxScene = FBX.fromPath(args[2], outputFormat.lower() == 'fbx')
+                importer = None
+            else:
+                global fbxManager
+                fbxManager, fbxScene, importer = importScene(args[2])
 
         if not os.path.exists(args[3]):
             os.mkdir(args[3])
 
         name, ext = os.path.splitext(os.path.basename(args[3]))
-        outputFormat = args[1].split('=')[1]
         if os.path.isfile(args[3]):
-            exportToFbx(args[3], fbxScene, ext[1:])
+            exportToFbx(args[3], fbxScene, cacheDir, jobs)
         elif os.path.isdir(args[3]):
             if outputFormat.lower() == 'fbx':
-                for path in glob.glob(f'{args[3]}/**'):
-                    name, ext = os.path.splitext(os.path.basename(path))
-                    exportToFbx(path, fbxScene, ext[1:])
+                paths = sorted(glob.glob(f'{args[3]}/**'), key=ut.natural_keys)
+                exportFolderToFbx(paths, fbxScene, jobs, cacheDir)
             else:
-                fbxExport(args[2], args[3], outputFormat)
+                archiveName = options.get('archive')
+                if archiveName == '':
+                    archiveName = f'{os.path.splitext(os.path.basename(args[2]))[0]}.afs'
+                manifestPath = options.get('incremental')
+                if manifestPath == '':
+                    manifestPath = f'{os.path.normpath(os.path.abspath(args[3]))}.manifest.json'
+                fbxExport(fbxScene, importer, args[3], outputFormat, jobs, tolerance, archiveName, manifestPath, \
+                    cacheDir)
                 print(f'FBX --> {outputFormat.upper()} Export done !')
         else:
             raise Exception("invalid input/output folder")
 
+        if cacheDir != None:
+            # Entries written by this run are only evicted once it is done
+            Cache(cacheDir).evict()
+
         # Saving fbx output
         if len(args) == 5:
             name, ext = os.path.splitext(os.path.basename(args[4]))
             if ext.lower() == '.fbx':
-                saveScene(args[4], fbxManager, fbxScene)
+                with profiling.span('fbxSave', path=args[4]):
+                    if isinstance(fbxScene, FBX):
+                        with open(args[4], "wb") as stream:
+                            fbxScene.write(stream)
+                    else:
+                        saveScene(args[4], fbxManager, fbxScene)
                 print('FBX Export done !')
-        
-        importer.Destroy()
+
+        if importer != None:
+            importer.Destroy()
 
 if __name__ == "__main__":
-   if len(sys.argv) < 4:
+   # Frozen executables re-run themselves in each worker process of --jobs
+   multiprocessing.freeze_support()
+   try:
+       args, options = parseOptions(sys.argv)
+   except Exception as error:
+       print(f'ERROR: {error}')
+       args = []
+   if len(args) < 4:
        print(f'USAGE:\n'
-             f'ANM TO FBX: anim_converter.exe --to=fbx input.fbx (anm_folder|input.anm) output.fbx\n'
+             f'ANM TO FBX: anim_converter.exe --to=fbx input.fbx (anm_folder|input.anm|input.afs) output.fbx\n'
              f'FBX TO ANM: anim_converter.exe --to=anm input.fbx output_folder\n'
              f'-----------------------------------------------------------------------------------\n'
-             f'SPA TO FBX: anim_converter.exe --to=fbx input.fbx (spa_folder|input.spa) output.fbx\n'
-             f'FBX TO SPA: anim_converter.exe --to=spa input.fbx output_folder'
+             f'SPA TO FBX: anim_converter.exe --to=fbx input.fbx (spa_folder|input.spa|input.afs) output.fbx\n'
+             f'FBX TO SPA: anim_converter.exe --to=spa input.fbx output_folder\n'
+             f'-----------------------------------------------------------------------------------\n'
+             f'OPTIONS:\n'
+             f'--jobs=N: decode/encode animation files with N worker processes\n'
+             f'--cache-dir=path: keep decoded ANM/SPA files in a cache folder, keyed by content\n'
+             f'--fbx-backend=(sdk|native): FBX reader/writer, native does not need the FBX SDK\n'
+             f'--tolerance=T: FBX TO ANM/SPA, also drop keys within T of the linear interpolation of their neighbours\n'
+             f'--archive[=name.afs]: FBX TO ANM/SPA, write every animation to a single AFS archive of the output folder\n'
+             f'--incremental[=manifest.json]: FBX TO ANM/SPA, only encode animations changed since the last export (default output_folder.manifest.json)\n'
+             f'--profile[=report.json]: write stage timings and key/byte counters as a Chrome trace (default profile.json)'
        )
-   elif len(sys.argv) >= 4:
-       handleInput(sys.argv)
\ No newline at end of file
+   elif len(args) >= 4:
+       handleInput(args, options)
\ No newline at end of file
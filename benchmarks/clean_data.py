@@ -0,0 +1,107 @@
+"""
+Rounding and default pose offset subtraction of a synthetic take
+(10k frames, every bone of ANM.boneList) against the previous per-key
+implementation of app.roundData and of the offset branch of app.cleanData
+
+Run from the repository root: python -m benchmarks.clean_data
+"""
+import copy, time
+import numpy as np
+from core.ANM import ANM
+from core.Track import Track, dataToTracks
+from core.keyframes import roundKeys, roundTrack, subtractOffsets, subtractTrackOffsets
+
+def legacy_round_data(data):
+    for animName in data:
+        for boneName in data[animName]:
+            for frame in data[animName][boneName]:
+                if 'translation' in data[animName][boneName][frame]:
+                    data[animName][boneName][frame]['translation'] = \
+                        tuple(map(lambda x: isinstance(x, float) and round(x, 4) or x, \
+                            data[animName][boneName][frame]['translation']))
+                if 'rotation' in data[animName][boneName][frame]:
+                    data[animName][boneName][frame]['rotation'] = \
+                        tuple(map(lambda x: isinstance(x, float) and round(x, 4) or x, \
+                            data[animName][boneName][frame]['rotation']))
+    return data
+
+def legacy_subtract_offsets(data, offsetData):
+    for boneName in data:
+        for frame in list(data[boneName].keys()):
+            if 'translation' in data[boneName][frame]:
+                if 0 in offsetData[boneName] and 'translation' in offsetData[boneName][0]:
+                    data[boneName][frame]['translation'] = tuple(map(lambda i, j: i - j, \
+                        data[boneName][frame]['translation'], offsetData[boneName][0]['translation']))
+                if data[boneName][frame]['translation'] != (0,0,0,1):
+                        data[boneName][frame]['translation'] = (*data[boneName][frame]['translation'][:3],1)
+                else:
+                    del data[boneName][frame]['translation']
+            if 'rotation' in data[boneName][frame]:
+                if 0 in offsetData[boneName] and 'rotation' in offsetData[boneName][0]:
+                    data[boneName][frame]['rotation'] = tuple(map(lambda i, j: i - j, \
+                        data[boneName][frame]['rotation'], offsetData[boneName][0]['rotation']))
+                if data[boneName][frame]['rotation'] == (0,0,0):
+                    del data[boneName][frame]['rotation']
+            if data[boneName][frame] == {}:
+                del data[boneName][frame]
+    return data
+
+def make_take(random, frameCount):
+    data = {}
+    offsetData = {}
+    for boneName in ANM.boneList:
+        translations = random.uniform(-100, 100, (frameCount, 3)).tolist()
+        rotations = random.uniform(-180, 180, (frameCount, 3)).tolist()
+        data[boneName] = {frame: {'translation': (*translation, 1), 'rotation': tuple(rotation)} \
+            for frame, (translation, rotation) in enumerate(zip(translations, rotations))}
+        offsetData[boneName] = {0: {'translation': (*random.uniform(-1, 1, 3).tolist(), 1),
+            'rotation': tuple(random.uniform(-90, 90, 3).tolist())}}
+    return data, offsetData
+
+def to_data(tracks):
+    # Nested {name: Track} results in the dict layout
+    if isinstance(tracks, Track):
+        return tracks.toDict()
+    return {name: to_data(value) for name, value in tracks.items()}
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+def run(frameCount = 10000):
+    data, offsetData = make_take(np.random.default_rng(0), frameCount)
+    tracks = dataToTracks(data)
+    results = {}
+
+    def dict_round(data):
+        for boneName in data['take']:
+            roundKeys(data['take'][boneName])
+        return data
+
+    def dict_offsets(data):
+        for boneName in data:
+            subtractOffsets(data[boneName], offsetData[boneName])
+        return data
+
+    def track_round(tracks):
+        return {'take': {boneName: roundTrack(track) for boneName, track in tracks.items()}}
+
+    def track_offsets(tracks):
+        return {boneName: subtractTrackOffsets(track, offsetData[boneName][0]['translation'],
+            offsetData[boneName][0]['rotation']) for boneName, track in tracks.items()}
+
+    results['round'] = (timed(legacy_round_data, {'take': copy.deepcopy(data)}),
+        timed(dict_round, {'take': copy.deepcopy(data)}), timed(track_round, tracks))
+    results['offsets'] = (timed(legacy_subtract_offsets, copy.deepcopy(data), offsetData),
+        timed(dict_offsets, copy.deepcopy(data)), timed(track_offsets, tracks))
+
+    for name, ((_, before), (_, after), (_, track)) in results.items():
+        if before != after or to_data(track) != after:
+            raise Exception(f"{name}: results differ")
+    return {name: tuple(duration for duration, _ in timings) for name, timings in results.items()}
+
+if __name__ == "__main__":
+    for name, (before, after, track) in run().items():
+        print(f'{name}: {before * 1000:.0f} ms -> dict {after * 1000:.0f} ms ({before / after:.1f}x), '
+            f'track {track * 1000:.0f} ms ({before / track:.1f}x)')
@@ -0,0 +1,174 @@
+"""
+Decode/encode throughput of the ANM and SPA codecs, of StringTable and of
+the cleanData/roundData stages on synthetic files covering bone counts,
+frame counts and rotation/translation mixes. Each stage reports keys/s,
+bytes/s and its peak traced memory.
+
+Run from the repository root:
+python -m benchmarks.codecs [--quick] [--json=results.json] [--compare=previous.json]
+"""
+import copy, io, json, os, platform, subprocess, sys, time, tracemalloc
+import numpy as np
+import app
+from core.ANM import ANM
+from core.SPA import SPA
+from core.StringTable import StringTable
+from core.Track import dataToTracks
+
+def make_data(random, boneNames, frameCount, translationRatio):
+    """
+    Dict layout take keying every bone on every frame, translationRatio
+    of the keys also have a translation
+    """
+    data = {}
+    for boneName in boneNames:
+        rotations = random.uniform(-89, 89, (frameCount, 3)).tolist()
+        translations = random.uniform(-5, 5, (frameCount, 3)).tolist()
+        hasTranslation = (random.random(frameCount) < translationRatio).tolist()
+        data[boneName] = {}
+        for frame, rotation, translation, translated in zip(range(frameCount), rotations, translations, hasTranslation):
+            data[boneName][frame] = {'rotation': tuple(rotation)}
+            if translated:
+                data[boneName][frame]['translation'] = (*translation, 1)
+    return data
+
+def count_keys(data):
+    return sum(len(keys) for boneData in data.values() for keys in boneData.values())
+
+def make_anm(data, frameCount):
+    anm = ANM('bench.anm')
+    anm.load(copy.deepcopy(data), frameCount)
+    stream = io.BytesIO()
+    anm.write(stream)
+    # Keys actually stored, ANM drops most translations
+    keyCount = sum(len(track.translationFrames) or len(track.rotationFrames) for track in anm.tracks.values())
+    return anm, stream.getvalue(), keyCount
+
+def make_spa(data, frameCount):
+    spa = SPA('bench.spa')
+    spa.load(copy.deepcopy(data), frameCount)
+    stream = io.BytesIO()
+    spa.write(stream)
+    return spa, stream.getvalue(), count_keys(data)
+
+def read_stream(cls, buffer):
+    animation = cls('bench')
+    animation.read(io.BytesIO(buffer))
+    return animation
+
+def write_reference(animation, size):
+    stream = io.BytesIO(bytes(size))
+    animation.writeReference(stream)
+    return stream
+
+def make_stages(case, random):
+    boneCount, frameCount, translationRatio = case['bones'], case['frames'], case['translationRatio']
+    anmData = make_data(random, ANM.boneList[:boneCount], frameCount, translationRatio)
+    spaData = make_data(random, [f'bone_{i:03d}' for i in range(boneCount)], frameCount, translationRatio)
+    anm, anmBytes, anmKeys = make_anm(anmData, frameCount)
+    spa, spaBytes, spaKeys = make_spa(spaData, frameCount)
+    spaTracks = dataToTracks(spaData)
+    names = [f'anim_{i}|bone_{j:03d}' for i in range(frameCount // 10 + 1) for j in range(boneCount)]
+    table = StringTable()
+    table.build(names, 0x30)
+    tableBytes = table.to_bytes()
+
+    # name: (function, keys, bytes), keys are names for StringTable
+    return {
+        'anm.read': (lambda: read_stream(ANM, anmBytes), anmKeys, len(anmBytes)),
+        'anm.readBuffer': (lambda: ANM.fromBuffer('bench', anmBytes).data, anmKeys, len(anmBytes)),
+        'anm.write': (lambda: anm.write(io.BytesIO()), anmKeys, len(anmBytes)),
+        'anm.writeReference': (lambda: write_reference(anm, len(anmBytes)), anmKeys, len(anmBytes)),
+        'spa.read': (lambda: read_stream(SPA, spaBytes), spaKeys, len(spaBytes)),
+        'spa.readBuffer': (lambda: SPA.fromBuffer('bench', spaBytes).data, spaKeys, len(spaBytes)),
+        'spa.write': (lambda: spa.write(io.BytesIO()), spaKeys, len(spaBytes)),
+        'spa.writeReference': (lambda: write_reference(spa, len(spaBytes)), spaKeys, len(spaBytes)),
+        'stringTable.build': (lambda: StringTable().build(names, 0x30), len(names), len(tableBytes)),
+        'stringTable.parse': (lambda: StringTable().read_buffer(tableBytes, 0), len(names), len(tableBytes)),
+        'cleanData': (lambda tracks: app.cleanData(tracks), count_keys(spaData), None, spaTracks),
+        'roundData': (lambda tracks: app.roundData({'bench': tracks}), count_keys(spaData), None, spaTracks),
+    }
+
+def measure(function, data = None, repeat = 3):
+    """
+    Best time of repeat runs and peak memory traced during one more run,
+    stages modifying data get a fresh copy for each run (not timed)
+    """
+    args = lambda: () if data is None else (copy.deepcopy(data),)
+    timings = []
+    for i in range(repeat):
+        arguments = args()
+        start = time.perf_counter()
+        function(*arguments)
+        timings.append(time.perf_counter() - start)
+
+    arguments = args()
+    tracemalloc.start()
+    function(*arguments)
+    peakMemory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return min(timings), peakMemory
+
+def get_cases(quick = False):
+    bones = (8, 55)
+    # ANM bone offsets are 16 bits words, 55 bones fit about 230 rotation keys each
+    frames = (50,) if quick else (50, 200)
+    translationRatios = (0.0, 0.5)
+    return [{'bones': boneCount, 'frames': frameCount, 'translationRatio': ratio} \
+        for boneCount in bones for frameCount in frames for ratio in translationRatios]
+
+def get_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+            text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def run(quick = False, repeat = 3):
+    results = []
+    for case in get_cases(quick):
+        random = np.random.default_rng(0)
+        for stage, (function, keyCount, byteCount, *data) in make_stages(case, random).items():
+            seconds, peakMemory = measure(function, data[0] if data else None, repeat)
+            results.append({**case, 'stage': stage, 'seconds': seconds, 'keys': keyCount,
+                'keysPerSecond': keyCount / seconds, 'bytes': byteCount,
+                'bytesPerSecond': None if byteCount is None else byteCount / seconds, 'peakMemory': peakMemory})
+    return {
+        'commit': get_commit(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'results': results
+    }
+
+def get_key(result):
+    return (result['bones'], result['frames'], result['translationRatio'], result['stage'])
+
+def format_result(result, previous = None):
+    line = f"{result['stage']:<20} {result['bones']:>3} bones {result['frames']:>5} frames " \
+        f"{result['translationRatio']:>4.0%} translated: {result['keysPerSecond'] / 1e6:8.3f} Mkeys/s"
+    if result['bytesPerSecond'] is not None:
+        line += f" {result['bytesPerSecond'] / 2 ** 20:8.1f} MiB/s"
+    else:
+        line += ' ' * 15
+    line += f" {result['peakMemory'] / 2 ** 10:9.0f} KiB peak"
+    if previous is not None:
+        line += f" ({result['keysPerSecond'] / previous['keysPerSecond']:.2f}x)"
+    return line
+
+if __name__ == "__main__":
+    args, options = app.parseOptions(sys.argv[1:])
+    report = run('quick' in options)
+
+    previousResults = {}
+    if 'compare' in options:
+        with open(options['compare'], 'r', encoding='utf-8') as stream:
+            previous = json.load(stream)
+        previousResults = {get_key(result): result for result in previous['results']}
+        print(f"compared with {previous.get('commit')}, speed ratios in parentheses")
+
+    for result in report['results']:
+        print(format_result(result, previousResults.get(get_key(result))))
+
+    if 'json' in options:
+        with open(options['json'], 'w', encoding='utf-8') as stream:
+            json.dump(report, stream, indent=1)
@@ -0,0 +1,54 @@
+"""
+Per-call cost of core.utils.keep_cursor_pos against the previous
+implementation that inspected the signature on every call
+
+Run from the repository root: python -m benchmarks.cursor
+"""
+import inspect, io, timeit
+import core.utils as ut
+
+def legacy_keep_cursor_pos(function):
+    def wrapper(*args, **kwargs):
+        res = b''
+        args_name = list(inspect.signature(function).parameters.keys())
+        if all(x in args_name for x in ['stream']):
+            stream_arg_index = args_name.index('stream')
+            stream = args[stream_arg_index]
+            previous_pos = stream.tell()
+            if 'start_offset' in args_name:
+                start_offset_arg_index = args_name.index('start_offset')
+                start_offset = args[start_offset_arg_index]
+                stream.seek(start_offset)
+            res = function(*args, **kwargs)
+            stream.seek(previous_pos)
+        else:
+            raise Exception("Error with given arguments")
+        return res
+    return wrapper
+
+def read_bytes_at(self, stream, offset, length):
+    stream.seek(offset)
+    return stream.read(length)
+
+def read_string_inplace(stream, start_offset, max_size = 100):
+    return ut.read_string(stream, start_offset, max_size)
+
+def run(number = 200000):
+    stream = io.BytesIO(bytes(range(256)) * 16)
+    results = {}
+
+    for label, decorator in (('before', legacy_keep_cursor_pos), ('after', ut.keep_cursor_pos)):
+        readBytesAt = decorator(read_bytes_at)
+        readStringInplace = decorator(read_string_inplace)
+        results[label] = {
+            'readBytesAt': timeit.timeit(lambda: readBytesAt(None, stream, 64, 2), number=number) / number,
+            'read_string_inplace': timeit.timeit(lambda: readStringInplace(stream, 1, 4), number=number) / number,
+        }
+    return results
+
+if __name__ == "__main__":
+    results = run()
+    for name in results['before']:
+        before = results['before'][name] * 1e9
+        after = results['after'][name] * 1e9
+        print(f'{name}: {before:.0f} ns -> {after:.0f} ns per call ({before / after:.1f}x)')
@@ -0,0 +1,190 @@
+"""
+FBX SDK calls made by app.addAnimation against the previous per-key
+implementation, counted on a stub fbx module (the SDK is not needed)
+
+Run from the repository root: python -m benchmarks.fbx_export
+"""
+import bisect, collections, sys, time, types
+import numpy as np
+
+calls = collections.Counter()
+
+class FbxTime:
+    ePAL = 'PAL'
+    def __init__(self): self.frame = 0
+    def SetGlobalTimeMode(self, mode): calls['FbxTime.SetGlobalTimeMode'] += 1
+    def SetFrame(self, frame): calls['FbxTime.SetFrame'] += 1; self.frame = frame
+
+class FbxAnimCurve:
+    def __init__(self): self.frames = []; self.values = []
+    def KeyModifyBegin(self): calls['FbxAnimCurve.KeyModifyBegin'] += 1
+    def KeyModifyEnd(self): calls['FbxAnimCurve.KeyModifyEnd'] += 1
+    def KeyAdd(self, time):
+        calls['FbxAnimCurve.KeyAdd'] += 1
+        index = bisect.bisect_left(self.frames, time.frame)
+        if index == len(self.frames) or self.frames[index] != time.frame:
+            self.frames.insert(index, time.frame)
+            self.values.insert(index, 0.0)
+        return index, 0
+    def KeySet(self, index, time, value, interpolation):
+        calls['FbxAnimCurve.KeySet'] += 1
+        self.frames[index] = time.frame
+        self.values[index] = value
+    def ResizeKeyBuffer(self, count):
+        # As in the SDK, only reserves room for KeyAppend, KeyGetCount is unchanged
+        calls['FbxAnimCurve.ResizeKeyBuffer'] += 1
+    def KeyGetCount(self): calls['FbxAnimCurve.KeyGetCount'] += 1; return len(self.frames)
+
+class FbxProperty:
+    def __init__(self, value): self.value = value; self.curves = {}
+    def Get(self): calls['FbxProperty.Get'] += 1; return list(self.value)
+    def GetCurve(self, animLayer, axis, create):
+        calls['FbxProperty.GetCurve'] += 1
+        return self.curves.setdefault((animLayer, axis), FbxAnimCurve())
+
+class FbxNode:
+    def __init__(self, name, translation, rotation):
+        self.name = name
+        self.children = []
+        self.LclTranslation = FbxProperty(translation)
+        self.LclRotation = FbxProperty(rotation)
+    def GetName(self): calls['FbxNode.GetName'] += 1; return self.name
+    def GetChildCount(self): calls['FbxNode.GetChildCount'] += 1; return len(self.children)
+    def GetChild(self, i): calls['FbxNode.GetChild'] += 1; return self.children[i]
+    def FindChild(self, name):
+        calls['FbxNode.FindChild'] += 1
+        nodes = list(self.children)
+        while nodes:
+            node = nodes.pop(0)
+            if node.name == name:
+                return node
+            nodes += node.children
+        return None
+
+class FbxAnimStack:
+    @staticmethod
+    def Create(scene, name): calls['FbxAnimStack.Create'] += 1; return FbxAnimStack()
+    def AddMember(self, animLayer): calls['FbxAnimStack.AddMember'] += 1
+
+class FbxAnimLayer:
+    @staticmethod
+    def Create(scene, name): calls['FbxAnimLayer.Create'] += 1; return FbxAnimLayer()
+
+class FbxScene:
+    def __init__(self, root): self.root = root
+    def GetRootNode(self): calls['FbxScene.GetRootNode'] += 1; return self.root
+
+stub = types.ModuleType('fbx')
+stub.FbxTime = FbxTime
+stub.FbxAnimStack = FbxAnimStack
+stub.FbxAnimLayer = FbxAnimLayer
+stub.FbxAnimCurveDef = types.SimpleNamespace(eInterpolationConstant=2)
+sys.modules['fbx'] = stub
+
+import app
+from core.ANM import ANM
+from core.Track import Track
+
+def legacy_add_animation(fbxScene, inputObject):
+    fbx = stub
+    inputName = inputObject.name
+    rootNode = fbxScene.GetRootNode()
+    time = fbx.FbxTime()
+    time.SetGlobalTimeMode(fbx.FbxTime.ePAL)
+    time.SetFrame(0)
+
+    animStack = fbx.FbxAnimStack.Create(fbxScene, inputName)
+    animLayer = fbx.FbxAnimLayer.Create(fbxScene, "")
+    animStack.AddMember(animLayer)
+
+    for boneName, track in inputObject.tracks.items():
+        node = rootNode.FindChild(boneName)
+        transCurves = [node.LclTranslation.GetCurve(animLayer, axis, True) for axis in 'XYZ']
+        rotCurves = [node.LclRotation.GetCurve(animLayer, axis, True) for axis in 'XYZ']
+        for curve in transCurves + rotCurves:
+            curve.KeyModifyBegin()
+
+        for frameNum, translation in zip(track.translationFrames.tolist(), track.translations.tolist()):
+            time.SetFrame(frameNum)
+            for axis, curve in enumerate(transCurves):
+                value = node.LclTranslation.Get()[axis] + translation[axis]
+                keyIndex = curve.KeyAdd(time)[0]
+                curve.KeySet(keyIndex, time, value, fbx.FbxAnimCurveDef.eInterpolationConstant)
+
+        for frameNum, rotation in zip(track.rotationFrames.tolist(), track.rotations.tolist()):
+            time.SetFrame(frameNum)
+            for axis, curve in enumerate(rotCurves):
+                value = node.LclRotation.Get()[axis] + rotation[axis]
+                keyIndex = curve.KeyAdd(time)[0]
+                curve.KeySet(keyIndex, time, value, fbx.FbxAnimCurveDef.eInterpolationConstant)
+
+        for curve in rotCurves + transCurves:
+            curve.KeyModifyEnd()
+
+def make_scene(random):
+    # Bones chained under the root, as in a skeleton hierarchy
+    root = parent = FbxNode('RootNode', (0, 0, 0), (0, 0, 0))
+    for boneName in ANM.boneList:
+        node = FbxNode(boneName, random.uniform(-1, 1, 3).tolist(), random.uniform(-90, 90, 3).tolist())
+        parent.children.append(node)
+        parent = node
+    return FbxScene(root)
+
+def make_animations(random, count, frameCount):
+    animations = []
+    for i in range(count):
+        animation = ANM(f'move_{i}.anm')
+        animation.tracks = {}
+        for boneName in ANM.boneList:
+            frames = np.arange(frameCount)
+            animation.tracks[boneName] = Track(frames[:frameCount // 4], random.uniform(-1, 1, (frameCount // 4, 3)),
+                frames, random.uniform(-180, 180, (frameCount, 3)))
+        animations.append(animation)
+    return animations
+
+def curve_keys(fbxScene):
+    keys = []
+    nodes = [fbxScene.root]
+    while nodes:
+        node = nodes.pop()
+        for property in (node.LclTranslation, node.LclRotation):
+            keys += [(curve.frames, curve.values) for curve in property.curves.values()]
+        nodes += node.children
+    return keys
+
+def add_animations(fbxScene, animations):
+    # As in app.exportToFbx, the node index is built once per export
+    nodeIndex = app.getNodeIndex(fbxScene)
+    for animation in animations:
+        app.addAnimation(fbxScene, animation, nodeIndex)
+
+def legacy_add_animations(fbxScene, animations):
+    for animation in animations:
+        legacy_add_animation(fbxScene, animation)
+
+def run(count = 10, frameCount = 100):
+    random = np.random.default_rng(0)
+    animations = make_animations(random, count, frameCount)
+    results = {}
+    keys = {}
+
+    for label, addAnimations in (('before', legacy_add_animations), ('after', add_animations)):
+        fbxScene = make_scene(np.random.default_rng(1))
+        calls.clear()
+        start = time.perf_counter()
+        addAnimations(fbxScene, animations)
+        results[label] = (time.perf_counter() - start, dict(calls))
+        keys[label] = curve_keys(fbxScene)
+
+    if keys['before'] != keys['after']:
+        raise Exception("Exported curves differ")
+    return results
+
+if __name__ == "__main__":
+    results = run()
+    before, after = results['before'], results['after']
+    for name in sorted(set(before[1]) | set(after[1])):
+        print(f'{name}: {before[1].get(name, 0)} -> {after[1].get(name, 0)}')
+    beforeCalls, afterCalls = sum(before[1].values()), sum(after[1].values())
+    print(f'total calls: {beforeCalls} -> {afterCalls} ({beforeCalls / afterCalls:.1f}x)')
+    print(f'time: {before[0] * 1000:.0f} ms -> {after[0] * 1000:.0f} ms')
@@ -0,0 +1,200 @@
+"""
+Differential check of the ANM/SPA decoders and encoders over a corpus.
+Each file is decoded with the scalar read as reference and compared with
+every other engine (readVectorized, readBuffer, memory mapped and lazy
+reads) on frames, values and rotation axis order/flag nibbles. The
+reference data is then loaded and encoded again: write must match
+writeReference byte for byte. The rotation error of getRotation/getDegRotation
+is reported on its own, on reference rotations moved off the code grid by
+up to one step, and after decoding the written file (which also shows
+keys changed by load, or axis order changes).
+
+Run from the repository root:
+python -m benchmarks.parity corpus_folder [--jobs=N] [--json=results.json]
+Exits with 1 when an engine or write differs from the reference.
+"""
+import copy, glob, io, json, os, sys, time, zlib
+import numpy as np
+import app
+from core.ANM import ANM
+from core.SPA import SPA
+
+formats = {'.anm': ANM, '.spa': SPA}
+
+def read_stream(cls, name, buffer, lazy = False):
+    animation = cls(name)
+    animation.read(io.BytesIO(buffer), lazy)
+    return animation
+
+def read_vectorized(cls, name, buffer):
+    animation = cls(name)
+    animation.readVectorized(io.BytesIO(buffer))
+    return animation
+
+def get_engines(cls, path, buffer):
+    name = os.path.basename(path)
+    return {
+        'readVectorized': lambda: read_vectorized(cls, name, buffer),
+        'readBuffer': lambda: cls.fromBuffer(name, buffer),
+        'mmap': lambda: cls.fromPath(path),
+        'lazy': lambda: cls.fromPath(path, lazy=True),
+        'lazyStream': lambda: read_stream(cls, name, buffer, True),
+    }
+
+def same_value(a, b):
+    return a == b or (a != a and b != b)
+
+def compare_key(reference, value):
+    """
+    Mismatch kind of a key, None when identical.
+    Swapped axes or a different SPA flag byte point at the axis order nibble
+    """
+    if len(reference) == len(value) and all(map(same_value, reference, value)):
+        return None
+    if len(reference) != len(value) or reference[3:] != value[3:] or \
+        sorted(reference[:3]) == sorted(value[:3]):
+        return 'nibbles'
+    return 'values'
+
+def compare_data(reference, data):
+    counts = {'frames': 0, 'values': 0, 'nibbles': 0}
+    if list(reference) != list(data):
+        counts['frames'] += 1
+    for boneName, boneData in reference.items():
+        otherBoneData = data[boneName] if boneName in data else {}
+        # Frame order matters, app.cleanData compares keys in dict order
+        if list(boneData) != list(otherBoneData) or \
+            any(list(boneData[frame]) != list(otherBoneData[frame]) for frame in boneData if frame in otherBoneData):
+            counts['frames'] += 1
+        for frame, keys in boneData.items():
+            for dataType, value in keys.items():
+                if frame in otherBoneData and dataType in otherBoneData[frame]:
+                    kind = compare_key(value, otherBoneData[frame][dataType])
+                    if kind != None:
+                        counts[kind] += 1
+    return counts
+
+def get_frame_count(animation):
+    return animation.frameCount if isinstance(animation, ANM) else animation.keyframeCount
+
+def check_encoding(cls, name, reference, buffer):
+    """
+    Encodes the reference data again with write and writeReference
+    """
+    animation = cls(name)
+    animation.load(copy.deepcopy(reference.data), get_frame_count(reference))
+    encoded = animation.encode()
+    stream = io.BytesIO()
+    animation.writeReference(stream)
+
+    # Quantization alone: decoded rotations are already on the code grid,
+    # they are moved off it by up to one step (the same jitter on every run)
+    rotations = np.array([keys['rotation'][:3] for boneData in reference.data.values() \
+        for keys in boneData.values() if 'rotation' in keys], dtype=np.float64).reshape(-1)
+    step = animation.getDegRotation(1) - animation.getDegRotation(0)
+    rotations += np.random.default_rng(zlib.crc32(name.encode('utf-8'))).uniform(-step, step, len(rotations))
+    maxQuantizationError = max((abs(animation.getDegRotation(round(animation.getRotation(value))) - value) \
+        for value in rotations.tolist()), default=0.0)
+
+    # Rotations of the keys kept by load, decoded from the written file
+    decoded = read_stream(cls, name, encoded).data
+    maxRoundTripError = 0.0
+    for boneName, boneData in reference.data.items():
+        for frame, keys in boneData.items():
+            if 'rotation' in keys and frame in decoded.get(boneName, {}) and 'rotation' in decoded[boneName][frame]:
+                maxRoundTripError = max(maxRoundTripError, *(abs(a - b) for a, b in \
+                    zip(keys['rotation'][:3], decoded[boneName][frame]['rotation'][:3])))
+
+    return {
+        'writerParity': encoded == stream.getvalue(),
+        'roundTripIdentical': encoded == bytes(buffer),
+        'maxQuantizationError': maxQuantizationError,
+        'maxRoundTripError': maxRoundTripError
+    }
+
+def check_file(path):
+    cls = formats[os.path.splitext(path)[1].lower()]
+    name = os.path.basename(path)
+    with open(path, 'rb') as stream:
+        buffer = stream.read()
+    result = {'path': path, 'format': cls.__name__}
+    start = time.perf_counter()
+    try:
+        reference = read_stream(cls, name, buffer)
+    except Exception as error:
+        result['error'] = f'reference: {error!r}'
+        return result
+
+    result['keys'] = sum(len(keys) for boneData in reference.data.values() for keys in boneData.values())
+    result['engines'] = {}
+    for engine, read in get_engines(cls, path, buffer).items():
+        try:
+            result['engines'][engine] = compare_data(reference.data, read().data)
+        except Exception as error:
+            result['engines'][engine] = {'error': repr(error)}
+    try:
+        result.update(check_encoding(cls, name, reference, buffer))
+    except Exception as error:
+        result['writerParity'] = False
+        result['error'] = f'encoding: {error!r}'
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+def is_failure(result):
+    return 'error' in result or not result['writerParity'] or \
+        any('error' in counts or any(counts.values()) for counts in result['engines'].values())
+
+def get_paths(path):
+    if os.path.isfile(path):
+        return [path]
+    paths = glob.glob(os.path.join(glob.escape(path), '**', '*'), recursive=True)
+    return sorted((path for path in paths if os.path.splitext(path)[1].lower() in formats), key=app.ut.natural_keys)
+
+def run(path, jobs = 1):
+    return app.mapJobs(check_file, [(path,) for path in get_paths(path)], jobs)
+
+def print_summary(results, seconds):
+    keys = sum(result.get('keys', 0) for result in results)
+    print(f'{len(results)} files, {keys} keys in {seconds:.1f} s ({len(results) / seconds:.0f} files/s)')
+    engines = {}
+    for result in results:
+        for engine, counts in result.get('engines', {}).items():
+            total = engines.setdefault(engine, {'files': 0, 'frames': 0, 'values': 0, 'nibbles': 0, 'errors': 0})
+            total['files'] += 1
+            if 'error' in counts:
+                total['errors'] += 1
+            else:
+                for kind, count in counts.items():
+                    total[kind] += count
+    for engine, total in engines.items():
+        print(f"{engine}: {total['files']} files, {total['frames']} frame, {total['values']} value and "
+            f"{total['nibbles']} nibble mismatches, {total['errors']} errors")
+
+    encoded = [result for result in results if 'writerParity' in result]
+    print(f"write == writeReference: {sum(result['writerParity'] for result in encoded)}/{len(encoded)}")
+    print(f"write == input file: {sum(result.get('roundTripIdentical', False) for result in encoded)}/{len(encoded)}")
+    for format in sorted({result['format'] for result in encoded}):
+        formatResults = [result for result in encoded if result['format'] == format and 'maxRoundTripError' in result]
+        if formatResults:
+            animation = formats[f'.{format.lower()}'](format)
+            halfStep = (animation.getDegRotation(1) - animation.getDegRotation(0)) / 2
+            print(f"{format} max rotation error (half step {halfStep:.3g}): "
+                f"{max(result['maxQuantizationError'] for result in formatResults):.3g} "
+                f"degrees from quantization, {max(result['maxRoundTripError'] for result in formatResults):.3g} "
+                f"degrees after write and read")
+    for result in results:
+        if is_failure(result):
+            print(f"FAILED {result['path']}: {result.get('error', '')}")
+
+if __name__ == "__main__":
+    args, options = app.parseOptions(sys.argv[1:])
+    if len(args) != 1:
+        print(__doc__)
+        sys.exit(2)
+    start = time.perf_counter()
+    results = run(args[0], int(options.get('jobs', 1)))
+    print_summary(results, max(time.perf_counter() - start, 1e-9))
+    if 'json' in options:
+        with open(options['json'], 'w', encoding='utf-8') as stream:
+            json.dump(results, stream, indent=1)
+    sys.exit(1 if any(map(is_failure, results)) else 0)
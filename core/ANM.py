@@ -1,10 +1,22 @@
 import struct
+import os
+import numpy as np
 import core.utils as ut
+import core.profiling as profiling
+from core.Track import Track, dataToTracks, tracksToData, isTrackData, loadTracks
+from core.RotationCodec import RotationCodec
 
 class ANM:
     dataOffset = ut.b2i(b'\x94')
     commandOffset = ut.b2i(b'\x90')
 
+    # Translation keyframe layout: XYZ floats, frame number, packed rotation
+    translationDtype = np.dtype([('translation', '<f4', 3), ('frame', '<i4'), ('rotation', '<u8')])
+    # Axis order of the 3 packed rotations, indexed by the high nibble
+    rotationAxisOrders = [[0, 1, 2], [1, 0, 2], [1, 2, 0], [2, 1, 0]]
+    # Axis order nibbles past 3 are read as 3
+    rotationCodec = RotationCodec(0xfffff, 180, rotationAxisOrders + rotationAxisOrders[3:] * 12)
+
     boneList = [
         "BONE_NULL", "BONE_PRG_RESERVE", "BONE_RESERVE", "BONE_WAIST", "BONE_TAIL1", "BONE_TAIL2", "BONE_TAIL3", "BONE_TAIL4", 
         "BONE_HIP_R", "BONE_THIGH_R", "BONE_SHANK_R", "BONE_HEEL_R",
@@ -20,8 +32,25 @@ class ANM:
         "BONE_HAIR", "BONE_ALPHA", "BONE_THROW", "BONE_CAMERA", "BONE_UTILITY"
     ]
     
+    tracks = None
+    _data = None
+
     def __init__(self, name):
         self.name = name
+
+    @property
+    def data(self):
+        """
+        Dict layout of the animation, built from tracks on first access
+        """
+        if self._data is None and self.tracks is not None:
+            self._data = tracksToData(self.tracks)
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        self._data = data
+        self.tracks = None
     
     @ut.keep_cursor_pos
     def readCommandBytes(self, stream):
@@ -91,14 +120,128 @@ class ANM:
 
         return (rotationXFloat, rotationYFloat, rotationZFloat)
 
-    def read(self, stream):
-        # Reading ANM Header
+    @ut.keep_cursor_pos
+    def readBoneDataVectorized(self, stream, offset):
+        stream.seek(offset)
+        blockHeader = stream.read(4)
+        dataType, frameCount = struct.unpack("<hh", blockHeader)
+        dataSize = 10 if dataType == 1 else 24
+        return self.decodeBoneData(blockHeader + stream.read(max(frameCount, 0) * dataSize), 0)
+
+    def decodeBoneData(self, buffer, offset):
+        dataType, frameCount = struct.unpack_from("<hh", buffer, offset)
+        frameCount = max(frameCount, 0)
+        offset += 4
+
+        if dataType == 1:
+            rotationWords = np.frombuffer(buffer, '<u8', frameCount, offset)
+            frames = np.frombuffer(buffer, '<i2', frameCount, offset + frameCount * 8)
+            return Track(rotationFrames=frames, rotations=self.rotationCodec.decodeRotations(rotationWords))
+
+        keyframes = np.frombuffer(buffer, self.translationDtype, frameCount, offset)
+        # Translations are stored as ZYX
+        return Track(keyframes['frame'], keyframes['translation'][:, ::-1],
+            keyframes['frame'], self.rotationCodec.decodeRotations(keyframes['rotation']))
+
+    def readHeader(self, stream):
         self.unknown0x00 = ut.b2i(stream.read(1))
         self.commandsCount = ut.b2i(stream.read(1))
         if self.commandsCount > 0:
             self.readCommandBytes(stream)
         self.frameCount = struct.unpack("<h", stream.read(2))[0]
         self.unknown0x04 = ut.b2i(stream.read(2))
+
+    @classmethod
+    def readInfo(cls, buffer, offset = 0):
+        """
+        Frame count, animated bones and byte size of the ANM at offset from its
+        header and bone block headers only, None when these are not valid
+        """
+        headerSize = 6 + 2 * len(cls.boneList)
+        if offset < 0 or offset + headerSize > len(buffer):
+            return None
+        frameCount = struct.unpack_from("<h", buffer, offset + 2)[0]
+        boneOffsets = struct.unpack_from(f"<{len(cls.boneList)}h", buffer, offset + 6)
+        if frameCount < 0:
+            return None
+
+        commandsCount = buffer[offset + 1]
+        size = max(headerSize, cls.commandOffset + commandsCount * 16) if commandsCount > 0 else headerSize
+        if offset + size > len(buffer):
+            return None
+
+        bones = []
+        for boneName, boneOffset in zip(cls.boneList, boneOffsets):
+            # Same offsets as the readers, blocks can be stored in any order
+            if boneOffset <= 0:
+                continue
+            blockOffset = boneOffset * 4
+            if offset + blockOffset + 4 > len(buffer):
+                return None
+            dataType, keyCount = struct.unpack_from("<hh", buffer, offset + blockOffset)
+            if dataType not in (0, 1) or keyCount < 0:
+                return None
+            size = max(size, blockOffset + 4 + keyCount * (10 if dataType == 1 else 24))
+            if offset + size > len(buffer):
+                return None
+            if keyCount > 0:
+                bones.append(boneName)
+
+        return {'frameCount': frameCount, 'bones': bones, 'size': size}
+
+    def readVectorized(self, stream, lazy = False):
+        """
+        Same output as read, each bone block is decoded at once with NumPy
+        into tracks, data is only built when accessed.
+        When lazy, only the header and bone offsets are read and each track
+        is decoded on first access, stream must stay open until then
+        """
+        self.readHeader(stream)
+        offsets = struct.unpack(f"<{len(self.boneList)}h", stream.read(2 * len(self.boneList)))
+        self.readTracks(offsets, lambda offset: self.readBoneDataVectorized(stream, offset), lazy)
+
+    def readBuffer(self, buffer, lazy = False):
+        """
+        Same as readVectorized, parsing a bytes-like object (bytes, mmap,
+        memoryview) with offset arithmetic instead of a stream
+        """
+        self.unknown0x00, self.commandsCount = struct.unpack_from("<BB", buffer, 0)
+        if self.commandsCount > 0:
+            commandsEnd = self.commandOffset + self.commandsCount * 16
+            self.commandsBytes = bytes(buffer[self.commandOffset:commandsEnd])
+        self.frameCount = struct.unpack_from("<h", buffer, 2)[0]
+        self.unknown0x04 = struct.unpack_from(">H", buffer, 4)[0]
+
+        offsets = struct.unpack_from(f"<{len(self.boneList)}h", buffer, 6)
+        self.readTracks(offsets, lambda offset: self.decodeBoneData(buffer, offset), lazy)
+
+    def readTracks(self, offsets, decode, lazy = False):
+        """
+        Tracks from the bone offset table, decode gives the track of a bone block offset
+        """
+        self.data = None
+        self.tracks = loadTracks(dict(zip(self.boneList, offsets)), \
+            lambda offset: decode(offset * 4) if offset > 0 else Track(), lazy)
+
+    @classmethod
+    def fromBuffer(cls, name, buffer, lazy = False):
+        anm = cls(name)
+        anm.readBuffer(buffer, lazy)
+        return anm
+
+    @classmethod
+    def fromPath(cls, path, mmap = True, lazy = False):
+        buffer = ut.map_file(path) if mmap else ut.read_file(path)
+        return cls.fromBuffer(os.path.basename(path), buffer, lazy)
+
+    def read(self, stream, lazy = False):
+        # Bones are decoded on first access to data or tracks
+        if lazy:
+            self.readVectorized(stream, True)
+            return
+
+        # Reading ANM Header
+        self.readHeader(stream)
         self.data = {}
 
         for boneName in self.boneList:
@@ -108,56 +251,60 @@ class ANM:
                 self.readBoneData(stream, offset, boneName)
 
     def load(self, data, frameCount = 0):
-        self.data = data
+        # Dict layout of legacy callers
+        if not isTrackData(data):
+            data = dataToTracks(data)
         self.unknown0x00 = ut.b2i(b'\x61')
         self.commandsCount = 0
         self.frameCount = frameCount
         self.unknown0x04 = 0
 
         # Reorganizing data
-        self.data = {}
+        tracks = {}
         for boneName in self.boneList:
-            if boneName not in data:
-                data[boneName] = {}
-            if boneName not in self.data:
-                self.data[boneName] = {}
-            
-            lastTranslation = (0,0,0,1)
-            lastRotation = (0,0,0)
-
-            for frame in data[boneName]:
-                # Removing all translations except for RESERVE BONE
-                if boneName not in ["BONE_RESERVE", "BONE_THROW", "BONE_CAMERA", "BONE_UTILITY"] \
-                    and 'translation' in data[boneName][frame]:
-                    del data[boneName][frame]['translation']
-                if 'translation' in data[boneName][frame]:
-                    if 'translation' not in self.data[boneName]:
-                        self.data[boneName]['translation'] = {}
-                    lastTranslation = data[boneName][frame]['translation']
-                    self.data[boneName]['translation'][frame] = lastTranslation
-                if 'rotation' in data[boneName][frame]:
-                    if 'rotation' not in self.data[boneName]:
-                        self.data[boneName]['rotation'] = {}
-                    lastRotation = data[boneName][frame]['rotation']
-                    self.data[boneName]['rotation'][frame] = lastRotation
-            
-            if len(self.data[boneName]) == 1:
-                if lastTranslation != (0,0,0,1):
-                    self.data[boneName]['translation'][self.frameCount] = lastTranslation
-                if lastRotation != (0,0,0):
-                    self.data[boneName]['rotation'][self.frameCount] = lastRotation
-
-    def getDataSize(self, boneName):
+            track = data[boneName] if boneName in data else Track()
+            translationFrames, translations = track.translationFrames, track.translations
+            rotationFrames, rotations = track.rotationFrames, track.rotations[:, :3]
+
+            # Removing all translations except for RESERVE BONE
+            if boneName not in ["BONE_RESERVE", "BONE_THROW", "BONE_CAMERA", "BONE_UTILITY"]:
+                translationFrames, translations = translationFrames[:0], translations[:0]
+
+            # A single data type is keyed up to the last frame
+            if len(translationFrames) and not len(rotationFrames) and \
+                tuple(translations[-1].tolist()) != (0,0,0,1):
+                translationFrames, translations = self.holdLastKey(translationFrames, translations, frameCount)
+            if len(rotationFrames) and not len(translationFrames) and \
+                tuple(rotations[-1].tolist()) != (0,0,0):
+                rotationFrames, rotations = self.holdLastKey(rotationFrames, rotations, frameCount)
+
+            tracks[boneName] = Track(translationFrames, translations, rotationFrames, rotations)
+        self.data = None
+        self.tracks = tracks
+
+    @staticmethod
+    def holdLastKey(frames, values, frame):
+        """
+        Keys frame with the last value, replacing the value of a key at frame
+        """
+        isFrame = frames == frame
+        if isFrame.any():
+            values = values.copy()
+            values[isFrame] = values[-1]
+            return frames, values
+        return np.append(frames, frame), np.concatenate([values, values[-1:]])
+
+    def getDataSize(self, boneData):
         dataSize = 4 # include dataType and frameCount
         translationSize = 0
         rotationSize = 0
 
-        for dataType in self.data[boneName]:
+        for dataType in boneData:
             if dataType == 'translation':
-                for frame in self.data[boneName][dataType]:
+                for frame in boneData[dataType]:
                     translationSize += 24
-            elif dataType == 'rotation' and 'translation' not in self.data[boneName]:
-                for frame in self.data[boneName][dataType]:
+            elif dataType == 'rotation' and 'translation' not in boneData:
+                for frame in boneData[dataType]:
                     rotationSize += 10
 
         dataSize += translationSize + rotationSize
@@ -165,6 +312,79 @@ class ANM:
         return dataSize
 
     def write(self, stream):
+        stream.write(self.encode())
+
+    def encode(self):
+        """
+        Same output as writeReference, offsets and payload are computed in a
+        single traversal and the file is assembled in memory
+        """
+        boneOffsets = []
+        blocks = []
+        dataOffset = self.dataOffset
+
+        for boneName in self.boneList:
+            if len(self.tracks[boneName]) == 0:
+                boneOffsets.append(0)
+                continue
+            block = self.encodeBoneData(self.tracks[boneName])
+            padding = bytes(ut.add_padding(len(block), 4) - len(block))
+            boneOffsets.append(dataOffset // 0x4)
+            blocks += [block, padding]
+            dataOffset += len(block) + len(padding)
+            profiling.count('bytesWritten', len(block), self.name, boneName)
+
+        header = struct.pack(f"<bbhh{len(self.boneList)}h", self.unknown0x00, \
+            self.commandsCount, self.frameCount, self.unknown0x04, *boneOffsets)
+        if blocks:
+            # Last block is not padded
+            blocks.pop()
+            header += bytes(self.dataOffset - len(header))
+
+        encoded = b''.join([header, *blocks])
+        # Header and padding between blocks
+        profiling.count('bytesWritten', len(header) + sum(map(len, blocks[1::2])), self.name)
+        return encoded
+
+    def encodeBoneData(self, track):
+        if len(track.translationFrames):
+            frames = track.translationFrames
+            keyframes = np.zeros(len(frames), self.translationDtype)
+            keyframes['translation'] = track.translations[:, :3]
+            keyframes['frame'] = frames
+
+            # Frames without rotation get a default packed rotation, the
+            # last rotation key of a frame is used
+            rotationIndex = {frame: index for index, frame in enumerate(track.rotationFrames.tolist())}
+            indices = np.array([rotationIndex.get(frame, -1) for frame in frames.tolist()], dtype=np.int64)
+            rotationWords = np.full(len(frames), 0x37FFFF7FFFF7FFFF, dtype=np.uint64)
+            hasRotation = indices >= 0
+            if hasRotation.any():
+                rotationWords[hasRotation] = self.rotationCodec.encodeRotations(track.rotations[indices[hasRotation]])
+            keyframes['rotation'] = rotationWords
+
+            return struct.pack("<hh", 0, len(frames)) + keyframes.tobytes()
+
+        frames = track.rotationFrames
+        return struct.pack("<hh", 1, len(frames)) + \
+            self.rotationCodec.encodeRotations(track.rotations).astype('<u8').tobytes() + \
+            frames.astype('<i2').tobytes()
+
+    def writeReference(self, stream):
+        """
+        Original seek based writer, kept as reference for encode
+        """
+        # Layout of the original writer: data[bone][dataType][frame]
+        data = {}
+        for boneName, track in self.tracks.items():
+            data[boneName] = {}
+            if len(track.translationFrames):
+                data[boneName]['translation'] = dict(zip(track.translationFrames.tolist(), \
+                    map(tuple, track.translations.tolist())))
+            if len(track.rotationFrames):
+                data[boneName]['rotation'] = dict(zip(track.rotationFrames.tolist(), \
+                    map(tuple, track.rotations.tolist())))
+
         # Writing ANM Header
         stream.write(struct.pack("<b", self.unknown0x00))
         stream.write(struct.pack("<b", self.commandsCount))
@@ -175,36 +395,36 @@ class ANM:
         dataOffset = self.dataOffset
         for boneName in self.boneList:
 
-            if self.data[boneName] == {}:
+            if data[boneName] == {}:
                 stream.write(bytes(2))
             else:
                 stream.write(struct.pack("<h", int(dataOffset / 0x4)))
-                dataOffset += self.getDataSize(boneName)
+                dataOffset += self.getDataSize(data[boneName])
                 dataOffset = ut.add_padding(dataOffset, 4)
 
         stream.seek(self.dataOffset)
         for boneName in self.boneList:
-            if self.data[boneName] != {}:
-                for dataType in self.data[boneName]:
-                    frameCount = len(self.data[boneName][dataType])
+            if data[boneName] != {}:
+                for dataType in data[boneName]:
+                    frameCount = len(data[boneName][dataType])
 
                     if dataType == 'translation':
                         stream.write(struct.pack("<h", 0))
                         stream.write(struct.pack("<h", frameCount))
-                        for frame in self.data[boneName][dataType]:
-                            translationData = self.data[boneName][dataType][frame]
+                        for frame in data[boneName][dataType]:
+                            translationData = data[boneName][dataType][frame]
                             translationData = struct.pack("<fffi", *translationData[:3], frame)
                             stream.write(translationData)
-                            if ('rotation' in self.data[boneName]) and (frame in self.data[boneName]['rotation']):
-                                stream.write(self.getRotationBytes(self.data[boneName]['rotation'][frame]))
+                            if ('rotation' in data[boneName]) and (frame in data[boneName]['rotation']):
+                                stream.write(self.getRotationBytes(data[boneName]['rotation'][frame]))
                             else:
                                 stream.write(struct.pack("<q", 0x37FFFF7FFFF7FFFF))
-                    elif dataType == 'rotation' and 'translation' not in self.data[boneName]:
+                    elif dataType == 'rotation' and 'translation' not in data[boneName]:
                         stream.write(struct.pack("<h", 1))
                         stream.write(struct.pack("<h", frameCount))
-                        for frame in self.data[boneName][dataType]:
-                            stream.write(self.getRotationBytes(self.data[boneName][dataType][frame]))
-                        for frame in self.data[boneName][dataType]:
+                        for frame in data[boneName][dataType]:
+                            stream.write(self.getRotationBytes(data[boneName][dataType][frame]))
+                        for frame in data[boneName][dataType]:
                             stream.write(struct.pack("<h", frame))
                     
                     paddedPosition = ut.add_padding(stream.tell(), 4)
@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+import tempfile
+import zipfile
+import numpy as np
+import core.utils as ut
+from core.StringTable import StringTable
+from core.Track import Track
+
+class Cache:
+    """
+    On-disk cache of decoded animations, one .npz file per animation keyed
+    by a hash of the file content and of the decoder version.
+    Least recently used entries are evicted past maxSize bytes by evict,
+    which scans the whole folder and is meant to be called once per run
+    """
+    # Part of every key: decoder output or entry layout changes need a new version
+    version = 2
+    trackFields = ('translationFrames', 'translations', 'rotationFrames', 'rotations')
+    # Folder of the default poses parsed when no cache folder is given
+    defaultPath = os.path.join(tempfile.gettempdir(), 'anim_converter')
+
+    def __init__(self, path, maxSize = 1024 * 1024 * 1024):
+        self.path = path
+        self.maxSize = maxSize
+        os.makedirs(self.path, exist_ok=True)
+
+    def getKey(self, buffer, className):
+        hash = hashlib.sha1(f'{className}:{self.version}:'.encode('utf-8'))
+        hash.update(buffer)
+        return hash.hexdigest()
+
+    def getEntryPath(self, key):
+        return os.path.join(self.path, f'{key}.npz')
+
+    def load(self, path, animationClass):
+        """
+        Returns the decoded animation, from cache if its content was seen before
+        """
+        buffer = ut.map_file(path)
+        name = os.path.basename(path)
+        key = self.getKey(buffer, animationClass.__name__)
+
+        animation = self.get(key, name, animationClass)
+        if animation is None:
+            animation = animationClass.fromBuffer(name, buffer)
+            self.put(key, animation)
+        return animation
+
+    def get(self, key, name, animationClass):
+        entryPath = self.getEntryPath(key)
+        try:
+            with np.load(entryPath, allow_pickle=False) as entry:
+                animation = animationClass(name)
+                for attribute, value in json.loads(str(entry['header'])).items():
+                    setattr(animation, attribute, value)
+                for field in entry.files:
+                    if field.startswith('bytes/'):
+                        setattr(animation, field.split('/')[1], entry[field].tobytes())
+                    elif field.startswith('strings/') and field.endswith('/offsets'):
+                        attribute = field.split('/')[1]
+                        stringTable = StringTable()
+                        stringTable.start_offset = int(entry[f'strings/{attribute}/start'])
+                        stringTable.set_content(zip(entry[field].tolist(), \
+                            entry[f'strings/{attribute}/values'].tolist()))
+                        setattr(animation, attribute, stringTable)
+
+                tracks = {}
+                for i, boneName in enumerate(entry['boneNames'].tolist()):
+                    track = Track()
+                    for field in self.trackFields:
+                        setattr(track, field, entry[f'{i}/{field}'])
+                    if f'{i}/rotationFlags' in entry:
+                        track.rotationFlags = entry[f'{i}/rotationFlags']
+                    tracks[boneName] = track
+                animation.tracks = tracks
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+            # Missing, outdated or corrupt entries are misses, and written again
+            return None
+
+        # Marking the entry as recently used
+        os.utime(entryPath)
+        return animation
+
+    def put(self, key, animation):
+        header = {attribute: value for attribute, value in vars(animation).items() \
+            if isinstance(value, (int, float)) and not isinstance(value, bool)}
+        arrays = {
+            'header': np.array(json.dumps(header)),
+            'boneNames': np.array(list(animation.tracks.keys()), dtype=str)
+        }
+        # Raw header bytes (ANM commands) and string tables (SPA names)
+        for attribute, value in vars(animation).items():
+            if isinstance(value, bytes):
+                arrays[f'bytes/{attribute}'] = np.frombuffer(value, dtype=np.uint8)
+            elif isinstance(value, StringTable):
+                arrays[f'strings/{attribute}/start'] = np.array(value.start_offset)
+                arrays[f'strings/{attribute}/offsets'] = np.array(list(value.content.keys()), dtype=np.int64)
+                arrays[f'strings/{attribute}/values'] = np.array(list(value.content.values()), dtype=bytes)
+        for i, track in enumerate(animation.tracks.values()):
+            for field in self.trackFields:
+                arrays[f'{i}/{field}'] = getattr(track, field)
+            if track.rotationFlags is not None:
+                arrays[f'{i}/rotationFlags'] = track.rotationFlags
+
+        self.save(key, arrays)
+
+    def save(self, key, arrays):
+        ut.write_file_atomic(self.getEntryPath(key), lambda stream: np.savez(stream, **arrays))
+
+    def getDefaultPoseKey(self, path, backend):
+        key = f'pose:{self.version}:{os.path.abspath(path)}:{os.path.getmtime(path)}:{backend}'
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def loadDefaultPose(self, path, backend, parse):
+        """
+        Returns the animation data of the default pose FBX file at path,
+        parse(path) is only called when the file changed since it was cached
+        """
+        key = self.getDefaultPoseKey(path, backend)
+        entryPath = self.getEntryPath(key)
+        try:
+            with np.load(entryPath, allow_pickle=False) as entry:
+                content = json.loads(str(entry['pose']))
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+            animData = parse(path)
+            try:
+                self.save(key, {'pose': np.array(json.dumps(animData))})
+            except OSError:
+                # The pose is parsed again on the next run
+                pass
+            return animData
+
+        os.utime(entryPath)
+        # JSON keeps floats and key order, frames and tuples are restored
+        return {animName: {boneName: {int(frame): {dataType: tuple(value) for dataType, value in keys.items()} \
+            for frame, keys in boneData.items()} for boneName, boneData in boneDatas.items()} \
+            for animName, boneDatas in content.items()}
+
+    def evict(self):
+        entries = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith('.npz'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        totalSize = sum(size for mtime, size, path in entries)
+        for mtime, size, path in sorted(entries):
+            if totalSize <= self.maxSize:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            totalSize -= size
@@ -0,0 +1,661 @@
+import os
+import re
+import struct
+import zlib
+import numpy as np
+import core.utils as ut
+
+class FBXNode:
+    """
+    FBX record: name, typed property values and child records
+    """
+    __slots__ = ('name', 'properties', 'types', 'children')
+
+    def __init__(self, name, properties = None, types = '', children = None):
+        self.name = name
+        self.properties = properties if properties != None else []
+        # One FBX type code per property (see FBX.scalarTypes / FBX.arrayTypes)
+        self.types = types
+        self.children = children if children != None else []
+
+    def find(self, name):
+        for child in self.children:
+            if child.name == name:
+                return child
+        return None
+
+    def findAll(self, name):
+        return [child for child in self.children if child.name == name]
+
+    def getProperties70(self):
+        """
+        Properties70 values by property name
+        """
+        properties = {}
+        propertiesNode = self.find('Properties70')
+        if propertiesNode != None:
+            for property in propertiesNode.findAll('P'):
+                properties[property.properties[0]] = property.properties[4:]
+        return properties
+
+    def __repr__(self):
+        return f'{self.name}: {self.properties} ({len(self.children)} children)'
+
+class FBX:
+    """
+    Pure Python reader for the subset of FBX needed by animations: skeleton
+    models with their default transform, animation stacks, layers and curves.
+    Binary (zlib arrays decoded with NumPy) and ASCII files are supported.
+    """
+    binaryMagic = b'Kaydara FBX Binary  \x00\x1a\x00'
+    # FbxTime units per second
+    timeUnit = 46186158000
+    # PAL (25 fps) frame duration, the time mode used by app.py
+    frameDuration = timeUnit // 25
+
+    scalarTypes = {'Y': '<h', 'C': '<B', 'I': '<i', 'F': '<f', 'D': '<d', 'L': '<q'}
+    arrayTypes = {'f': '<f4', 'd': '<f8', 'l': '<i8', 'i': '<i4', 'b': '<u1'}
+    skeletonTypes = ('LimbNode', 'Limb', 'Root')
+
+    # Binary footer as written by Blender, accepted by the FBX SDK
+    binaryFooterId = b'\xfa\xbc\xab\x09\xd0\xc8\xd4\x66\xb1\x76\xfb\x83\x1c\xf7\x26\x7e'
+    binaryFooterMagic = b'\xf8\x5a\x8c\x6a\xde\xf5\xd9\x7e\xec\xe9\x0c\xe3\x75\x8f\x29\x0b'
+    # Records followed by a null record even without children
+    nullRecordNodes = ('AnimationStack', 'AnimationLayer')
+    # Arrays larger than this (in bytes) are zlib compressed
+    compressionThreshold = 128
+
+    # FbxAnimCurveDef::eInterpolationConstant, as keyed by app.addAnimation
+    keyAttrFlags = 0x00000002
+    # FbxAnimCurveDef interpolation flags of KeyAttrFlags
+    interpolationConstant = 0x00000002
+    interpolationCubic = 0x00000008
+    constantNext = 0x00000100
+    keyAttrDataFloat = (0.0, 0.0, 9.419963346924634e-30, 0.0)
+
+    # Only these records are parsed when reading animations, others are skipped
+    animationSections = {
+        'GlobalSettings': None,
+        'Objects': {'Model': None, 'NodeAttribute': None, 'AnimationStack': None,
+            'AnimationLayer': None, 'AnimationCurveNode': None, 'AnimationCurve': None},
+        'Connections': None,
+        'Takes': None
+    }
+
+    asciiToken = re.compile(r'''\s*(?:
+        ;[^\n]*
+        |(?P<name>[A-Za-z_][\w|]*)[ \t]*:
+        |"(?P<string>[^"]*)"
+        |\*(?P<length>\d+)
+        |(?P<number>[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)
+        |(?P<symbol>[,{}])
+        |(?P<word>[A-Za-z_][\w.#-]*)
+        )''', re.VERBOSE)
+    asciiArrayTypes = {'KeyTime': 'l', 'KeyValueFloat': 'f', 'KeyAttrDataFloat': 'f',
+        'KeyAttrFlags': 'i', 'KeyAttrRefCount': 'i'}
+
+    def __init__(self, name):
+        self.name = name
+        self.version = 7400
+        self.nodes = []
+
+    @classmethod
+    def fromPath(cls, path, full = False):
+        """
+        full: keeps every record (needed to write the file back),
+        otherwise only animation related records are parsed
+        """
+        document = cls(os.path.basename(path))
+        document.readBuffer(ut.map_file(path), full)
+        return document
+
+    def readBuffer(self, buffer, full = False):
+        sections = None if full else self.animationSections
+        if bytes(buffer[:len(self.binaryMagic)]) == self.binaryMagic:
+            self.version = struct.unpack_from('<I', buffer, len(self.binaryMagic))[0]
+            self.nodes = self.readBinaryNodes(buffer, len(self.binaryMagic) + 4, len(buffer), sections)
+        else:
+            self.readASCII(bytes(buffer).decode('utf-8', 'surrogateescape'), sections)
+        self.index()
+
+    def find(self, name):
+        for node in self.nodes:
+            if node.name == name:
+                return node
+        return None
+
+    # Binary format
+
+    def getNodeHeaderFormat(self):
+        return '<QQQB' if self.version >= 7500 else '<IIIB'
+
+    def readBinaryNodes(self, buffer, offset, endOffset, sections = None):
+        """
+        Reads sibling records until a null record, unwanted records are skipped
+        """
+        nodes = []
+        headerFormat = self.getNodeHeaderFormat()
+        headerSize = struct.calcsize(headerFormat)
+
+        while offset + headerSize <= endOffset:
+            nodeEnd, propertyCount, propertyLength, nameLength = \
+                struct.unpack_from(headerFormat, buffer, offset)
+            if nodeEnd == 0:
+                break
+            offset += headerSize
+            name = bytes(buffer[offset:offset + nameLength]).decode('utf-8', 'surrogateescape')
+            offset += nameLength
+
+            if sections == None or name in sections:
+                properties, types = self.readBinaryProperties(buffer, offset, propertyCount)
+                childSections = None if sections == None else sections[name]
+                children = self.readBinaryNodes(buffer, offset + propertyLength, nodeEnd, childSections)
+                nodes.append(FBXNode(name, properties, types, children))
+            offset = nodeEnd
+        return nodes
+
+    def readBinaryProperties(self, buffer, offset, count):
+        properties = []
+        types = ''
+
+        for i in range(count):
+            typeCode = chr(buffer[offset])
+            offset += 1
+
+            if typeCode in self.scalarTypes:
+                format = self.scalarTypes[typeCode]
+                properties.append(struct.unpack_from(format, buffer, offset)[0])
+                offset += struct.calcsize(format)
+            elif typeCode in self.arrayTypes:
+                length, encoding, dataLength = struct.unpack_from('<III', buffer, offset)
+                offset += 12
+                data = buffer[offset:offset + dataLength]
+                if encoding == 1:
+                    data = zlib.decompress(data)
+                properties.append(np.frombuffer(data, self.arrayTypes[typeCode], length))
+                offset += dataLength
+            elif typeCode in ('S', 'R'):
+                length = struct.unpack_from('<I', buffer, offset)[0]
+                offset += 4
+                data = bytes(buffer[offset:offset + length])
+                properties.append(data.decode('utf-8', 'surrogateescape') if typeCode == 'S' else data)
+                offset += length
+            else:
+                raise Exception(f"Unknown FBX property type: {typeCode}")
+            types += typeCode
+
+        return properties, types
+
+    def write(self, stream):
+        stream.write(self.encode())
+
+    def encode(self):
+        """
+        Binary FBX content of the document, whatever format it was read from
+        """
+        chunks = [self.binaryMagic, struct.pack('<I', self.version)]
+        offset = len(self.binaryMagic) + 4
+        for node in self.nodes + [None]:
+            data = self.encodeBinaryNode(node, offset)
+            chunks.append(data)
+            offset += len(data)
+
+        # Footer, padded to 16 bytes (a full 16 bytes when already aligned)
+        chunks.append(self.binaryFooterId + bytes(4))
+        offset += len(self.binaryFooterId) + 4
+        chunks.append(bytes(16 - offset % 16))
+        chunks.append(struct.pack('<I', self.version) + bytes(120) + self.binaryFooterMagic)
+        return b''.join(chunks)
+
+    def encodeBinaryNode(self, node, offset):
+        """
+        Record starting at offset (end offsets are absolute), None gives a null record
+        """
+        headerFormat = self.getNodeHeaderFormat()
+        headerSize = struct.calcsize(headerFormat)
+        if node == None:
+            return bytes(headerSize)
+
+        name = node.name.encode('utf-8', 'surrogateescape')
+        properties = self.encodeBinaryProperties(node.properties, node.types)
+        offset += headerSize + len(name) + len(properties)
+
+        children = node.children
+        if children or not node.properties or node.name in self.nullRecordNodes:
+            children = children + [None]
+        childrenData = []
+        for child in children:
+            data = self.encodeBinaryNode(child, offset)
+            childrenData.append(data)
+            offset += len(data)
+
+        header = struct.pack(headerFormat, offset, len(node.properties), len(properties), len(name))
+        return b''.join([header, name, properties] + childrenData)
+
+    def encodeBinaryProperties(self, properties, types):
+        chunks = []
+        for value, typeCode in zip(properties, types):
+            chunks.append(typeCode.encode('ascii'))
+
+            if typeCode in self.scalarTypes:
+                chunks.append(struct.pack(self.scalarTypes[typeCode], value))
+            elif typeCode in self.arrayTypes:
+                data = np.ascontiguousarray(value, self.arrayTypes[typeCode]).tobytes()
+                encoding = 0
+                if len(data) > self.compressionThreshold:
+                    data = zlib.compress(data)
+                    encoding = 1
+                chunks.append(struct.pack('<III', len(value), encoding, len(data)))
+                chunks.append(data)
+            elif typeCode in ('S', 'R'):
+                data = value.encode('utf-8', 'surrogateescape') if typeCode == 'S' else bytes(value)
+                chunks.append(struct.pack('<I', len(data)))
+                chunks.append(data)
+            else:
+                raise Exception(f"Unknown FBX property type: {typeCode}")
+
+        return b''.join(chunks)
+
+    # ASCII format
+
+    def readASCII(self, text, sections = None):
+        tokens = []
+        position = 0
+        while position < len(text):
+            match = self.asciiToken.match(text, position)
+            if match == None or match.end() == position:
+                if text[position:].strip() == '':
+                    break
+                raise Exception(f"Invalid FBX ASCII content at {position}")
+            position = match.end()
+            if match.lastgroup != None:
+                tokens.append((match.lastgroup, match.group(match.lastgroup)))
+
+        self.nodes = self.parseASCIINodes(tokens, 0, sections)[0]
+        header = self.find('FBXHeaderExtension')
+        if header != None and header.find('FBXVersion') != None:
+            self.version = header.find('FBXVersion').properties[0]
+
+    def parseASCIINodes(self, tokens, index, sections = None, parentName = None):
+        nodes = []
+
+        while index < len(tokens):
+            kind, value = tokens[index]
+            if kind == 'symbol' and value == '}':
+                return nodes, index + 1
+            if kind != 'name':
+                raise Exception(f"Unexpected FBX ASCII token: {value}")
+            name = value
+            index += 1
+
+            properties = []
+            types = ''
+            while index < len(tokens) and tokens[index][0] not in ('name', 'symbol'):
+                property, type = self.parseASCIIValue(tokens[index], name, parentName, len(properties))
+                properties.append(property)
+                types += type
+                index += 1
+                if index < len(tokens) and tokens[index] == ('symbol', ','):
+                    index += 1
+
+            children = []
+            if index < len(tokens) and tokens[index] == ('symbol', '{'):
+                childSections = None if sections == None else sections.get(name)
+                children, index = self.parseASCIINodes(tokens, index + 1, childSections, name)
+
+            # Arrays are written as *length { a: values }
+            if types == '*':
+                values = children[0].properties if children else []
+                type = self.asciiArrayTypes.get(name, \
+                    'd' if any(isinstance(x, float) for x in values) else 'i')
+                properties, types, children = [np.array(values, self.arrayTypes[type])], type, []
+
+            if sections == None or name in sections:
+                nodes.append(FBXNode(name, properties, types, children))
+
+        return nodes, index
+
+    def parseASCIIValue(self, token, name, parentName, position):
+        kind, value = token
+        if kind == 'string':
+            return value, 'S'
+        if kind == 'length':
+            return int(value), '*'
+        if kind == 'word':
+            if value in ('T', 'Y', 'F', 'N'):
+                return int(value in ('T', 'Y')), 'C'
+            return value, 'S'
+        if re.fullmatch(r'[-+]?\d+', value):
+            value = int(value)
+            # Object ids and connections are 64 bit
+            isId = (parentName == 'Objects' and position == 0) or (name == 'C' and position > 0)
+            return value, 'L' if isId or not -2**31 <= value < 2**31 else 'I'
+        return float(value), 'D'
+
+    # Scene graph
+
+    def index(self):
+        self.objects = {}
+        objects = self.find('Objects')
+        if objects != None:
+            for node in objects.children:
+                if node.properties:
+                    self.objects[node.properties[0]] = node
+        self.nextId = max(self.objects, default=0) + 1
+
+        # First model of each name, like FbxNode.FindChild
+        self.models = {}
+        for model in self.getObjects('Model'):
+            self.models.setdefault(self.getName(model), model)
+
+        # Connected objects by destination and by source, in file order
+        self.sources = {}
+        self.destinations = {}
+        connections = self.find('Connections')
+        if connections != None:
+            for connection in connections.findAll('C'):
+                source, destination = connection.properties[1:3]
+                property = connection.properties[3] if len(connection.properties) > 3 else None
+                self.sources.setdefault(destination, []).append((source, property))
+                self.destinations.setdefault(source, []).append((destination, property))
+
+    def getName(self, node):
+        """
+        Object name without the class part
+        """
+        name = node.properties[1]
+        if '\x00\x01' in name:
+            return name.split('\x00\x01')[0]
+        if '::' in name:
+            return name.split('::', 1)[1]
+        return name
+
+    def getId(self, node):
+        return node.properties[0]
+
+    def getObjects(self, className):
+        return [node for node in self.objects.values() if node.name == className]
+
+    def getSources(self, node, className = None, property = None):
+        """
+        Objects connected to node, filtered by class and connection property
+        """
+        sources = []
+        for source, sourceProperty in self.sources.get(self.getId(node), []):
+            if source in self.objects and (className == None or self.objects[source].name == className) \
+                and (property == None or sourceProperty == property):
+                sources.append(self.objects[source])
+        return sources
+
+    def getSkeletonModels(self):
+        """
+        Models with a skeleton node attribute, in node attribute order
+        """
+        models = []
+        for attribute in self.getObjects('NodeAttribute'):
+            if attribute.properties[2] in self.skeletonTypes:
+                for destination, property in self.destinations.get(self.getId(attribute), []):
+                    model = self.objects.get(destination)
+                    if model != None and model.name == 'Model' and model not in models:
+                        models.append(model)
+        for model in self.getObjects('Model'):
+            if model.properties[2] in self.skeletonTypes and model not in models:
+                models.append(model)
+        return models
+
+    def findModel(self, name):
+        return self.models.get(name)
+
+    def getAnimStacks(self):
+        return self.getObjects('AnimationStack')
+
+    def getAnimLayers(self, animStack):
+        return self.getSources(animStack, 'AnimationLayer')
+
+    def getDefaultValue(self, model, propertyName):
+        return tuple(model.getProperties70().get(propertyName, (0.0, 0.0, 0.0))[:3])
+
+    def getCurves(self, model, animLayer, propertyName):
+        """
+        Keys of the X, Y, Z curves animating a model property in a layer,
+        as {axis: (frames, values)} plus the curve node default values and
+        the {axis: attributes} of the keys (see getKeyAttributes)
+        """
+        layerCurveNodes = self.getSources(animLayer, 'AnimationCurveNode')
+        curves = {}
+        attributes = {}
+        defaults = self.getDefaultValue(model, propertyName)
+
+        for curveNode in self.getSources(model, 'AnimationCurveNode', propertyName):
+            if curveNode not in layerCurveNodes:
+                continue
+            curveNodeProperties = curveNode.getProperties70()
+            defaults = tuple(curveNodeProperties.get(f'd|{axis}', [default])[0] \
+                for axis, default in zip('XYZ', defaults))
+
+            for axis in 'XYZ':
+                for curve in self.getSources(curveNode, 'AnimationCurve', f'd|{axis}'):
+                    times = curve.find('KeyTime').properties[0]
+                    values = curve.find('KeyValueFloat')
+                    if values == None:
+                        values = curve.find('KeyValueDouble')
+                    curves[axis] = (self.toFrames(times), np.asarray(values.properties[0], dtype=np.float64))
+                    attributes[axis] = self.getKeyAttributes(curve, len(times))
+        return curves, defaults, attributes
+
+    def getKeyAttributes(self, curve, keyCount):
+        """
+        Interpolation flags, right slopes and next left slopes (per second)
+        of each key of a curve, attributes being shared by runs of
+        KeyAttrRefCount keys. None when the curve has no attributes
+        """
+        flags, data, refCounts = (curve.find(name) for name in ('KeyAttrFlags', 'KeyAttrDataFloat', 'KeyAttrRefCount'))
+        if flags == None or refCounts == None:
+            return None
+        flags = np.asarray(flags.properties[0], dtype=np.int64)
+        refCounts = np.asarray(refCounts.properties[0], dtype=np.int64)[:len(flags)]
+        data = np.zeros((len(flags), 4)) if data == None else \
+            np.asarray(data.properties[0], dtype=np.float64)[:4 * len(flags)].reshape(-1, 4)
+        if len(refCounts) == 0 or len(data) < len(refCounts):
+            return None
+        keyAttributes = np.repeat(np.arange(len(refCounts)), np.maximum(refCounts, 0))[:keyCount]
+        # Keys past the counted ones keep the last attributes
+        keyAttributes = np.concatenate([keyAttributes, \
+            np.full(keyCount - len(keyAttributes), len(refCounts) - 1, dtype=keyAttributes.dtype)])
+        return flags[keyAttributes], data[keyAttributes, 0], data[keyAttributes, 1]
+
+    @classmethod
+    def evaluateCurve(cls, frames, values, attributes, at):
+        """
+        Values of curve keys at the given frames, like FbxAnimCurve.Evaluate:
+        constant before the first key and after the last one, in between
+        each key is interpolated towards the next one with its own mode.
+        Cubic keys use their slopes (tangent weights are not supported),
+        keys without attributes are interpolated linearly
+        """
+        frames = np.asarray(frames, dtype=np.float64)
+        values = np.asarray(values, dtype=np.float64)
+        at = np.asarray(at, dtype=np.float64)
+        if len(frames) < 2:
+            return np.full(len(at), values[0] if len(values) else 0.0)
+
+        index = np.clip(np.searchsorted(frames, at, 'right') - 1, 0, len(frames) - 2)
+        start, stop = frames[index], frames[index + 1]
+        startValues, stopValues = values[index], values[index + 1]
+        span = stop - start
+        with np.errstate(invalid='ignore', divide='ignore'):
+            position = np.clip(np.where(span > 0, (at - start) / span, 0.0), 0, 1)
+        result = startValues + (stopValues - startValues) * position
+
+        if attributes != None:
+            flags, rightSlopes, nextLeftSlopes = attributes
+            flags = flags[index]
+            # Hermite basis, slopes are per second and span in frames
+            seconds = span * cls.frameDuration / cls.timeUnit
+            square, cube = position ** 2, position ** 3
+            cubic = (2 * cube - 3 * square + 1) * startValues + (cube - 2 * square + position) * seconds * rightSlopes[index] + \
+                (-2 * cube + 3 * square) * stopValues + (cube - square) * seconds * nextLeftSlopes[index]
+            result = np.where(flags & cls.interpolationCubic, cubic, result)
+            constant = np.where(flags & cls.constantNext, stopValues, startValues)
+            result = np.where(flags & cls.interpolationConstant, constant, result)
+            result = np.where(at == start, startValues, result)
+
+        result = np.where(at <= frames[0], values[0], result)
+        return np.where(at >= frames[-1], values[-1], result)
+
+    def toFrames(self, times):
+        """
+        Same as FbxTime.GetFrameCount in PAL mode (truncated division)
+        """
+        times = np.asarray(times, dtype=np.int64)
+        return np.sign(times) * (np.abs(times) // self.frameDuration)
+
+    def getTimeSpan(self, index, animStack):
+        """
+        Start and stop frames of a take, from the Takes section like
+        FbxImporter.GetTakeInfo, or from the animation stack
+        """
+        takes = self.find('Takes')
+        takeList = takes.findAll('Take') if takes != None else []
+        if index < len(takeList) and takeList[index].find('LocalTime') != None:
+            start, stop = takeList[index].find('LocalTime').properties[:2]
+        else:
+            properties = animStack.getProperties70()
+            start = properties.get('LocalStart', [0])[0]
+            stop = properties.get('LocalStop', [0])[0]
+        return self.toFrames([start, stop]).tolist()
+
+    # Animation writing
+
+    def addAnimation(self, name, tracks):
+        """
+        Adds an animation stack keying the models named after the tracks,
+        track values being offsets from the model default pose
+        """
+        animStack = self.addObject('AnimationStack', f'{name}\x00\x01AnimStack')
+        animLayer = self.addObject('AnimationLayer', '\x00\x01AnimLayer')
+        self.connect(self.getId(animLayer), self.getId(animStack))
+
+        stopFrame = 0
+        for boneName in tracks:
+            model = self.findModel(boneName)
+            # FbxNode.FindChild would give None, bones missing from the skeleton are skipped
+            # (and never decoded from lazily read files)
+            if model == None:
+                continue
+            track = tracks[boneName]
+            for propertyName, shortName, frames, values in (
+                ('Lcl Translation', 'T', track.translationFrames, track.translations),
+                ('Lcl Rotation', 'R', track.rotationFrames, track.rotations)):
+                if len(frames) == 0:
+                    continue
+                defaults = self.getDefaultValue(model, propertyName)
+                frames, values = self.sortKeys(frames, np.asarray(values)[:, :3] + defaults)
+                self.addCurveNode(animLayer, model, propertyName, shortName, defaults, frames, values)
+                stopFrame = max(stopFrame, int(frames[-1]))
+
+        stopTime = stopFrame * self.frameDuration
+        properties = FBXNode('Properties70')
+        for propertyName in ('LocalStart', 'LocalStop', 'ReferenceStart', 'ReferenceStop'):
+            time = stopTime if propertyName.endswith('Stop') else 0
+            properties.children.append(FBXNode('P', [propertyName, 'KTime', 'Time', '', time], 'SSSSL'))
+        animStack.children.append(properties)
+        self.addTake(name, 0, stopTime)
+        return animStack
+
+    @staticmethod
+    def sortKeys(frames, values):
+        """
+        Keys sorted by frame, the last one wins on duplicate frames like KeyAdd + KeySet
+        """
+        frames = np.asarray(frames, dtype=np.int64)
+        order = np.argsort(frames, kind='stable')
+        frames = frames[order]
+        keep = np.ones(len(frames), dtype=bool)
+        keep[:-1] = frames[1:] != frames[:-1]
+        return frames[keep], values[order][keep]
+
+    def addCurveNode(self, animLayer, model, propertyName, shortName, defaults, frames, values):
+        curveNode = self.addObject('AnimationCurveNode', f'{shortName}\x00\x01AnimCurveNode')
+        properties = FBXNode('Properties70')
+        for axis, default in zip('XYZ', defaults):
+            properties.children.append(FBXNode('P', [f'd|{axis}', 'Number', '', 'A', float(default)], 'SSSSD'))
+        curveNode.children.append(properties)
+        self.connect(self.getId(curveNode), self.getId(animLayer))
+        self.connect(self.getId(curveNode), self.getId(model), propertyName)
+
+        times = frames * self.frameDuration
+        for axis, axisValues in zip('XYZ', values.T):
+            curve = self.addObject('AnimationCurve', '\x00\x01AnimCurve', [
+                FBXNode('Default', [float(axisValues[0])], 'D'),
+                FBXNode('KeyVer', [4008], 'I'),
+                FBXNode('KeyTime', [times], 'l'),
+                FBXNode('KeyValueFloat', [axisValues.astype(np.float32)], 'f'),
+                FBXNode('KeyAttrFlags', [np.array([self.keyAttrFlags], np.int32)], 'i'),
+                FBXNode('KeyAttrDataFloat', [np.array(self.keyAttrDataFloat, np.float32)], 'f'),
+                FBXNode('KeyAttrRefCount', [np.array([len(times)], np.int32)], 'i')
+            ])
+            self.connect(self.getId(curve), self.getId(curveNode), f'd|{axis}')
+        return curveNode
+
+    def addObject(self, className, name, children = None):
+        """
+        New object with a free id, counted in Definitions
+        """
+        objectId = self.nextId
+        self.nextId += 1
+        node = FBXNode(className, [objectId, name, ''], 'LSS', children)
+        self.getSection('Objects').children.append(node)
+        self.objects[objectId] = node
+
+        definitions = self.getSection('Definitions')
+        for objectType in definitions.findAll('ObjectType'):
+            if objectType.properties[0] == className:
+                break
+        else:
+            objectType = FBXNode('ObjectType', [className], 'S', [FBXNode('Count', [0], 'I')])
+            definitions.children.append(objectType)
+        for counter in (objectType, definitions):
+            if counter.find('Count') != None:
+                counter.find('Count').properties[0] += 1
+        return node
+
+    def connect(self, source, destination, property = None):
+        if property == None:
+            connection = FBXNode('C', ['OO', source, destination], 'SLL')
+        else:
+            connection = FBXNode('C', ['OP', source, destination, property], 'SLLS')
+        self.getSection('Connections').children.append(connection)
+        self.sources.setdefault(destination, []).append((source, property))
+        self.destinations.setdefault(source, []).append((destination, property))
+
+    def addTake(self, name, start, stop):
+        takes = self.getSection('Takes')
+        if takes.find('Current') == None:
+            takes.children.insert(0, FBXNode('Current', [''], 'S'))
+        takes.children.append(FBXNode('Take', [name], 'S', [
+            FBXNode('FileName', [f'{name}.tak'], 'S'),
+            FBXNode('LocalTime', [start, stop], 'LL'),
+            FBXNode('ReferenceTime', [start, stop], 'LL')
+        ]))
+
+    def getSection(self, name):
+        """
+        Top level record, created when missing
+        """
+        section = self.find(name)
+        if section == None:
+            section = FBXNode(name)
+            self.nodes.append(section)
+        return section
+
+def unrollRotations(values):
+    """
+    Removes 360 degrees jumps between consecutive keys of a rotation curve,
+    per channel counterpart of FbxAnimCurveFilterUnroll
+    """
+    values = np.array(values, dtype=np.float64)
+    if len(values) > 1:
+        jumps = np.round(np.diff(values) / 360) * 360
+        values[1:] -= np.cumsum(jumps)
+    return values
@@ -0,0 +1,69 @@
+import hashlib
+import json
+import os
+import pickle
+import core.utils as ut
+
+class Manifest:
+    """
+    Fingerprints of the animations written by the last export and stamps of
+    their output files, animations whose fingerprint and output file did not
+    change are not encoded again
+    """
+    # Manifests of another version are ignored, encoder output changes need a new one
+    version = 1
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if os.path.isfile(path):
+            with open(path, 'r', encoding='utf-8') as stream:
+                content = json.load(stream)
+            if content.get('version') == self.version:
+                self.entries = content['entries']
+
+    @staticmethod
+    def getStamp(path):
+        if not os.path.isfile(path):
+            return None
+        stat = os.stat(path)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    @staticmethod
+    def getFingerprint(data, frameCount, settings):
+        """
+        Hash of the extracted keys of an animation and of the settings
+        changing its output. Pickles keep floats exactly and are much faster
+        to build than reprs, objects shared differently only give a new hash
+        """
+        return hashlib.sha1(pickle.dumps((frameCount, settings, data), protocol=4)).hexdigest()
+
+    def getUnchanged(self, fingerprints, outputPaths):
+        """
+        Names of the animations with the same fingerprint as in the last
+        export, written to an output file that was not modified since
+        """
+        stamps = {}
+        unchanged = []
+        for name, fingerprint in fingerprints.items():
+            entry = self.entries.get(name)
+            if entry == None or entry['fingerprint'] != fingerprint:
+                continue
+            outputPath = outputPaths[name]
+            if outputPath not in stamps:
+                stamps[outputPath] = self.getStamp(outputPath)
+            if stamps[outputPath] != None and entry['stamp'] == stamps[outputPath]:
+                unchanged.append(name)
+        return unchanged
+
+    def update(self, fingerprints, outputPaths):
+        """
+        Entries of the animations just written, others are forgotten
+        """
+        stamps = {outputPath: self.getStamp(outputPath) for outputPath in set(outputPaths.values())}
+        self.entries = {name: {'fingerprint': fingerprint, 'stamp': stamps[outputPaths[name]]} \
+            for name, fingerprint in fingerprints.items()}
+
+    def save(self):
+        content = {'version': self.version, 'entries': self.entries}
+        ut.write_file_atomic(self.path, lambda stream: stream.write(json.dumps(content, indent=1).encode('utf-8')))
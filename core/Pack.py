@@ -0,0 +1,276 @@
+import hashlib
+import json
+import os
+import struct
+import core.utils as ut
+from core.ANM import ANM
+from core.SPA import SPA
+
+class Pack:
+    """
+    Persistent index of the ANM/SPA animations of a directory tree or of a
+    blob (AFS archive, or animations laid out back to back), built from the
+    animation headers without decoding any keyframe
+    """
+    # Index files of another version are rebuilt
+    version = 1
+    formats = {'anm': ANM, 'spa': SPA}
+    afsMagic = b'AFS\x00'
+    afsNameSize = 32
+    afsAttributeSize = 48
+
+    def __init__(self, path, alignment = 4):
+        self.path = os.path.abspath(path)
+        self.alignment = alignment
+        self.stamp = None
+        self.entries = []
+        # Mapping of the blob, shared by all its entries
+        self.blob = None
+
+    def __getstate__(self):
+        # Mappings are not pickled, worker processes map the blob again
+        state = dict(vars(self))
+        state['blob'] = None
+        return state
+
+    @classmethod
+    def fromPath(cls, path, indexPath = None, alignment = 4):
+        """
+        Index of path, read from indexPath and updated when path changed
+        """
+        pack = None
+        if indexPath != None and os.path.isfile(indexPath):
+            pack = cls.load(indexPath)
+            if pack.path != os.path.abspath(path):
+                pack = None
+        if pack == None:
+            pack = cls(path, alignment)
+
+        if pack.scan() and indexPath != None:
+            pack.save(indexPath)
+        return pack
+
+    def scan(self):
+        """
+        Updates the index, returns True when entries changed.
+        Files of a directory tree are only read again when their size or
+        modification time changed, a blob is read again as a whole
+        """
+        if os.path.isdir(self.path):
+            entries = self.scanFolder()
+            changed = entries != self.entries
+        else:
+            stat = os.stat(self.path)
+            stamp = [stat.st_size, stat.st_mtime_ns]
+            if stamp == self.stamp:
+                return False
+            self.stamp = stamp
+            # Mapped again, views of the previous mapping keep it alive
+            self.blob = None
+            entries = self.scanBlob()
+            changed = True
+        self.entries = entries
+        return changed
+
+    def scanFolder(self):
+        previousEntries = {entry['path']: entry for entry in self.entries}
+        entries = []
+        for root, dirs, files in os.walk(self.path):
+            dirs.sort(key=ut.natural_keys)
+            for name in sorted(files, key=ut.natural_keys):
+                format = os.path.splitext(name)[1][1:].lower()
+                if format not in self.formats:
+                    continue
+                path = os.path.join(root, name)
+                relativePath = os.path.relpath(path, self.path)
+                stat = os.stat(path)
+                stamp = [stat.st_size, stat.st_mtime_ns]
+
+                entry = previousEntries.get(relativePath)
+                if entry == None or entry['stamp'] != stamp:
+                    buffer = ut.map_file(path)
+                    entry = self.getEntry(name, buffer, 0, format, len(buffer))
+                    if entry == None:
+                        continue
+                    entry['path'] = relativePath
+                    entry['stamp'] = stamp
+                entries.append(entry)
+        return entries
+
+    def getBlob(self):
+        if self.blob is None:
+            self.blob = ut.map_file(self.path)
+        return self.blob
+
+    def close(self):
+        """
+        Releases the mapping of the blob, buffers of its entries must not be used anymore
+        """
+        if self.blob is not None and not isinstance(self.blob, bytes):
+            self.blob.close()
+        self.blob = None
+
+    def scanBlob(self):
+        buffer = self.getBlob()
+        if buffer[:len(self.afsMagic)] == self.afsMagic and len(buffer) >= 8 and \
+            16 + struct.unpack_from("<I", buffer, 4)[0] * 8 <= len(buffer):
+            return self.scanAFS(buffer)
+        return self.scanRaw(buffer)
+
+    def scanAFS(self, buffer):
+        """
+        Entries of the AFS table of contents holding an animation,
+        names come from the attribute table when there is one.
+        Entries named as an animation must hold one
+        """
+        fileCount = struct.unpack_from("<I", buffer, 4)[0]
+        table = struct.unpack_from(f"<{fileCount * 2}I", buffer, 8)
+        attributeOffset, attributeSize = struct.unpack_from("<II", buffer, 8 + fileCount * 8)
+        hasNames = attributeOffset > 0 and attributeSize >= fileCount * self.afsAttributeSize and \
+            attributeOffset + attributeSize <= len(buffer)
+
+        entries = []
+        for i in range(fileCount):
+            offset, size = table[2 * i:2 * i + 2]
+            name = f'{i:04d}'
+            if hasNames:
+                nameOffset = attributeOffset + i * self.afsAttributeSize
+                name = bytes(buffer[nameOffset:nameOffset + self.afsNameSize]).split(b'\x00')[0].decode('utf-8', 'replace')
+            format = os.path.splitext(name)[1][1:].lower()
+            if offset + size > len(buffer):
+                if format in self.formats:
+                    raise Exception(f"archive entry {name} ends past the end of {self.path}")
+                continue
+            if format in self.formats:
+                entry = self.getEntry(name, buffer, offset, format, size)
+                if entry == None:
+                    raise Exception(f"archive entry {name} is not a valid {format.upper()} file")
+            else:
+                entry = self.findEntry(name, buffer, offset, size, self.formats)
+            if entry != None:
+                entries.append(entry)
+        return entries
+
+    def scanRaw(self, buffer):
+        """
+        Animations found at alignment steps, the scan resumes after each one
+        """
+        entries = []
+        offset = 0
+        while offset < len(buffer):
+            entry = self.findEntry(None, buffer, offset, None, self.formats)
+            if entry == None:
+                offset += self.alignment
+                continue
+            entries.append(entry)
+            offset = ut.add_padding(offset + entry['size'], self.alignment)
+        return entries
+
+    def findEntry(self, name, buffer, offset, size, formats):
+        # SPA headers are the most constrained, they are tried first
+        for format in sorted(formats, key=lambda format: format != 'spa'):
+            entry = self.getEntry(name, buffer, offset, format, size)
+            # Empty animations are not told apart from any other bytes in raw blobs
+            if entry != None and (size != None or entry['bones']):
+                return entry
+        return None
+
+    def getEntry(self, name, buffer, offset, format, size = None):
+        """
+        Index entry of the animation at offset, None when its header is not valid.
+        size defaults to the size given by the header
+        """
+        info = self.formats[format].readInfo(buffer, offset)
+        if info == None or (size != None and info['size'] > size):
+            return None
+        size = info['size'] if size == None else size
+        if name == None:
+            name = f'{offset:08x}.{format}'
+        return {
+            'name': name,
+            'path': None,
+            'offset': offset,
+            'size': size,
+            'format': format,
+            'frameCount': info['frameCount'],
+            'bones': info['bones'],
+            'hash': hashlib.sha1(buffer[offset:offset + size]).hexdigest()
+        }
+
+    def find(self, boneName = None, format = None):
+        """
+        Entries animating boneName and of the given format, when set
+        """
+        return [entry for entry in self.entries if (boneName == None or boneName in entry['bones']) \
+            and (format == None or entry['format'] == format)]
+
+    def getBuffer(self, entry):
+        """
+        Bytes of the animation, mapped from the file or the blob
+        """
+        if entry['path'] != None:
+            return ut.map_file(os.path.join(self.path, entry['path']))
+        return memoryview(self.getBlob())[entry['offset']:entry['offset'] + entry['size']]
+
+    def read(self, entry, lazy = False):
+        """
+        Decoded animation of an entry, tracks are decoded on first access when lazy
+        """
+        return self.formats[entry['format']].fromBuffer(entry['name'], self.getBuffer(entry), lazy)
+
+    def save(self, indexPath):
+        content = {'version': self.version, 'path': self.path, 'alignment': self.alignment,
+            'stamp': self.stamp, 'entries': self.entries}
+        ut.write_file_atomic(indexPath, lambda stream: stream.write(json.dumps(content, indent=1).encode('utf-8')))
+
+    @classmethod
+    def load(cls, indexPath):
+        """
+        Index saved by save, an empty index when its version is outdated
+        """
+        with open(indexPath, 'r', encoding='utf-8') as stream:
+            content = json.load(stream)
+        pack = cls(content['path'], content.get('alignment', 4))
+        if content.get('version') == cls.version:
+            pack.stamp = content['stamp']
+            pack.entries = content['entries']
+        return pack
+
+class PackWriter:
+    """
+    Writes animations to a single AFS archive readable by Pack: a table of
+    contents of fileCount (offset, size) pairs, entries aligned on alignment
+    bytes and an attribute table holding the entry names
+    """
+    def __init__(self, stream, fileCount, alignment = 0x800):
+        self.stream = stream
+        self.fileCount = fileCount
+        self.alignment = alignment
+        self.table = []
+        self.names = []
+        # Entries follow the table of contents, which is written on close
+        self.offset = ut.add_padding(16 + fileCount * 8, alignment)
+        self.stream.write(bytes(self.offset))
+
+    def add(self, name, buffer):
+        nameBytes = name.encode('utf-8')
+        if len(self.table) == self.fileCount:
+            raise Exception("archive is full")
+        if len(nameBytes) >= Pack.afsNameSize:
+            raise Exception(f"name too long for an AFS archive: {name}")
+        self.stream.write(buffer)
+        self.stream.write(bytes(ut.add_padding(len(buffer), self.alignment) - len(buffer)))
+        self.table.append((self.offset, len(buffer)))
+        self.names.append(nameBytes)
+        self.offset += ut.add_padding(len(buffer), self.alignment)
+
+    def close(self):
+        if len(self.table) != self.fileCount:
+            raise Exception(f"{len(self.table)} entries added to an archive of {self.fileCount}")
+        # Dates are left empty, archives only depend on their entries
+        attributes = b''.join(struct.pack(f"<{Pack.afsNameSize}s12xI", name, size) \
+            for name, (offset, size) in zip(self.names, self.table))
+        self.stream.write(attributes)
+        self.stream.seek(0)
+        self.stream.write(Pack.afsMagic + struct.pack(f"<I{self.fileCount * 2}III", self.fileCount, \
+            *(value for entry in self.table for value in entry), self.offset, len(attributes)))
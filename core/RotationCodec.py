@@ -0,0 +1,115 @@
+import numpy as np
+
+class RotationCodec:
+    """
+    Packed rotations of the ANM and SPA formats: three angle codes at bits 40,
+    20 and 0 of a 64-bit word, and a nibble at bit 60 giving the axis held by
+    each code. Codes map 0..maxCode to -90..degrees - 90
+    """
+    codeMask = 0xfffff
+    shifts = np.array([40, 20, 0], dtype=np.uint64)
+    # Below this many keys, the pure Python path is faster than NumPy
+    minArraySize = 8
+
+    def __init__(self, maxCode, degrees, axisOrders, axisSigns = None):
+        """
+        axisOrders (and axisSigns) give for each of the 16 nibble values the
+        code read as X, Y and Z (and the sign applied to them)
+        """
+        self.maxCode = maxCode
+        self.degrees = degrees
+        self.axisOrders = np.array(axisOrders, dtype=np.intp)
+        self.axisSigns = np.ones((16, 3)) if axisSigns is None else np.array(axisSigns, dtype=np.float64)
+        self.orderList = self.axisOrders.tolist()
+        self.signList = [signs if signs != [1, 1, 1] else None for signs in self.axisSigns.tolist()]
+
+    def getDegrees(self, code):
+        return (code / self.maxCode) * self.degrees - 90
+
+    def getCode(self, value):
+        return round(((value + 90) / self.degrees) * self.maxCode)
+
+    def getEncodingOrder(self, nibble, axisOrder):
+        """
+        Code order and signs of encoded axes, the inverse of the decoding of
+        nibble unless axisOrder is given
+        """
+        if axisOrder != None:
+            return list(axisOrder), None
+        return self.orderList[nibble], self.signList[nibble]
+
+    def decodeRotation(self, word):
+        """
+        Pure Python decoding of a single word, returns XYZ degrees
+        """
+        codes = ((word >> 40) & self.codeMask, (word >> 20) & self.codeMask, word & self.codeMask)
+        nibble = (word >> 60) & 0xf
+        signs = self.signList[nibble]
+        rotation = tuple(self.getDegrees(codes[axis]) for axis in self.orderList[nibble])
+        if signs != None:
+            rotation = tuple(value * sign for value, sign in zip(rotation, signs))
+        return rotation
+
+    def encodeRotation(self, rotation, nibble = 3, axisOrder = None):
+        """
+        Pure Python encoding of XYZ degrees, returns the word as a signed integer
+        """
+        order, signs = self.getEncodingOrder(nibble, axisOrder)
+        if signs != None:
+            rotation = [value * sign for value, sign in zip(rotation, signs)]
+        codes = [0, 0, 0]
+        for field, value in zip(order, rotation):
+            codes[field] = self.getCode(value)
+        word = (nibble << 60) | (codes[0] << 40) | (codes[1] << 20) | codes[2]
+        # Same bits as the int64 arithmetic of encodeRotations
+        return word - (1 << 64) if word >= (1 << 63) else word
+
+    def decodeRotations(self, rotationWords):
+        """
+        Returns a (count, 3) array of XYZ degrees
+        """
+        rotationWords = np.asarray(rotationWords, dtype=np.uint64)
+        if len(rotationWords) < self.minArraySize:
+            return np.array([self.decodeRotation(word) for word in rotationWords.tolist()],
+                dtype=np.float64).reshape(-1, 3)
+
+        codes = ((rotationWords[:, None] >> self.shifts) & np.uint64(self.codeMask)).astype(np.float64)
+        codes /= self.maxCode
+        codes *= self.degrees
+        codes -= 90
+
+        nibbles = rotationWords >> np.uint64(60)
+        if (nibbles == nibbles[0]).all():
+            # Usual case, every key of the block has the same axis order
+            nibble = int(nibbles[0])
+            rotations = codes[:, self.axisOrders[nibble]]
+            return rotations if self.signList[nibble] == None else rotations * self.axisSigns[nibble]
+        nibbles = nibbles.astype(np.intp)
+        return np.take_along_axis(codes, self.axisOrders[nibbles], axis=1) * self.axisSigns[nibbles]
+
+    def encodeRotations(self, rotations, nibble = 3, axisOrder = None):
+        """
+        Packs XYZ degrees (values past the third of each rotation are ignored),
+        returns the words as uint64
+        """
+        if len(rotations) < self.minArraySize:
+            try:
+                return np.array([self.encodeRotation(rotation[:3], nibble, axisOrder) \
+                    for rotation in rotations], dtype=np.int64).view(np.uint64)
+            except (ValueError, OverflowError):
+                # NaN or out of range values, wrapped like NumPy does
+                pass
+
+        try:
+            rotations = np.array(rotations, dtype=np.float64).reshape(len(rotations), -1)[:, :3]
+        except ValueError:
+            rotations = np.array([rotation[:3] for rotation in rotations], dtype=np.float64).reshape(-1, 3)
+        order, signs = self.getEncodingOrder(nibble, axisOrder)
+        if signs != None:
+            rotations = rotations * signs
+
+        codes = np.rint(((rotations + 90) / self.degrees) * self.maxCode).astype(np.int64)
+        rotationWords = np.int64(nibble << 60 if nibble < 8 else (nibble << 60) - (1 << 64))
+        for axis, field in enumerate(order):
+            rotationWords = rotationWords | (codes[:, axis] << (40, 20, 0)[field])
+        return np.asarray(rotationWords).view(np.uint64)
@@ -1,19 +1,44 @@
 import struct
+import numpy as np
 import core.utils as ut
+import core.profiling as profiling
 from core.StringTable import StringTable
+from core.Track import Track, dataToTracks, tracksToData, isTrackData, loadTracks
+from core.RotationCodec import RotationCodec
 import os
 
 class SPA:
     boneEntrySize = 48
     translationDataSize = 16
     rotationDataSize = 8
+    # Nibble 1 swaps the first two codes and mirrors X/Z, other values keep the code order
+    rotationCodec = RotationCodec(0x7ffff, 90, [[0, 1, 2]] + [[1, 0, 2]] + [[0, 1, 2]] * 14,
+        [[1, 1, 1]] + [[-1, 1, -1]] + [[1, 1, 1]] * 14)
+    # Written with X in the low code, like ANM (read as Z by the nibble 3 order)
+    writeAxisOrder = [2, 1, 0]
+
+    tracks = None
+    _data = None
 
     def __init__(self, name):
         self.name = name
         self.stringTable = StringTable()
+
+    @property
+    def data(self):
+        """
+        Dict layout of the animation, built from tracks on first access
+        """
+        if self._data is None and self.tracks is not None:
+            self._data = tracksToData(self.tracks)
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        self._data = data
+        self.tracks = None
     
-    def read(self, stream):
-        # Reading SPA Header
+    def readHeader(self, stream):
         self.offset = stream.tell()
         self.unknown0x00 = ut.b2i(stream.read(4))
         self.nameOffset = ut.b2i(stream.read(4))
@@ -24,6 +49,135 @@ class SPA:
         self.keyframeCount = struct.unpack(">f", stream.read(4))[0]
         self.boneCount = ut.b2i(stream.read(4))
         self.entriesOffset = ut.b2i(stream.read(4))
+
+    @classmethod
+    def readInfo(cls, buffer, offset = 0):
+        """
+        Keyframe count, animated bones and byte size of the SPA at offset from
+        its header and bone entries only, None when these are not valid.
+        buffer needs a find method (bytes, mmap)
+        """
+        if offset < 0 or offset + 0x30 > len(buffer):
+            return None
+        unknown0x00, nameOffset, unknown0x08, keyframeCount, boneCount, entriesOffset = \
+            struct.unpack_from(">IIIfII", buffer, offset)
+        entriesEnd = entriesOffset + boneCount * cls.boneEntrySize
+        if entriesOffset < 0x30 or boneCount == 0 or entriesEnd > nameOffset or \
+            offset + nameOffset >= len(buffer) or not np.isfinite(keyframeCount) or keyframeCount < 0:
+            return None
+
+        # First string is the animation file name, the table ends after the last name
+        nameOffsets = [nameOffset]
+        entries = np.frombuffer(buffer, '>u4', boneCount * 12, offset + entriesOffset)
+        bones = []
+        for boneNameOffset, unknown0x04, translationBlockCount, rotationBlockCount, \
+            unknown0x10, translationFrameOffset, rotationFrameOffset, unknown0x1C, \
+            translationFloatOffset, rotationFloatOffset, *_ in entries.reshape(boneCount, 12).tolist():
+            tables = ((translationFrameOffset, 4 * translationBlockCount),
+                (rotationFrameOffset, 4 * rotationBlockCount),
+                (translationFloatOffset, cls.translationDataSize * translationBlockCount),
+                (rotationFloatOffset, cls.rotationDataSize * rotationBlockCount))
+            if boneNameOffset < nameOffset or any(length > 0 and (tableOffset < entriesEnd or \
+                tableOffset + length > nameOffset) for tableOffset, length in tables):
+                return None
+            nameOffsets.append(boneNameOffset)
+            if translationBlockCount + rotationBlockCount > 0:
+                bones.append(boneNameOffset)
+
+        nameEnds = {}
+        for stringOffset in nameOffsets:
+            nameEnds[stringOffset] = buffer.find(b'\x00', offset + stringOffset) - offset
+            if nameEnds[stringOffset] < 0:
+                return None
+        try:
+            bones = [ut.b2s_name(bytes(buffer[offset + stringOffset:offset + nameEnds[stringOffset]])) \
+                for stringOffset in bones]
+        except UnicodeDecodeError:
+            return None
+        return {'frameCount': keyframeCount, 'bones': bones, 'size': max(nameEnds.values()) + 1}
+
+    def readVectorized(self, stream, lazy = False):
+        """
+        Same output as read, keyframe tables are decoded as NumPy views
+        over the whole file into tracks, data is only built when accessed.
+        When lazy, only the header, string table and bone entries are read
+        and each track is decoded on first access, stream must stay open until then
+        """
+        self.readHeader(stream)
+        if lazy:
+            stream.seek(self.entriesOffset)
+            entries = np.frombuffer(stream.read(self.boneCount * self.boneEntrySize), '>u4')
+            readArray = lambda dtype, count, offset: self.readArray(stream, dtype, count, offset)
+        else:
+            stream.seek(0)
+            buffer = stream.read()
+            entries = np.frombuffer(buffer, '>u4', self.boneCount * 12, self.entriesOffset)
+            readArray = lambda dtype, count, offset: np.frombuffer(buffer, dtype, count, offset)
+        self.readTracks(entries, readArray, lazy)
+
+    def readBuffer(self, buffer, lazy = False):
+        """
+        Same as readVectorized, parsing a bytes-like object (bytes, mmap,
+        memoryview) with offset arithmetic instead of a stream
+        """
+        self.offset = 0
+        self.unknown0x00, self.nameOffset, self.unknown0x08 = struct.unpack_from(">III", buffer, 0)
+        self.stringTable.read_buffer(buffer, self.nameOffset)
+        self.keyframeCount = struct.unpack_from(">f", buffer, 12)[0]
+        self.boneCount, self.entriesOffset = struct.unpack_from(">II", buffer, 16)
+        self.readTracks(np.frombuffer(buffer, '>u4', self.boneCount * 12, self.entriesOffset), \
+            lambda dtype, count, offset: np.frombuffer(buffer, dtype, count, offset), lazy)
+
+    @classmethod
+    def fromBuffer(cls, name, buffer, lazy = False):
+        spa = cls(name)
+        spa.readBuffer(buffer, lazy)
+        return spa
+
+    @classmethod
+    def fromPath(cls, path, mmap = True, lazy = False):
+        buffer = ut.map_file(path) if mmap else ut.read_file(path)
+        return cls.fromBuffer(os.path.basename(path), buffer, lazy)
+
+    @ut.keep_cursor_pos
+    def readArray(self, stream, dtype, count, offset):
+        stream.seek(offset)
+        return np.frombuffer(stream.read(count * np.dtype(dtype).itemsize), dtype, count)
+
+    def readTracks(self, entries, readArray, lazy = False):
+        """
+        Tracks from the bone entries, readArray(dtype, count, offset)
+        gives the keyframe tables
+        """
+        entries = {ut.b2s_name(self.stringTable.get_string(entry[0])): entry \
+            for entry in entries.reshape(self.boneCount, 12).tolist()}
+        self.data = None
+        self.tracks = loadTracks(entries, lambda entry: self.decodeTrack(entry, readArray), lazy)
+
+    def decodeTrack(self, entry, readArray):
+        boneNameOffset, unknown0x04, translationBlockCount, rotationBlockCount, \
+            unknown0x10, translationFrameOffset, rotationFrameOffset, unknown0x1C, \
+            translationFloatOffset, rotationFloatOffset, *_ = entry
+
+        translationFrames = readArray('>f4', translationBlockCount, translationFrameOffset)
+        translationFloats = readArray('>f4', translationBlockCount * 4, translationFloatOffset)
+        rotationFrames = readArray('>f4', rotationBlockCount, rotationFrameOffset)
+        rotationWords = readArray('>u8', rotationBlockCount, rotationFloatOffset)
+
+        return Track(
+            np.trunc(translationFrames), translationFloats,
+            np.trunc(rotationFrames), self.rotationCodec.decodeRotations(rotationWords),
+            rotationWords >> np.uint64(56)
+        )
+
+    def read(self, stream, lazy = False):
+        # Bones are decoded on first access to data or tracks
+        if lazy:
+            self.readVectorized(stream, True)
+            return
+
+        # Reading SPA Header
+        self.readHeader(stream)
         self.data = {}
 
         for i in range(self.boneCount):
@@ -31,7 +185,7 @@ class SPA:
 
             # Reading bone entry
             boneNameOffset = ut.b2i(stream.read(4))
-            boneName = ut.b2s_name(self.stringTable.content[boneNameOffset])
+            boneName = ut.b2s_name(self.stringTable.get_string(boneNameOffset))
             unknown0x04 = ut.b2i(stream.read(4))
             translationBlockCount = ut.b2i(stream.read(4))
             rotationBlockCount = ut.b2i(stream.read(4))
@@ -83,9 +237,13 @@ class SPA:
                     (rotationXFloat, rotationYFloat, rotationZFloat, rotationBytes[0])
 
     def load(self, data, keyframeCount = 0):
+        # Dict layout of legacy callers
+        if not isTrackData(data):
+            data = dataToTracks(data)
         # Getting used bones names only
-        self.data = {k: v for k, v in data.items() if v != {}}
-        self.stringList = list(self.data.keys())
+        self.data = None
+        self.tracks = {k: v for k, v in data.items() if len(v) > 0}
+        self.stringList = list(self.tracks.keys())
         
         # Adding file name
         name = os.path.splitext(os.path.basename(self.name))[0]
@@ -95,7 +253,7 @@ class SPA:
         self.nameOffset = 0
         self.unknown0x08 = 5
         self.keyframeCount = keyframeCount
-        self.boneCount = len(self.data)
+        self.boneCount = len(self.tracks)
         self.entriesOffset = ut.b2i(b'\x30')
         self.dataOffset = self.entriesOffset + (self.boneCount * self.boneEntrySize)
         self.nameOffset = self.entriesOffset + self.getDataSize()
@@ -104,32 +262,86 @@ class SPA:
     def getDataSize(self):
         dataSize = 0
         
-        for boneName in self.data:
+        for track in self.tracks.values():
             dataSize += self.boneEntrySize
-            translationSize = 0
-            rotationSize = 0
+            translationCount = len(track.translationFrames)
+            rotationCount = len(track.rotationFrames)
 
             # Frames
-            for frameNum in self.data[boneName]:
-                if 'translation' in self.data[boneName][frameNum]:
-                    translationSize += 4
-                if 'rotation' in self.data[boneName][frameNum]:
-                    rotationSize += 4
-            dataSize += ut.add_padding(translationSize) + ut.add_padding(rotationSize)
-
-            translationSize = 0
-            rotationSize = 0
-
+            dataSize += ut.add_padding(4 * translationCount) + ut.add_padding(4 * rotationCount)
             # Data
-            for frameNum in self.data[boneName]:
-                if 'translation' in self.data[boneName][frameNum]:
-                    translationSize += self.translationDataSize
-                if 'rotation' in self.data[boneName][frameNum]:
-                    rotationSize += self.rotationDataSize
-            dataSize += ut.add_padding(translationSize) + ut.add_padding(rotationSize)
+            dataSize += ut.add_padding(self.translationDataSize * translationCount) + \
+                ut.add_padding(self.rotationDataSize * rotationCount)
         return dataSize
 
     def write(self, stream):
+        stream.write(self.encode())
+
+    def encode(self):
+        """
+        Same output as writeReference, header, entries, keyframe tables and
+        string table are laid out in a single preallocated buffer
+        """
+        stringTableBytes = self.stringTable.to_bytes()
+        buffer = bytearray(self.nameOffset + len(stringTableBytes))
+        buffer[self.nameOffset:] = stringTableBytes
+
+        # Writing SPA Header
+        struct.pack_into(">IIIfII4xI4xI8x", buffer, 0, self.unknown0x00, self.nameOffset, \
+            self.unknown0x08, self.keyframeCount, self.boneCount, self.entriesOffset, \
+            self.dataOffset, self.dataOffset)
+
+        # Writing bones entries and data
+        entryOffset = self.entriesOffset
+        nextBlockOffset = self.dataOffset
+
+        for boneName, track in self.tracks.items():
+            translationBlockCount = len(track.translationFrames)
+            rotationBlockCount = len(track.rotationFrames)
+
+            translationFrameOffset = nextBlockOffset
+            rotationFrameOffset = translationFrameOffset + ut.add_padding(4 * translationBlockCount)
+            translationFloatOffset = rotationFrameOffset + ut.add_padding(4 * rotationBlockCount)
+            rotationFloatOffset = translationFloatOffset + \
+                ut.add_padding(self.translationDataSize * translationBlockCount)
+            nextBlockOffset = rotationFloatOffset + \
+                ut.add_padding(self.rotationDataSize * rotationBlockCount)
+            profiling.count('bytesWritten', nextBlockOffset - translationFrameOffset, self.name, boneName)
+
+            nameOffset = self.stringTable.get_offset(boneName)
+            struct.pack_into(">12I", buffer, entryOffset, nameOffset, 2, translationBlockCount, \
+                rotationBlockCount, 0, translationFrameOffset, rotationFrameOffset, translationFloatOffset, \
+                translationFloatOffset, rotationFloatOffset, nextBlockOffset, 0)
+            entryOffset += self.boneEntrySize
+
+            if translationBlockCount > 0:
+                buffer[translationFrameOffset:translationFrameOffset + 4 * translationBlockCount] = \
+                    track.translationFrames.astype('>f4').tobytes()
+                buffer[translationFloatOffset:translationFloatOffset + 16 * translationBlockCount] = \
+                    track.translations.astype('>f4').reshape(translationBlockCount, 4).tobytes()
+
+            if rotationBlockCount > 0:
+                buffer[rotationFrameOffset:rotationFrameOffset + 4 * rotationBlockCount] = \
+                    track.rotationFrames.astype('>f4').tobytes()
+                buffer[rotationFloatOffset:rotationFloatOffset + 8 * rotationBlockCount] = \
+                    self.rotationCodec.encodeRotations(track.rotations, 3, self.writeAxisOrder).astype('>u8').tobytes()
+
+        # Header, bone entries and string table
+        profiling.count('bytesWritten', len(buffer) - (nextBlockOffset - self.dataOffset), self.name)
+        return bytes(buffer)
+
+    def writeReference(self, stream):
+        """
+        Original seek based writer, kept as reference for encode
+        """
+        # Layout of the original writer: data[bone][frame][dataType], frames
+        # are sorted when the channels are, so that both keep their order
+        data = {}
+        for boneName, track in self.tracks.items():
+            data[boneName] = track.toDict()
+            if (np.diff(track.translationFrames) >= 0).all() and (np.diff(track.rotationFrames) >= 0).all():
+                data[boneName] = dict(sorted(data[boneName].items()))
+
         # Writing string table
         stream.seek(self.nameOffset)
         self.stringTable.write(stream)
@@ -149,17 +361,17 @@ class SPA:
         # Writing bones entries
         nextBlockOffset = self.dataOffset
         
-        for boneName in self.data:
-            nameOffset = ut.search_index_dict(self.stringTable.content, boneName)
+        for boneName in data:
+            nameOffset = self.stringTable.get_offset(boneName)
             stream.write(ut.i2b(nameOffset))
             stream.write(ut.i2b(2)) # unknown0x04
             
             translationBlockCount = 0
             rotationBlockCount = 0
-            for frameNum in self.data[boneName]:
-                if 'translation' in self.data[boneName][frameNum]:
+            for frameNum in data[boneName]:
+                if 'translation' in data[boneName][frameNum]:
                     translationBlockCount += 1
-                if 'rotation' in self.data[boneName][frameNum]:
+                if 'rotation' in data[boneName][frameNum]:
                     rotationBlockCount += 1
 
             stream.write(ut.i2b(translationBlockCount))
@@ -187,22 +399,22 @@ class SPA:
             i = 0
             j = 0
             # Write data
-            for frameNum in self.data[boneName]:
-                if 'translation' in self.data[boneName][frameNum]:
+            for frameNum in data[boneName]:
+                if 'translation' in data[boneName][frameNum]:
                     stream.seek(translationFrameOffset + 4 * i)
                     stream.write(struct.pack(">f", frameNum))
                     stream.seek(translationFloatOffset + 16 * i)
-                    stream.write(struct.pack(">ffff", *self.data[boneName][frameNum]['translation']))
+                    stream.write(struct.pack(">ffff", *data[boneName][frameNum]['translation']))
                     i += 1
                 
-                if 'rotation' in self.data[boneName][frameNum]:
+                if 'rotation' in data[boneName][frameNum]:
                     stream.seek(rotationFrameOffset + 4 * j)
                     stream.write(struct.pack(">f", frameNum))
                     stream.seek(rotationFloatOffset + 8 * j)
 
-                    rotationX = round(self.getRotation(self.data[boneName][frameNum]['rotation'][0]))
-                    rotationY = round(self.getRotation(self.data[boneName][frameNum]['rotation'][1])) << 20
-                    rotationZ = round(self.getRotation(self.data[boneName][frameNum]['rotation'][2])) << 40
+                    rotationX = round(self.getRotation(data[boneName][frameNum]['rotation'][0]))
+                    rotationY = round(self.getRotation(data[boneName][frameNum]['rotation'][1])) << 20
+                    rotationZ = round(self.getRotation(data[boneName][frameNum]['rotation'][2])) << 40
 
                     rotationBytes = struct.pack(">q", 0x3000000000000000 | (rotationX | rotationY | rotationZ))
 
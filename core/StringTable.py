@@ -1,4 +1,5 @@
 import os
+import bisect
 import core.utils as ut
 
 class StringTable():
@@ -13,15 +14,76 @@ class StringTable():
             stream.seek(0, os.SEEK_END)
             size = stream.tell() - self.start_offset
             stream.seek(self.start_offset)
-        string_list = stream.read(size).split(b'\x00')
+        self.parse(stream.read(size))
+
+    def read_buffer(self, buffer, start_offset, size = None):
+        """
+        Inits the string table from a bytes-like object
+        """
+        self.start_offset = start_offset
+        end_offset = len(buffer) if size == None else start_offset + size
+        self.parse(bytes(buffer[start_offset:end_offset]))
+
+    def parse(self, data):
+        string_list = data.split(b'\x00')
         string_list = [x for x in string_list if x != b'']
         string_list_offsets = self.gen_offsets(string_list)
-        self.content = dict(zip(string_list_offsets, string_list))
+        self.set_content(zip(string_list_offsets, string_list))
 
-    def build(self, string_list, start_offset = 0):
+    def build(self, string_list, start_offset = 0, deduplicate = False, share_suffixes = False):
+        """
+        Inits the string table from a list of names,
+        duplicates and names ending another name can optionally share storage
+        """
         self.start_offset = start_offset
-        string_list_offsets = self.gen_offsets(string_list)
-        self.content = dict(zip(string_list_offsets, string_list))
+        if deduplicate or share_suffixes:
+            string_list = list(dict.fromkeys(string_list))
+        if not share_suffixes:
+            string_list_offsets = self.gen_offsets(string_list)
+            self.set_content(zip(string_list_offsets, string_list))
+            return
+
+        suffixes = set()
+        for string in string_list:
+            suffixes.update(string[i:] for i in range(1, len(string)))
+        stored_list = [x for x in string_list if x not in suffixes]
+        stored_offsets = dict(zip(stored_list, self.gen_offsets(stored_list)))
+
+        content = []
+        for string in string_list:
+            if string in stored_offsets:
+                content.append((stored_offsets[string], string))
+            else:
+                container = next(x for x in stored_list if x.endswith(string))
+                content.append((stored_offsets[container] + len(container) - len(string), string))
+        self.set_content(sorted(content, key=lambda x: x[0]))
+
+    def set_content(self, items):
+        """
+        Fills both offset -> name and name -> offset indexes
+        """
+        self.content = dict(items)
+        self.offsets = {}
+        for offset, string in self.content.items():
+            self.offsets.setdefault(string, offset)
+        self.sorted_offsets = list(self.content.keys())
+
+    def get_offset(self, string):
+        if string not in self.offsets:
+            raise Exception("Key not found in dict")
+        return self.offsets[string]
+
+    def get_string(self, offset):
+        """
+        Name at offset, offsets pointing inside a name give its suffix
+        """
+        if offset in self.content:
+            return self.content[offset]
+        index = bisect.bisect_right(self.sorted_offsets, offset) - 1
+        if index < 0:
+            raise KeyError(offset)
+        container_offset = self.sorted_offsets[index]
+        return self.content[container_offset][offset - container_offset:]
 
     def gen_offsets(self, string_list):
         """
@@ -43,8 +105,17 @@ class StringTable():
         return size
     
     def write(self, output):
+        output.write(self.to_bytes())
+
+    def to_bytes(self):
+        data = b''
+        end_offset = self.start_offset
         for key, val in self.content.items():
-            output.write(ut.s2b_name(val) + b'\x00')
+            # Skipping names stored as the suffix of a previous one
+            if key >= end_offset:
+                data += ut.s2b_name(val) + b'\x00'
+                end_offset = key + len(val) + 1
+        return data
     
     def __repr__(self):
         string = (
@@ -0,0 +1,117 @@
+import numpy as np
+from collections.abc import MutableMapping
+
+class Track:
+    """
+    Columnar keyframes of a single bone, one (frames, values) pair per channel
+    """
+    __slots__ = ('translationFrames', 'translations', 'rotationFrames', 'rotations', 'rotationFlags')
+
+    def __init__(self, translationFrames = (), translations = (),
+                 rotationFrames = (), rotations = (), rotationFlags = None):
+        self.translationFrames = np.asarray(translationFrames, dtype=np.int32)
+        self.translations = self.toColumns(translations, len(self.translationFrames))
+        self.rotationFrames = np.asarray(rotationFrames, dtype=np.int32)
+        self.rotations = self.toColumns(rotations, len(self.rotationFrames))
+        # Raw flag byte kept by SPA rotations
+        self.rotationFlags = None if rotationFlags is None else \
+            np.asarray(rotationFlags, dtype=np.uint8)
+
+    @staticmethod
+    def toColumns(values, count):
+        values = np.asarray(values, dtype=np.float64)
+        if values.size == 0:
+            return np.empty((count, 3))
+        return values.reshape(count, -1)
+
+    @classmethod
+    def fromDict(cls, boneData):
+        """
+        Builds a track from the data[frame][dataType] -> tuple layout,
+        keys of each channel keep their dict order
+        """
+        translationFrames = [frame for frame in boneData if 'translation' in boneData[frame]]
+        rotationFrames = [frame for frame in boneData if 'rotation' in boneData[frame]]
+        translations = [boneData[frame]['translation'] for frame in translationFrames]
+        rotations = [boneData[frame]['rotation'] for frame in rotationFrames]
+
+        rotationFlags = None
+        if rotations and len(rotations[0]) == 4:
+            rotationFlags = [rotation[3] for rotation in rotations]
+            rotations = [rotation[:3] for rotation in rotations]
+
+        return cls(translationFrames, translations, rotationFrames, rotations, rotationFlags)
+
+    def toDict(self):
+        """
+        Compatibility layout: data[frame][dataType] -> tuple
+        """
+        boneData = {}
+        for frame, translation in zip(self.translationFrames.tolist(), self.translations.tolist()):
+            boneData[frame] = {'translation': tuple(translation)}
+
+        rotations = self.rotations.tolist()
+        if self.rotationFlags is not None:
+            rotations = [(*rotation, flag) for rotation, flag in zip(rotations, self.rotationFlags.tolist())]
+        for frame, rotation in zip(self.rotationFrames.tolist(), rotations):
+            if frame not in boneData:
+                boneData[frame] = {}
+            boneData[frame]['rotation'] = tuple(rotation)
+
+        return boneData
+
+    def __len__(self):
+        return len(self.translationFrames) + len(self.rotationFrames)
+
+class LazyMapping(MutableMapping):
+    """
+    Mapping of known keys whose values are loaded on first access
+    """
+    def __init__(self, keys, load):
+        self.keyIndex = dict.fromkeys(keys)
+        self.load = load
+        self.loaded = {}
+
+    def __getitem__(self, key):
+        if key not in self.loaded:
+            if key not in self.keyIndex:
+                raise KeyError(key)
+            self.loaded[key] = self.load(key)
+        return self.loaded[key]
+
+    def __setitem__(self, key, value):
+        self.keyIndex[key] = None
+        self.loaded[key] = value
+
+    def __delitem__(self, key):
+        del self.keyIndex[key]
+        self.loaded.pop(key, None)
+
+    def __contains__(self, key):
+        return key in self.keyIndex
+
+    def __iter__(self):
+        return iter(self.keyIndex)
+
+    def __len__(self):
+        return len(self.keyIndex)
+
+def loadTracks(sources, load, lazy = False):
+    """
+    Bone name -> Track from bone name -> source (block offset, bone entry),
+    tracks are decoded at once or on first access when lazy
+    """
+    if lazy:
+        return LazyMapping(sources, lambda boneName: load(sources[boneName]))
+    return {boneName: load(source) for boneName, source in sources.items()}
+
+def dataToTracks(data):
+    return {boneName: Track.fromDict(boneData) for boneName, boneData in data.items()}
+
+def tracksToData(tracks):
+    if isinstance(tracks, LazyMapping):
+        return LazyMapping(tracks, lambda boneName: tracks[boneName].toDict())
+    return {boneName: track.toDict() for boneName, track in tracks.items()}
+
+def isTrackData(data):
+    return any(isinstance(value, Track) for value in data.values())
@@ -0,0 +1,338 @@
+import itertools
+import math
+import numpy as np
+from core.Track import Track
+
+def isClose(values, reference, relTol = 0.001):
+    """
+    math.isclose(value, reference, rel_tol=relTol) on every channel of each key
+    """
+    values = np.asarray(values, dtype=np.float64)
+    reference = np.asarray(reference, dtype=np.float64)
+    with np.errstate(invalid='ignore'):
+        difference = np.abs(values - reference)
+    finite = np.isfinite(values) & np.isfinite(reference)
+    close = (values == reference) | (finite & ((difference <= np.abs(relTol * reference)) | \
+        (difference <= np.abs(relTol * values))))
+    return close.all(axis=-1)
+
+def reduceEqualKeys(frames, values, reference = None, relTol = 0.001):
+    """
+    Keep mask of the keys differing from the last kept key, in the given order.
+    Keys at frame <= 0 are always kept, reference is the value compared
+    to the first keys (the frame 0 value in app.cleanData)
+    """
+    frames = np.asarray(frames)
+    values = np.asarray(values, dtype=np.float64)
+    count = len(frames)
+    keep = np.ones(count, dtype=bool)
+    if count == 0:
+        return keep
+
+    # A key following a kept key is dropped when close to it, only runs of
+    # dropped keys need to be compared to the key kept before them
+    closeToPrevious = np.empty(count, dtype=bool)
+    closeToPrevious[0] = reference is not None and isClose(values[0], reference, relTol)
+    closeToPrevious[1:] = isClose(values[1:], values[:-1], relTol)
+    candidates = np.flatnonzero(closeToPrevious & (frames > 0))
+
+    # Runs are sequential by nature (each key is compared to the last kept
+    # one): their first keys are checked with plain floats, faster than
+    # NumPy calls on short runs, then long runs in growing NumPy windows
+    if reference is not None:
+        reference = [float(value) for value in reference]
+    end = -1
+    for start in candidates.tolist():
+        # Keys inside the previous run follow a dropped key
+        if start <= end:
+            continue
+        runReference = reference if start == 0 else values[start - 1].tolist()
+        end = start
+        shortEnd = min(start + 8, count)
+        while end < shortEnd and frames[end] > 0 and all(math.isclose(value, referenceValue, rel_tol=relTol) \
+            for value, referenceValue in zip(values[end].tolist(), runReference)):
+            end += 1
+
+        window = 64
+        while end == shortEnd and end < count:
+            stop = min(end + window, count)
+            kept = np.flatnonzero(~isClose(values[end:stop], runReference, relTol) | (frames[end:stop] <= 0))
+            if len(kept):
+                end += kept[0]
+                break
+            end = shortEnd = stop
+            window *= 2
+        keep[start:end] = False
+    return keep
+
+def reduceLinearKeys(frames, values, tolerance):
+    """
+    Keep mask of the keys needed for the linear interpolation of kept keys
+    to stay within tolerance on every channel (Ramer-Douglas-Peucker),
+    first and last keys are always kept
+    """
+    frames = np.asarray(frames)
+    values = np.asarray(values, dtype=np.float64)
+    count = len(frames)
+    keep = np.ones(count, dtype=bool)
+    if count < 3:
+        return keep
+
+    order = np.argsort(frames, kind='stable')
+    sortedFrames = frames[order].astype(np.float64)
+    sortedValues = values[order]
+    sortedKeep = np.zeros(count, dtype=bool)
+    sortedKeep[[0, -1]] = True
+
+    # Every segment of a recursion level is split at once, keys of
+    # segments already within tolerance are not looked at again
+    index = np.arange(count)
+    active = index[1:-1]
+    while len(active):
+        previous = np.maximum.accumulate(np.where(sortedKeep, index, 0))[active]
+        following = np.minimum.accumulate(np.where(sortedKeep, index, count - 1)[::-1])[::-1][active]
+        span = sortedFrames[following] - sortedFrames[previous]
+        weights = np.divide(sortedFrames[active] - sortedFrames[previous], span, \
+            out=np.zeros(len(active)), where=span != 0)
+        interpolated = sortedValues[previous] + weights[:, None] * (sortedValues[following] - sortedValues[previous])
+        errors = np.abs(sortedValues[active] - interpolated).max(axis=1)
+
+        # Active keys are sorted, each segment is a contiguous slice of them.
+        # Its worst key (the first one on ties) is kept when out of tolerance
+        starts = np.flatnonzero(np.r_[True, previous[1:] != previous[:-1]])
+        worstErrors = np.fmax.reduceat(errors, starts)
+        isWorst = errors == np.repeat(worstErrors, np.diff(np.r_[starts, len(active)]))
+        worst = np.minimum.reduceat(np.where(isWorst, np.arange(len(active)), len(active)), starts)
+        split = worst[(worstErrors > tolerance) & (worst < len(active))]
+        sortedKeep[active[split]] = True
+        splitSegments = np.zeros(count, dtype=bool)
+        splitSegments[previous[split]] = True
+        active = active[splitSegments[previous] & ~sortedKeep[active]]
+
+    keep[order] = sortedKeep
+    return keep
+
+def getKeys(boneData, dataType):
+    """
+    Frames keyed with dataType in dict order and their values as an array
+    """
+    frames = [frame for frame in boneData if dataType in boneData[frame]]
+    entries = [boneData[frame][dataType] for frame in frames]
+    widths = set(map(len, entries))
+    if not entries:
+        values = np.empty((0, 0))
+    elif len(widths) == 1:
+        # Much faster than np.array on a list of tuples
+        width = widths.pop()
+        values = np.fromiter(itertools.chain.from_iterable(entries), np.float64, \
+            len(entries) * width).reshape(-1, width)
+    else:
+        width = min(widths)
+        values = np.array([entry[:width] for entry in entries], dtype=np.float64)
+    return frames, values
+
+def reduceKeys(boneData, tolerance = 0):
+    """
+    Removes redundant keys of a bone in the data[frame][dataType] -> tuple layout,
+    keys close to the previous kept one first, then keys within tolerance of
+    the linear interpolation of their neighbours when tolerance > 0
+    """
+    for dataType in ('translation', 'rotation'):
+        frames, values = getKeys(boneData, dataType)
+        if not frames:
+            continue
+        values = values[:, :3]
+        reference = None
+        if 0 in boneData and dataType in boneData[0]:
+            reference = boneData[0][dataType][:3]
+
+        keep = reduceEqualKeys(frames, values, reference)
+        if tolerance > 0:
+            keep[keep] = reduceLinearKeys(np.array(frames)[keep], values[keep], tolerance)
+
+        for index in np.flatnonzero(~keep).tolist():
+            del boneData[frames[index]][dataType]
+
+    removeEmptyFrames(boneData)
+    return boneData
+
+def removeEmptyFrames(boneData):
+    for frame in [frame for frame in boneData if not boneData[frame]]:
+        del boneData[frame]
+
+def roundValues(values, decimals = 4):
+    """
+    round(value, decimals) on every value, values rounding to 0 are kept
+    as they are (the "round(x, 4) or x" of the former app.roundData)
+    """
+    values = np.asarray(values, dtype=np.float64)
+    scale = 10.0 ** decimals
+    scaled = values * scale
+    rounded = np.round(scaled) / scale
+
+    # round() works on the exact decimal value, scaled values near a tie
+    # (or too large to be exact) are rounded by round() itself
+    with np.errstate(invalid='ignore'):
+        exact = (np.abs(scaled) < 2 ** 40) & (np.abs(np.abs(scaled - np.floor(scaled)) - 0.5) > 1e-3)
+    if not exact.all():
+        rounded[~exact] = [round(value, decimals) for value in values[~exact].tolist()]
+    return np.where(rounded != 0, rounded, values)
+
+def setKeys(boneData, dataType, frames, columns):
+    """
+    Stores keys given as value columns, zipping column lists is much
+    faster than building (and garbage collecting) a list per row
+    """
+    for frame, value in zip(frames, zip(*columns)):
+        boneData[frame][dataType] = value
+
+def roundKeys(boneData, decimals = 4):
+    """
+    Rounds the X, Y, Z values of every key of a bone in the dict layout,
+    extra values (translation W) are left as they are
+    """
+    for dataType in ('translation', 'rotation'):
+        frames, values = getKeys(boneData, dataType)
+        if not frames:
+            continue
+        width = values.shape[1]
+        columns = roundValues(values[:, :3], decimals).T.tolist()
+        columns += [[boneData[frame][dataType][index] for frame in frames] for index in range(3, width)]
+        for frame, value in zip(frames, zip(*columns)):
+            entry = boneData[frame]
+            entry[dataType] = value + entry[dataType][width:]
+    return boneData
+
+def subtractOffsets(boneData, offsetBoneData):
+    """
+    Subtracts the frame 0 values of offsetBoneData (the default pose) from
+    the keys of a bone in the dict layout and removes keys left to zero.
+    As in the former app.cleanData, translations are always kept when
+    offset (their W difference is 0) and stored back with W = 1
+    """
+    offsets = offsetBoneData[0] if 0 in offsetBoneData else {}
+    for dataType, zero in (('translation', (0,0,0,1)), ('rotation', (0,0,0))):
+        frames, values = getKeys(boneData, dataType)
+        if dataType in offsets:
+            offset = offsets[dataType]
+            width = min(values.shape[1], len(offset))
+            with np.errstate(invalid='ignore'):
+                values = values[:, :width] - np.asarray(offset[:width], dtype=np.float64)
+        width = values.shape[1]
+        isZero = np.zeros(len(frames), dtype=bool)
+        if width == len(zero):
+            isZero = (values == zero).all(axis=1)
+
+        keptFrames = []
+        for frame, zeroKey in zip(frames, isZero.tolist()):
+            if zeroKey:
+                del boneData[frame][dataType]
+            else:
+                keptFrames.append(frame)
+        keptValues = values[~isZero]
+        if dataType == 'translation':
+            setKeys(boneData, dataType, keptFrames, keptValues[:, :3].T.tolist() + [[1] * len(keptFrames)])
+        elif dataType in offsets:
+            setKeys(boneData, dataType, keptFrames, keptValues.T.tolist())
+
+    removeEmptyFrames(boneData)
+    return boneData
+
+def reduceTrack(track, tolerance = 0):
+    """
+    Same as reduceKeys on the columnar layout, returns a reduced copy of the track
+    """
+    keeps = []
+    for frames, values in ((track.translationFrames, track.translations), (track.rotationFrames, track.rotations)):
+        values = values[:, :3]
+        zeroFrames = np.flatnonzero(frames == 0)
+        reference = values[zeroFrames[-1]] if len(zeroFrames) else None
+        keep = reduceEqualKeys(frames, values, reference)
+        if tolerance > 0:
+            keep[keep] = reduceLinearKeys(frames[keep], values[keep], tolerance)
+        keeps.append(keep)
+
+    translationKeep, rotationKeep = keeps
+    return Track(track.translationFrames[translationKeep], track.translations[translationKeep],
+        track.rotationFrames[rotationKeep], track.rotations[rotationKeep],
+        None if track.rotationFlags is None else track.rotationFlags[rotationKeep])
+
+def roundTrack(track, decimals = 4):
+    """
+    Same as roundKeys on the columnar layout, returns a rounded copy of the track
+    """
+    translations = track.translations.copy()
+    rotations = track.rotations.copy()
+    translations[:, :3] = roundValues(translations[:, :3], decimals)
+    rotations[:, :3] = roundValues(rotations[:, :3], decimals)
+    return Track(track.translationFrames, translations, track.rotationFrames, rotations, track.rotationFlags)
+
+def subtractTrackOffsets(track, translationOffset = None, rotationOffset = None):
+    """
+    Same as subtractOffsets on the columnar layout, the offsets are the
+    frame 0 keys of the default pose (None when it has no such key).
+    Returns a new track, translations are stored with W = 1
+    """
+    translations = track.translations
+    if translationOffset is not None:
+        # Offset translations are always kept (their W difference is 0)
+        width = min(translations.shape[1], len(translationOffset))
+        with np.errstate(invalid='ignore'):
+            translations = translations[:, :width] - np.asarray(translationOffset[:width], dtype=np.float64)
+        translationKeep = np.ones(len(translations), dtype=bool)
+    elif translations.shape[1] == 4:
+        translationKeep = ~(translations == (0,0,0,1)).all(axis=1)
+    else:
+        translationKeep = np.ones(len(translations), dtype=bool)
+    translations = translations[translationKeep, :3]
+    translations = np.column_stack([translations, np.ones(len(translations))])
+
+    rotations = track.rotations
+    if rotationOffset is not None:
+        width = min(rotations.shape[1], len(rotationOffset))
+        with np.errstate(invalid='ignore'):
+            rotations = rotations[:, :width] - np.asarray(rotationOffset[:width], dtype=np.float64)
+    rotationKeep = np.ones(len(rotations), dtype=bool)
+    if rotations.shape[1] == 3:
+        rotationKeep = ~(rotations == 0).all(axis=1)
+
+    return Track(track.translationFrames[translationKeep], translations,
+        track.rotationFrames[rotationKeep], rotations[rotationKeep],
+        None if track.rotationFlags is None else track.rotationFlags[rotationKeep])
+
+def mergeCurves(curves, defaults, evaluate):
+    """
+    Keys of the X, Y and Z curves of a property on the union of their key
+    frames, curves is {axis: (frames, values)} with frames in key order.
+    Curves without a key at one of these frames are evaluated there by
+    evaluate(axis, frames), axes without keys keep their default value.
+    Returns the frames and a (count, 3) array of values
+    """
+    curves = {axis: (np.asarray(frames, dtype=np.int64), np.asarray(values, dtype=np.float64)) \
+        for axis, (frames, values) in curves.items() if len(frames) > 0}
+    if not curves:
+        return np.empty(0, dtype=np.int64), np.empty((0, 3))
+
+    frames = next(iter(curves.values()))[0]
+    # Usual case, curves keyed on the same increasing frames
+    shared = (frames[1:] > frames[:-1]).all() and \
+        all(np.array_equal(axisFrames, frames) for axisFrames, axisValues in curves.values())
+    if not shared:
+        frames = np.unique(np.concatenate([axisFrames for axisFrames, axisValues in curves.values()]))
+    values = np.empty((len(frames), 3))
+    for column, (axis, default) in enumerate(zip('XYZ', defaults)):
+        if axis not in curves:
+            values[:, column] = default
+            continue
+        axisFrames, axisValues = curves[axis]
+        if shared:
+            values[:, column] = axisValues
+            continue
+        # Last key of each frame, as when keys are set one after the other
+        indices = np.searchsorted(axisFrames, frames, 'right') - 1
+        hasKey = indices >= 0
+        hasKey[hasKey] = axisFrames[indices[hasKey]] == frames[hasKey]
+        values[hasKey, column] = axisValues[indices[hasKey]]
+        if not hasKey.all():
+            values[~hasKey, column] = evaluate(axis, frames[~hasKey])
+    return frames, values
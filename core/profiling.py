@@ -0,0 +1,93 @@
+import contextlib
+import json
+import os
+import threading
+import time
+
+# Spans and counters are only recorded once enabled, disabled calls
+# return right away (span gives a shared no-op context manager)
+enabled = False
+events = []
+counters = {}
+noSpan = contextlib.nullcontext()
+
+class Span:
+    """
+    Complete event of the Chrome trace format, timed between enter and exit
+    """
+    __slots__ = ('name', 'args', 'start')
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exception):
+        end = time.perf_counter_ns()
+        events.append({'name': self.name, 'ph': 'X', 'ts': self.start / 1000, 'dur': (end - self.start) / 1000,
+            'pid': os.getpid(), 'tid': threading.get_ident(), 'args': self.args})
+        return False
+
+def span(name, **args):
+    """
+    Context manager timing a named stage, args are shown with the span
+    """
+    if not enabled:
+        return noSpan
+    return Span(name, args)
+
+def count(name, value, animation, bone = None):
+    """
+    Adds value to the name counter of an animation, and of one of its bones when given
+    """
+    if not enabled:
+        return
+    animationCounters = counters.setdefault(animation, {'total': {}, 'bones': {}})
+    animationCounters['total'][name] = animationCounters['total'].get(name, 0) + value
+    if bone != None:
+        boneCounters = animationCounters['bones'].setdefault(bone, {})
+        boneCounters[name] = boneCounters.get(name, 0) + value
+
+def enable():
+    global enabled
+    enabled = True
+
+def reset():
+    events.clear()
+    counters.clear()
+
+def runProfiled(function, *args):
+    """
+    Calls function with profiling enabled (in a worker process), returns its
+    result with the recorded events and counters to merge in the parent
+    """
+    enable()
+    reset()
+    return function(*args), list(events), dict(counters)
+
+def merge(workerEvents, workerCounters):
+    events.extend(workerEvents)
+    for animation, animationCounters in workerCounters.items():
+        for name, value in animationCounters['total'].items():
+            count(name, value, animation)
+        for bone, boneCounters in animationCounters['bones'].items():
+            mergedCounters = counters.setdefault(animation, {'total': {}, 'bones': {}})['bones'].setdefault(bone, {})
+            for name, value in boneCounters.items():
+                mergedCounters[name] = mergedCounters.get(name, 0) + value
+
+def getReport():
+    """
+    Chrome trace (chrome://tracing, Perfetto) with the counters of each animation
+    """
+    return {
+        'traceEvents': sorted(events, key=lambda event: event['ts']),
+        'displayTimeUnit': 'ms',
+        'counters': counters
+    }
+
+def writeReport(path):
+    with open(path, 'w', encoding='utf-8') as stream:
+        json.dump(getReport(), stream)
@@ -1,4 +1,6 @@
 import inspect, os
+import functools
+import mmap
 import datetime
 import re
 
@@ -32,24 +34,30 @@ def search_index_dict(dict, search_val):
 
 def keep_cursor_pos(function):
     """
-    restores cursor position after function execution
+    restores cursor position after function execution,
+    argument positions are resolved once at decoration time
     """
+    args_name = list(inspect.signature(function).parameters.keys())
+    if 'stream' not in args_name:
+        raise Exception("Error with given arguments")
+    stream_arg_index = args_name.index('stream')
+    start_offset_arg_index = None
+    if 'start_offset' in args_name:
+        start_offset_arg_index = args_name.index('start_offset')
+
+    @functools.wraps(function)
     def wrapper(*args, **kwargs):
-        res = b''
-        args_name = list(inspect.signature(function).parameters.keys())
-        if all(x in args_name for x in ['stream']):
-            stream_arg_index = args_name.index('stream')
-            stream = args[stream_arg_index]
-            previous_pos = stream.tell()
-            if 'start_offset' in args_name:
-                start_offset_arg_index = args_name.index('start_offset')
-                start_offset = args[start_offset_arg_index]
-                stream.seek(start_offset)            
-            res = function(*args, **kwargs)
+        stream = args[stream_arg_index] if stream_arg_index < len(args) \
+            else kwargs['stream']
+        previous_pos = stream.tell()
+        if start_offset_arg_index != None:
+            start_offset = args[start_offset_arg_index] if start_offset_arg_index < len(args) \
+                else kwargs['start_offset']
+            stream.seek(start_offset)
+        try:
+            return function(*args, **kwargs)
+        finally:
             stream.seek(previous_pos)
-        else:
-            raise Exception("Error with given arguments")
-        return res
     return wrapper
 
 @keep_cursor_pos
@@ -79,6 +87,34 @@ def uniquify(path):
 
     return path
 
+def read_file(path):
+    with open(path, 'rb') as input:
+        return input.read()
+
+def write_file_atomic(path, write):
+    """
+    calls write with a binary stream over a temporary file, then moves it to path:
+    readers and interrupted writes never see a partial file
+    """
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(temp_path, 'wb') as output:
+            write(output)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def map_file(path):
+    """
+    maps a whole file read-only, the mapping is released with the returned object
+    """
+    with open(path, 'rb') as input:
+        if os.fstat(input.fileno()).st_size == 0:
+            return b''
+        return mmap.mmap(input.fileno(), 0, access=mmap.ACCESS_READ)
+
 def add_padding(num, length = 16):
     if num % length != 0:
         num += length - (num % length)
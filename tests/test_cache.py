@@ -0,0 +1,101 @@
+import os
+import numpy as np
+import pytest
+from core.ANM import ANM
+from core.Cache import Cache
+from core.SPA import SPA
+from core.StringTable import StringTable
+
+def writeAnm(path, rotation):
+    anm = ANM(os.path.basename(path))
+    anm.load({'BONE_WAIST': {0: {'rotation': rotation}, 5: {'rotation': (0, 45, 0)}}}, 10)
+    with open(path, 'wb') as stream:
+        anm.write(stream)
+
+def assertSameTracks(animation, expected):
+    assert list(animation.tracks) == list(expected.tracks)
+    for boneName, track in expected.tracks.items():
+        assert np.array_equal(animation.tracks[boneName].rotations, track.rotations)
+        assert np.array_equal(animation.tracks[boneName].rotationFrames, track.rotationFrames)
+        assert np.array_equal(animation.tracks[boneName].translations, track.translations)
+        assert np.array_equal(animation.tracks[boneName].translationFrames, track.translationFrames)
+
+def getEntryPath(cache, path):
+    with open(path, 'rb') as stream:
+        return cache.getEntryPath(cache.getKey(stream.read(), 'ANM'))
+
+def getEntries(cache):
+    return sorted(name for name in os.listdir(cache.path) if name.endswith('.npz'))
+
+def test_corrupt_entry_is_a_miss(tmp_path):
+    path = str(tmp_path / 'a.anm')
+    writeAnm(path, (10, 20, 30))
+    cache = Cache(str(tmp_path / 'cache'))
+    expected = cache.load(path, ANM)
+    (entry,) = getEntries(cache)
+
+    with open(os.path.join(cache.path, entry), 'wb') as stream:
+        stream.write(b'PK\x03\x04 not a zip file')
+    assertSameTracks(cache.load(path, ANM), expected)
+    # Written again by the miss
+    assertSameTracks(cache.get(entry[:-4], 'a.anm', ANM), expected)
+
+def test_evict_keeps_recently_used_entries(tmp_path):
+    cache = Cache(str(tmp_path / 'cache'))
+    for i, name in enumerate(('a.anm', 'b.anm', 'c.anm')):
+        path = str(tmp_path / name)
+        writeAnm(path, (i, 0, 0))
+        cache.load(path, ANM)
+        os.utime(getEntryPath(cache, path), (i, i))
+    entries = getEntries(cache)
+    sizes = [os.path.getsize(os.path.join(cache.path, entry)) for entry in entries]
+    newest = getEntryPath(cache, str(tmp_path / 'c.anm'))
+
+    # Entries are only evicted by evict
+    cache.maxSize = max(sizes)
+    assert len(getEntries(cache)) == 3
+    cache.evict()
+    assert getEntries(cache) == [os.path.basename(newest)]
+
+def writeAnimation(path, animationClass):
+    animation = animationClass(os.path.basename(path))
+    animation.load({'BONE_WAIST': {0: {'translation': (1, 2, 3, 1), 'rotation': (10, 20, 30)}, \
+        5: {'rotation': (0, 45, 0)}}, 'BONE_HEAD': {3: {'rotation': (5, 0, -5)}}}, 10)
+    buffer = bytearray(animation.encode())
+    if animationClass == ANM:
+        # One command, read from the command offset
+        buffer[1] = 1
+    with open(path, 'wb') as stream:
+        stream.write(buffer)
+    return bytes(buffer)
+
+def reencode(animation):
+    # Same as writeAnimation of app, tracks are loaded into a new animation
+    output = type(animation)(animation.name)
+    output.load(animation.tracks, animation.frameCount if isinstance(animation, ANM) else animation.keyframeCount)
+    return output.encode()
+
+@pytest.mark.parametrize('animationClass', [ANM, SPA])
+def test_hit_matches_fresh_decode(tmp_path, animationClass):
+    path = str(tmp_path / f'a.{animationClass.__name__.lower()}')
+    buffer = writeAnimation(path, animationClass)
+    cache = Cache(str(tmp_path / 'cache'))
+    cache.load(path, animationClass)
+
+    hit = cache.get(cache.getKey(buffer, animationClass.__name__), 'a', animationClass)
+    fresh = animationClass.fromBuffer('a', buffer)
+    assert hit is not None
+    # Only the data built on access is not set on hits
+    assert set(vars(fresh)) - set(vars(hit)) == {'_data'}
+    for attribute, value in vars(fresh).items():
+        if attribute == 'tracks':
+            assertSameTracks(hit, fresh)
+        elif isinstance(value, StringTable):
+            assert getattr(hit, attribute).start_offset == value.start_offset
+            assert getattr(hit, attribute).content == value.content
+            assert getattr(hit, attribute).get_string(value.start_offset + 1) == value.get_string(value.start_offset + 1)
+        else:
+            assert getattr(hit, attribute) == value
+    if animationClass == ANM:
+        assert hit.commandsBytes == buffer[0x90:0xa0]
+    assert reencode(hit) == reencode(fresh)
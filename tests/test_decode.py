@@ -0,0 +1,116 @@
+import io
+import struct
+import numpy as np
+import pytest
+from core.ANM import ANM
+from core.SPA import SPA
+from core.StringTable import StringTable
+
+def makeRandomAnm(seed):
+    """
+    ANM of random translation and rotation blocks stored out of bone order,
+    with repeated and negative frames, any rotation word and command bytes
+    """
+    random = np.random.default_rng(seed)
+    commandsCount = int(random.integers(0, 3))
+    offsets = [0] * len(ANM.boneList)
+    dataOffset = max(ANM.dataOffset, ANM.commandOffset + 16 * commandsCount)
+    data = b''
+    for boneName in random.choice(ANM.boneList, int(random.integers(1, 20)), replace=False).tolist():
+        keyCount = int(random.integers(0, 40))
+        frames = random.integers(-5, 200, keyCount)
+        words = random.integers(0, 2 ** 64, keyCount, dtype=np.uint64)
+        if random.random() < 0.5:
+            keyframes = np.zeros(keyCount, ANM.translationDtype)
+            keyframes['translation'] = random.uniform(-100, 100, (keyCount, 3))
+            keyframes['frame'] = frames
+            keyframes['rotation'] = words
+            block = struct.pack("<hh", 0, keyCount) + keyframes.tobytes()
+        else:
+            block = struct.pack("<hh", 1, keyCount) + words.astype('<u8').tobytes() + frames.astype('<i2').tobytes()
+        offsets[ANM.boneList.index(boneName)] = (dataOffset + len(data)) // 4
+        data += block + bytes(-len(block) % 4)
+
+    header = struct.pack(f"<BBhH{len(offsets)}h", 0x61, commandsCount, 120, 0, *offsets)
+    commands = random.integers(0, 256, 16 * commandsCount, dtype=np.uint8).tobytes()
+    return (header.ljust(ANM.commandOffset, b'\x00') + commands).ljust(dataOffset, b'\x00') + data
+
+def makeRandomSpa(seed):
+    """
+    SPA of random bones, frames are stored as floats (fractional, negative,
+    repeated once truncated) and rotation words have any flag byte
+    """
+    random = np.random.default_rng(seed)
+    boneNames = [f'bone_{i}' for i in range(int(random.integers(1, 12)))]
+    entriesOffset = 0x30
+    dataOffset = entriesOffset + SPA.boneEntrySize * len(boneNames)
+    data = b''
+    tableOffsets = []
+    for boneName in boneNames:
+        translationCount, rotationCount = random.integers(0, 30, 2).tolist()
+        words = random.integers(0, 2 ** 64, rotationCount, dtype=np.uint64)
+        # At least one word with the axis order nibble 1
+        words[:1] = words[:1] & np.uint64(0x0fffffffffffffff) | np.uint64(1 << 60)
+        tables = [random.uniform(-3, 200, translationCount).astype('>f4'),
+            random.uniform(-100, 100, 4 * translationCount).astype('>f4'),
+            random.uniform(-3, 200, rotationCount).astype('>f4'), words.astype('>u8')]
+        offsets = []
+        for table in tables:
+            offsets.append(dataOffset + len(data))
+            data += table.tobytes()
+        tableOffsets.append((translationCount, rotationCount, offsets))
+
+    nameOffset = dataOffset + len(data)
+    stringTable = StringTable()
+    stringTable.build(['anim_test.mb'] + boneNames, nameOffset)
+    header = struct.pack(">IIIfII4xI4xI8x", 0, nameOffset, 5, 120.0, len(boneNames), entriesOffset, dataOffset, dataOffset)
+    entries = b''
+    for boneName, (translationCount, rotationCount, offsets) in zip(boneNames, tableOffsets):
+        translationFrameOffset, translationFloatOffset, rotationFrameOffset, rotationFloatOffset = offsets
+        entries += struct.pack(">12I", stringTable.get_offset(boneName), 2, translationCount, rotationCount, 0, \
+            translationFrameOffset, rotationFrameOffset, translationFloatOffset, translationFloatOffset, \
+            rotationFloatOffset, nameOffset, 0)
+    return header + entries + data + stringTable.to_bytes()
+
+def assertSameKeys(animation, reference):
+    assert list(animation.data) == list(reference.data)
+    for boneName, boneData in reference.data.items():
+        # Same frames in the same order, then the same values
+        assert list(animation.data[boneName]) == list(boneData)
+        for frame, keys in boneData.items():
+            assert animation.data[boneName][frame] == keys
+
+def readStream(animationClass, buffer, vectorized = False, lazy = False):
+    animation = animationClass('test')
+    if vectorized:
+        animation.readVectorized(io.BytesIO(buffer))
+    else:
+        animation.read(io.BytesIO(buffer), lazy)
+    return animation
+
+def getAnimations(animationClass, buffer):
+    return [readStream(animationClass, buffer, vectorized=True), animationClass.fromBuffer('test', buffer),
+        animationClass.fromBuffer('test', buffer, lazy=True), readStream(animationClass, buffer, lazy=True)]
+
+@pytest.mark.parametrize('seed', range(8))
+def test_anm_readers_match_read(seed):
+    buffer = makeRandomAnm(seed)
+    reference = readStream(ANM, buffer)
+
+    for anm in getAnimations(ANM, buffer):
+        assert (anm.frameCount, anm.commandsCount) == (reference.frameCount, reference.commandsCount)
+        assert getattr(anm, 'commandsBytes', None) == getattr(reference, 'commandsBytes', None)
+        assertSameKeys(anm, reference)
+
+@pytest.mark.parametrize('seed', range(8))
+def test_spa_readers_match_read(seed):
+    buffer = makeRandomSpa(seed)
+    reference = readStream(SPA, buffer)
+    # Flag byte kept with each rotation, axis order nibble 1 and others
+    nibbles = {keys['rotation'][3] >> 4 == 1 for boneData in reference.data.values() \
+        for keys in boneData.values() if 'rotation' in keys}
+    assert nibbles == {True, False}
+
+    for spa in getAnimations(SPA, buffer):
+        assert spa.keyframeCount == reference.keyframeCount
+        assertSameKeys(spa, reference)
@@ -0,0 +1,156 @@
+import os
+import pickle
+import types
+import app
+
+repoRoot = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def makeFbxStub():
+    """
+    Stand-in for the FBX SDK bindings: every import gives a scene of a root
+    bone with one keyed translation curve, imported paths are recorded
+    """
+    stub = types.ModuleType('fbx')
+    stub.imports = []
+    stub.IOSROOT = 'IOSROOT'
+
+    class FbxTime:
+        ePAL = 'PAL'
+        def __init__(self, frame):
+            self.frame = frame
+        @staticmethod
+        def SetGlobalTimeMode(mode):
+            pass
+        def GetFrameCount(self, mode = None):
+            return self.frame
+
+    class Curve:
+        def __init__(self, keys):
+            self.keys = keys
+        def KeyGetCount(self):
+            return len(self.keys)
+        def KeyGetTime(self, i):
+            return FbxTime(self.keys[i][0])
+        def KeyGetValue(self, i):
+            return self.keys[i][1]
+
+    class Property:
+        def __init__(self, value, curves):
+            self.value = value
+            self.curves = curves
+        def Get(self):
+            return list(self.value)
+        def GetCurve(self, animLayer, axis, create = False):
+            return self.curves.get(axis)
+
+    class Node:
+        def __init__(self, name, children = ()):
+            self.name = name
+            self.children = list(children)
+            self.LclTranslation = Property((0, 0, 0), {'Y': Curve([(0, 1.5), (2, 2.5)])})
+            self.LclRotation = Property((0, 0, 0), {})
+        def GetName(self):
+            return self.name
+        def GetNode(self):
+            return self
+        def GetChildCount(self):
+            return len(self.children)
+        def GetChild(self, i):
+            return self.children[i]
+        def FindChild(self, name, *args):
+            return next((child for child in self.children if child.name == name), None)
+
+    class Stack:
+        def GetName(self):
+            return 'Take 001'
+        def GetSrcObjectCount(self, criteria):
+            return 1
+        def GetSrcObject(self, criteria, i):
+            return 'layer'
+
+    class FbxScene:
+        def __init__(self):
+            self.bone = Node(app.ANM.boneList[0])
+            self.root = Node('RootNode', [self.bone])
+            self.stacks = []
+        @staticmethod
+        def Create(manager, name):
+            return FbxScene()
+        def GetRootNode(self):
+            return self.root
+        def GetSrcObjectCount(self, criteria):
+            return len(self.stacks) if criteria == 'AnimStack' else 1
+        def GetSrcObject(self, criteria, i):
+            return self.stacks[i] if criteria == 'AnimStack' else self.bone
+        def Destroy(self):
+            pass
+
+    class FbxImporter:
+        @staticmethod
+        def Create(manager, name):
+            return FbxImporter()
+        def Initialize(self, path, *args):
+            self.path = path
+            return True
+        def Import(self, scene):
+            stub.imports.append(self.path)
+            scene.stacks.append(Stack())
+            return True
+        def GetTakeInfo(self, i):
+            return types.SimpleNamespace(mLocalTimeSpan=types.SimpleNamespace(GetStart=lambda: FbxTime(0), \
+                GetStop=lambda: FbxTime(10)))
+        def Destroy(self):
+            pass
+
+    class FbxAnimCurveFilterUnroll:
+        def __getattr__(self, name):
+            return lambda *args: None
+
+    stub.FbxTime = FbxTime
+    stub.FbxScene = FbxScene
+    stub.FbxImporter = FbxImporter
+    stub.FbxAnimCurveFilterUnroll = FbxAnimCurveFilterUnroll
+    stub.FbxManager = types.SimpleNamespace(Create=lambda: types.SimpleNamespace(Destroy=lambda: None))
+    stub.FbxIOSettings = types.SimpleNamespace(Create=lambda *args: None)
+    stub.FbxCriteria = types.SimpleNamespace(ObjectType=lambda classId: classId)
+    stub.FbxAnimStack = types.SimpleNamespace(ClassId='AnimStack')
+    stub.FbxAnimLayer = types.SimpleNamespace(ClassId='AnimLayer')
+    stub.FbxSkeleton = types.SimpleNamespace(ClassId='Skeleton')
+    return stub
+
+def test_default_pose_is_parsed_once(tmp_path, monkeypatch):
+    stub = makeFbxStub()
+    monkeypatch.setattr(app, 'fbx', stub)
+    monkeypatch.chdir(repoRoot)
+
+    parsed = app.getDefaultAnimData('ANM', False, str(tmp_path))
+    cached = app.getDefaultAnimData('ANM', False, str(tmp_path))
+
+    assert stub.imports == ['resources/fbx/anm_t_pose.fbx']
+    assert parsed['Take 001.anm'][app.ANM.boneList[0]][2] == {'translation': (0.0, 2.5, 0.0, 1)}
+    # Same keys, types and order, so that manifest fingerprints do not change
+    assert pickle.dumps(cached) == pickle.dumps(parsed)
+
+def test_default_pose_is_cached_per_backend(tmp_path, monkeypatch):
+    stub = makeFbxStub()
+    monkeypatch.setattr(app, 'fbx', stub)
+    monkeypatch.chdir(repoRoot)
+    monkeypatch.setattr(app, 'parseDefaultAnimData', \
+        lambda path, outputClass, native: stub.imports.append((path, native)) or {})
+
+    for native in (False, True, False, True):
+        app.getDefaultAnimData('ANM', native, str(tmp_path))
+
+    assert stub.imports == [('resources/fbx/anm_t_pose.fbx', False), ('resources/fbx/anm_t_pose.fbx', True)]
+
+def test_input_scene_is_imported_once(tmp_path, monkeypatch):
+    stub = makeFbxStub()
+    monkeypatch.setattr(app, 'fbx', stub)
+    monkeypatch.chdir(repoRoot)
+    outputPath = str(tmp_path / 'out')
+
+    app.convert(['app.py', '--to=anm', 'input.fbx', outputPath], {'cache-dir': str(tmp_path / 'cache')})
+
+    # The imported scene is read by getAnimationData, only the default pose is imported besides it
+    assert stub.imports == ['input.fbx', 'resources/fbx/anm_t_pose.fbx']
+    assert os.listdir(outputPath) == ['Take 001.anm']
@@ -0,0 +1,69 @@
+import copy
+import io
+import numpy as np
+import pytest
+from core.ANM import ANM
+from core.SPA import SPA
+from core.Track import Track, dataToTracks
+
+def makeData(boneNames, keyCounts, seed):
+    """
+    data[bone][frame] of random keys, rotations go up to 400 degrees past
+    the encoded range. Each bone has a number of keys from keyCounts, to
+    cover both the pure Python and the NumPy rotation encoders
+    """
+    random = np.random.default_rng(seed)
+    data = {}
+    for boneName, keyCount in zip(boneNames, keyCounts):
+        frames = sorted(random.choice(200, keyCount, replace=False).tolist())
+        data[boneName] = {}
+        for frame in frames:
+            keys = {}
+            if random.random() < 0.7:
+                keys['translation'] = (*random.uniform(-50, 50, 3).tolist(), 1)
+            if random.random() < 0.8:
+                keys['rotation'] = tuple(random.uniform(-490, 490, 3).tolist())
+            if keys:
+                data[boneName][frame] = keys
+    return data
+
+def writeReference(animation):
+    stream = io.BytesIO()
+    animation.writeReference(stream)
+    return stream.getvalue()
+
+@pytest.mark.parametrize('seed', range(4))
+def test_anm_encode_matches_reference(seed):
+    boneNames = ANM.boneList[:3] + ['BONE_THROW', 'BONE_HEAD', 'BONE_CAMERA']
+    anm = ANM('test.anm')
+    anm.load(makeData(boneNames, [1, 5, 40, 7, 100, 9], seed), 200)
+
+    assert anm.encode() == writeReference(anm)
+
+@pytest.mark.parametrize('seed', range(4))
+def test_spa_encode_matches_reference(seed):
+    spa = SPA('test.spa')
+    spa.load(makeData([f'bone_{i}' for i in range(6)], [1, 5, 40, 7, 100, 9], seed), 200)
+
+    assert spa.encode() == writeReference(spa)
+
+@pytest.mark.parametrize('animationClass', [ANM, SPA])
+def test_dict_load_matches_track_load(animationClass):
+    data = makeData(ANM.boneList[:3] + ['BONE_THROW'], [1, 5, 40, 7], 0)
+    fromDict = animationClass('test')
+    fromDict.load(copy.deepcopy(data), 200)
+    fromTracks = animationClass('test')
+    fromTracks.load(dataToTracks(data), 200)
+
+    assert fromTracks.encode() == fromDict.encode()
+
+def test_anm_single_channel_is_held_to_the_last_frame():
+    anm = ANM('test.anm')
+    anm.load({'BONE_WAIST': Track(rotationFrames=[0, 5], rotations=[(1, 2, 3), (4, 5, 6)]),
+        'BONE_THROW': Track([0, 10], [(1, 2, 3, 1), (0, 0, 0, 1)])}, 10)
+
+    assert anm.tracks['BONE_WAIST'].rotationFrames.tolist() == [0, 5, 10]
+    assert anm.tracks['BONE_WAIST'].rotations[-1].tolist() == [4, 5, 6]
+    # The last translation is zero, it is not held
+    assert anm.tracks['BONE_THROW'].translations.tolist() == [[1, 2, 3, 1], [0, 0, 0, 1]]
+    assert anm.encode() == writeReference(anm)
@@ -0,0 +1,286 @@
+import struct
+import zlib
+import numpy as np
+import app
+from core.FBX import FBX
+from core.Track import Track
+
+def getAttributes(flags, rightSlopes = None, nextLeftSlopes = None):
+    zeros = [0.0] * len(flags)
+    return np.array(flags), np.array(rightSlopes or zeros), np.array(nextLeftSlopes or zeros)
+
+def test_evaluate_constant_keys():
+    frames, values = [0, 10, 20], [1.0, 3.0, 5.0]
+    constant = FBX.interpolationConstant
+    attributes = getAttributes([constant, constant | FBX.constantNext, constant])
+
+    evaluated = FBX.evaluateCurve(frames, values, attributes, [-5, 0, 4, 10, 15, 25])
+    assert evaluated.tolist() == [1.0, 1.0, 1.0, 3.0, 5.0, 5.0]
+
+def test_evaluate_linear_keys():
+    frames, values = [0, 10], [1.0, 3.0]
+
+    assert FBX.evaluateCurve(frames, values, getAttributes([0x4, 0x4]), [5]).tolist() == [2.0]
+    # Curves without key attributes
+    assert FBX.evaluateCurve(frames, values, None, [2.5]).tolist() == [1.5]
+
+def test_evaluate_cubic_keys():
+    # Slopes per second, 10 frames last 0.4 second in PAL
+    frames, values = [0, 10], [0.0, 1.0]
+    cubic = FBX.interpolationCubic
+    flat = FBX.evaluateCurve(frames, values, getAttributes([cubic, cubic]), [5, 2])
+    assert np.allclose(flat, [0.5, 3 * 0.2 ** 2 - 2 * 0.2 ** 3])
+
+    linear = FBX.evaluateCurve(frames, values, getAttributes([cubic, cubic], [2.5, 2.5], [2.5, 2.5]), [2, 7])
+    assert np.allclose(linear, [0.2, 0.7])
+
+def test_evaluate_single_key():
+    assert FBX.evaluateCurve([3], [2.0], None, [0, 3, 9]).tolist() == [2.0, 2.0, 2.0]
+
+# Small scene: a skeleton of two models, a take with translation curves on X and Z
+frameDuration = FBX.frameDuration
+xFrames = list(range(20))
+xValues = [frame * 0.5 for frame in xFrames]
+zFrames, zValues = [0, 10], [3.0, 4.0]
+
+def getSceneNodes():
+    """
+    (name, [(type code, value)], children) records of the scene, the X
+    curve times are long enough to be zlib compressed
+    """
+    def p(*properties):
+        return ('P', list(zip('SSSS', properties[:4])) + [(type, value) for type, value in properties[4:]], [])
+    def curve(objectId, frames, values):
+        return ('AnimationCurve', [('L', objectId), ('S', '\x00\x01AnimCurve'), ('S', '')], [
+            ('KeyTime', [('l', [frame * frameDuration for frame in frames])], []),
+            ('KeyValueFloat', [('f', values)], [])])
+    return [
+        ('GlobalSettings', [], [('Version', [('I', 1000)], [])]),
+        ('Documents', [], [('Count', [('I', 1)], [])]),
+        ('Objects', [], [
+            ('Geometry', [('L', 60), ('S', '\x00\x01Geometry'), ('S', 'Mesh')], [
+                ('Vertices', [('d', [0.0, 1.0, 2.0])], [])]),
+            ('NodeAttribute', [('L', 10), ('S', '\x00\x01NodeAttribute'), ('S', 'LimbNode')], []),
+            ('Model', [('L', 20), ('S', 'Hips\x00\x01Model'), ('S', 'LimbNode')], [
+                ('Properties70', [], [p('Lcl Translation', 'Lcl Translation', '', 'A', ('D', 1.0), ('D', 2.0), ('D', 3.0))])]),
+            ('Model', [('L', 21), ('S', 'Spine\x00\x01Model'), ('S', 'LimbNode')], []),
+            ('AnimationStack', [('L', 30), ('S', 'Take 001\x00\x01AnimStack'), ('S', '')], [
+                ('Properties70', [], [p('LocalStop', 'KTime', 'Time', '', ('L', 12 * frameDuration))])]),
+            ('AnimationLayer', [('L', 31), ('S', '\x00\x01AnimLayer'), ('S', '')], []),
+            ('AnimationCurveNode', [('L', 40), ('S', 'T\x00\x01AnimCurveNode'), ('S', '')], [
+                ('Properties70', [], [p('d|X', 'Number', '', 'A', ('D', 7.0)), p('d|Y', 'Number', '', 'A', ('D', 8.0))])]),
+            curve(50, xFrames, xValues),
+            curve(51, zFrames, zValues)]),
+        ('Connections', [], [
+            ('C', [('S', 'OO'), ('L', 10), ('L', 20)], []),
+            ('C', [('S', 'OO'), ('L', 20), ('L', 0)], []),
+            ('C', [('S', 'OO'), ('L', 31), ('L', 30)], []),
+            ('C', [('S', 'OO'), ('L', 40), ('L', 31)], []),
+            ('C', [('S', 'OP'), ('L', 40), ('L', 20), ('S', 'Lcl Translation')], []),
+            ('C', [('S', 'OP'), ('L', 50), ('L', 40), ('S', 'd|X')], []),
+            ('C', [('S', 'OP'), ('L', 51), ('L', 40), ('S', 'd|Z')], [])]),
+        ('Takes', [], [
+            ('Current', [('S', '')], []),
+            ('Take', [('S', 'Take 001')], [('LocalTime', [('L', 0), ('L', 8 * frameDuration)], [])])])
+    ]
+
+def packProperties(properties):
+    data = b''
+    for typeCode, value in properties:
+        data += typeCode.encode('ascii')
+        if typeCode in FBX.scalarTypes:
+            data += struct.pack(FBX.scalarTypes[typeCode], value)
+        elif typeCode in FBX.arrayTypes:
+            array = np.array(value, FBX.arrayTypes[typeCode]).tobytes()
+            encoding = 0
+            if len(array) > 128:
+                array = zlib.compress(array)
+                encoding = 1
+            data += struct.pack('<III', len(value), encoding, len(array)) + array
+        else:
+            data += struct.pack('<I', len(value)) + value.encode('utf-8')
+    return data
+
+def packRecord(node, offset):
+    """
+    FBX 7.4 record starting at offset, end offsets are absolute
+    """
+    name, properties, children = node
+    propertyData = packProperties(properties)
+    offset += 13 + len(name) + len(propertyData)
+    childData = b''
+    for child in children:
+        childData += packRecord(child, offset + len(childData))
+    # Null record closing the children
+    if children or not properties or name in ('AnimationStack', 'AnimationLayer'):
+        childData += bytes(13)
+    return struct.pack('<IIIB', offset + len(childData), len(properties), len(propertyData), len(name)) + \
+        name.encode('ascii') + propertyData + childData
+
+def packBinary(nodes, version = 7400):
+    data = FBX.binaryMagic + struct.pack('<I', version)
+    for node in nodes:
+        data += packRecord(node, len(data))
+    data += bytes(13) + FBX.binaryFooterId + bytes(4)
+    data += bytes(16 - len(data) % 16)
+    return data + struct.pack('<I', version) + bytes(120) + FBX.binaryFooterMagic
+
+def getASCII():
+    return f"""; FBX 7.4.0 project file
+FBXHeaderExtension:  {{
+    FBXVersion: 7400
+}}
+GlobalSettings:  {{
+    Version: 1000
+}}
+Objects:  {{
+    NodeAttribute: 10, "NodeAttribute::", "LimbNode" {{
+    }}
+    Model: 20, "Model::Hips", "LimbNode" {{
+        Properties70:  {{
+            P: "Lcl Translation", "Lcl Translation", "", "A",1,2,3
+        }}
+    }}
+    Model: 21, "Model::Spine", "LimbNode" {{
+    }}
+    AnimationStack: 30, "AnimStack::Take 001", "" {{
+        Properties70:  {{
+            P: "LocalStop", "KTime", "Time", "",{12 * frameDuration}
+        }}
+    }}
+    AnimationLayer: 31, "AnimLayer::", "" {{
+    }}
+    AnimationCurveNode: 40, "AnimCurveNode::T", "" {{
+        Properties70:  {{
+            P: "d|X", "Number", "", "A",7
+            P: "d|Y", "Number", "", "A",8
+        }}
+    }}
+    AnimationCurve: 50, "AnimCurve::", "" {{
+        KeyTime: *{len(xFrames)} {{
+            a: {','.join(str(frame * frameDuration) for frame in xFrames)}
+        }}
+        KeyValueFloat: *{len(xValues)} {{
+            a: {','.join(map(str, xValues))}
+        }}
+    }}
+    AnimationCurve: 51, "AnimCurve::", "" {{
+        KeyTime: *2 {{
+            a: {','.join(str(frame * frameDuration) for frame in zFrames)}
+        }}
+        KeyValueFloat: *2 {{
+            a: {','.join(map(str, zValues))}
+        }}
+    }}
+}}
+Connections:  {{
+    ;Model::Hips, Model::RootNode
+    C: "OO",10,20
+    C: "OO",20,0
+    C: "OO",31,30
+    C: "OO",40,31
+    C: "OP",40,20, "Lcl Translation"
+    C: "OP",50,40, "d|X"
+    C: "OP",51,40, "d|Z"
+}}
+Takes:  {{
+    Current: ""
+    Take: "Take 001" {{
+        LocalTime: 0,{8 * frameDuration}
+    }}
+}}
+"""
+
+def readDocument(buffer, full = True):
+    document = FBX('test.fbx')
+    document.readBuffer(buffer, full)
+    return document
+
+def test_binary_nodes_and_properties():
+    document = readDocument(packBinary(getSceneNodes()))
+
+    assert [node.name for node in document.nodes] == ['GlobalSettings', 'Documents', 'Objects', 'Connections', 'Takes']
+    assert document.version == 7400
+    model = document.findModel('Hips')
+    assert model.properties == [20, 'Hips\x00\x01Model', 'LimbNode'] and model.types == 'LSS'
+    assert model.getProperties70()['Lcl Translation'] == [1.0, 2.0, 3.0]
+    # Compressed and raw arrays
+    keyTimes = [document.objects[objectId].find('KeyTime').properties[0] for objectId in (50, 51)]
+    assert keyTimes[0].dtype == np.int64 and keyTimes[0].tolist() == [frame * frameDuration for frame in xFrames]
+    assert keyTimes[1].tolist() == [frame * frameDuration for frame in zFrames]
+    assert document.find('Connections').children[-1].properties == ['OP', 51, 40, 'd|Z']
+    assert document.objects[60].find('Vertices').properties[0].tolist() == [0.0, 1.0, 2.0]
+
+def test_binary_reencode_is_identical():
+    buffer = packBinary(getSceneNodes())
+
+    assert readDocument(buffer).encode() == buffer
+
+def test_animation_sections_only():
+    document = readDocument(packBinary(getSceneNodes()), False)
+
+    assert [node.name for node in document.nodes] == ['GlobalSettings', 'Objects', 'Connections', 'Takes']
+    assert 60 not in document.objects and 20 in document.objects
+
+def assertAnimation(document):
+    assert [document.getName(model) for model in document.getSkeletonModels()] == ['Hips', 'Spine']
+    (animStack,) = document.getAnimStacks()
+    assert document.getName(animStack) == 'Take 001'
+    (animLayer,) = document.getAnimLayers(animStack)
+
+    curves, defaults, attributes = document.getCurves(document.findModel('Hips'), animLayer, 'Lcl Translation')
+    assert sorted(curves) == ['X', 'Z']
+    assert curves['X'][0].tolist() == xFrames and curves['X'][1].tolist() == xValues
+    assert curves['Z'][0].tolist() == zFrames and curves['Z'][1].tolist() == zValues
+    # Curve node values, Z keeps the model value
+    assert defaults == (7.0, 8.0, 3.0)
+    assert attributes == {'X': None, 'Z': None}
+    assert document.getCurves(document.findModel('Spine'), animLayer, 'Lcl Rotation') == ({}, (0.0, 0.0, 0.0), {})
+
+    # Take local time first, then the animation stack
+    assert document.getTimeSpan(0, animStack) == [0, 8]
+    assert document.getTimeSpan(1, animStack) == [0, 12]
+
+def test_binary_animation():
+    assertAnimation(readDocument(packBinary(getSceneNodes()), False))
+
+def test_ascii_animation():
+    document = readDocument(getASCII().encode('utf-8'), False)
+
+    assert document.version == 7400
+    assertAnimation(document)
+
+def test_written_animation_reads_back():
+    document = readDocument(packBinary(getSceneNodes()))
+    tracks = {
+        # Unsorted translation keys, rotations crossing 180 degrees
+        'Hips': Track([0, 5, 3], [(0.5, 1, 2), (1.5, 1, 2), (1.25, 1, 2)],
+            [0, 10, 20], [(170, 0, 0), (-175, 0, 0), (-160, 10, 0)]),
+        'Missing': Track(rotationFrames=[0, 30], rotations=[(1, 2, 3), (4, 5, 6)]),
+        'Spine': Track(rotationFrames=[2], rotations=[(1, 2, 3)])
+    }
+    document.addAnimation('test.anm', tracks)
+    document = readDocument(document.encode(), False)
+
+    animStack = document.getAnimStacks()[-1]
+    assert document.getName(animStack) == 'test.anm'
+    # Keyed up to the last frame of the skeleton bones
+    assert document.getTimeSpan(1, animStack) == [0, 20]
+    (animLayer,) = document.getAnimLayers(animStack)
+    assert len(document.getSources(animLayer, 'AnimationCurveNode')) == 3
+
+    # Values are offsets from the model default pose
+    curves, defaults, attributes = document.getCurves(document.findModel('Hips'), animLayer, 'Lcl Translation')
+    assert defaults == (1.0, 2.0, 3.0)
+    assert {axis: frames.tolist() for axis, (frames, values) in curves.items()} == {axis: [0, 3, 5] for axis in 'XYZ'}
+    assert [curves[axis][1].tolist() for axis in 'XYZ'] == [[1.5, 2.25, 2.5], [3, 3, 3], [5, 5, 5]]
+    assert all((flags & FBX.interpolationConstant).all() for flags, *slopes in attributes.values())
+
+    curves, defaults, attributes = document.getCurves(document.findModel('Spine'), animLayer, 'Lcl Rotation')
+    assert [(curves[axis][0].tolist(), curves[axis][1].tolist()) for axis in 'XYZ'] == [([2], [1]), ([2], [2]), ([2], [3])]
+
+    # Rotations are unrolled when read back by the app
+    animData = app.getNativeAnimationData(document, 'ANM', False)
+    hips = animData['test.anm']['Hips']
+    assert [hips[frame]['rotation'] for frame in (0, 10, 20)] == [(170, 0, 0), (185, 0, 0), (200, 10, 0)]
+    assert 'Missing' not in animData['test.anm']
@@ -0,0 +1,93 @@
+import copy
+import numpy as np
+from core.Track import Track
+from core.keyframes import mergeCurves, reduceKeys, reduceTrack, roundKeys, roundTrack, subtractOffsets, subtractTrackOffsets
+
+def interpolate(curves):
+    # Linear evaluation of the missing keys, recording the evaluated frames
+    evaluated = []
+    def evaluate(axis, frames):
+        evaluated.append((axis, frames.tolist()))
+        return np.interp(frames, *curves[axis])
+    return evaluate, evaluated
+
+def test_merge_shared_frames():
+    curves = {'X': ([0, 5], [1, 2]), 'Y': ([0, 5], [3, 4]), 'Z': ([0, 5], [5, 6])}
+    evaluate, evaluated = interpolate(curves)
+    frames, values = mergeCurves(curves, [0, 0, 0], evaluate)
+
+    assert evaluated == []
+    assert frames.tolist() == [0, 5]
+    assert values.tolist() == [[1, 3, 5], [2, 4, 6]]
+
+def test_merge_interpolates_missing_keys():
+    # Z has no curve, Y is constant after its last key
+    curves = {'X': ([0, 10], [1.0, 2.0]), 'Y': ([0, 5], [3.0, 4.0])}
+    evaluate, evaluated = interpolate(curves)
+    frames, values = mergeCurves(curves, [7, 8, 9], evaluate)
+
+    # Curves are only evaluated at the frames where they have no key
+    assert evaluated == [('X', [5]), ('Y', [10])]
+    assert frames.tolist() == [0, 5, 10]
+    assert np.array_equal(values, [[1.0, 3.0, 9], [1.5, 4.0, 9], [2.0, 4.0, 9]])
+
+def test_merge_keeps_last_key_of_a_frame():
+    curves = {'X': ([0, 2, 2, 4], [0.0, 1.0, 2.0, 3.0]), 'Y': ([1, 4], [10.0, 20.0])}
+    frames, values = mergeCurves(curves, [0, 0, 0], interpolate(curves)[0])
+
+    assert frames.tolist() == [0, 1, 2, 4]
+    assert values[:, 0].tolist()[2:] == [2.0, 3.0]
+    assert values[:, 1].tolist() == [10.0, 10.0, 10 + 10 / 3, 20.0]
+
+def test_merge_without_keys():
+    frames, values = mergeCurves({'X': ([], [])}, [1, 2, 3], None)
+
+    assert frames.shape == (0,) and values.shape == (0, 3)
+
+def makeBoneData():
+    # Zero translation at frame 5, zero rotation at frame 10 (once offset)
+    return {
+        0: {'translation': (1.23456789, 0, -2.5, 1), 'rotation': (10.000049, 20, 30)},
+        5: {'translation': (0, 0, 0, 1), 'rotation': (0.00001, -45.12345, 0)},
+        10: {'translation': (3, 2, 1, 1), 'rotation': (10, 20, 30)},
+        15: {'rotation': (-170.55555, 0, 90)},
+    }
+
+def makeTrack(boneData):
+    translationFrames = [frame for frame in boneData if 'translation' in boneData[frame]]
+    rotationFrames = [frame for frame in boneData if 'rotation' in boneData[frame]]
+    return Track(translationFrames, [boneData[frame]['translation'] for frame in translationFrames],
+        rotationFrames, [boneData[frame]['rotation'] for frame in rotationFrames])
+
+def test_round_track_matches_round_keys():
+    boneData = makeBoneData()
+    track = makeTrack(boneData)
+
+    assert roundTrack(track).toDict() == roundKeys(boneData)
+    # The track itself is left as it is
+    assert track.translations[0, 0] == 1.23456789
+
+def test_subtract_track_offsets_matches_subtract_offsets():
+    offsets = {0: {'translation': (1, 0, -2.5, 1), 'rotation': (10, 20, 30)}}
+    for offsetBoneData in (offsets, {0: {'rotation': (10, 20, 30)}}, {}):
+        boneData = makeBoneData()
+        offset = offsetBoneData.get(0, {})
+        track = subtractTrackOffsets(makeTrack(boneData), offset.get('translation'), offset.get('rotation'))
+
+        assert track.toDict() == subtractOffsets(copy.deepcopy(boneData), offsetBoneData)
+        assert track.translations.shape[1] == 4
+
+def test_reduce_track_matches_reduce_keys():
+    random = np.random.default_rng(0)
+    boneData = {}
+    for frame in range(60):
+        # Runs of repeated keys and of keys on a line
+        value = float(frame // 7) if frame < 30 else frame * 0.5 + random.uniform(-0.01, 0.01)
+        boneData[frame] = {'translation': (value, 1, 2, 1)}
+        if frame % 3:
+            boneData[frame]['rotation'] = (value, -value, 0)
+    for tolerance in (0, 0.05):
+        track = reduceTrack(makeTrack(boneData), tolerance)
+
+        assert track.toDict() == reduceKeys(copy.deepcopy(boneData), tolerance)
+        assert len(track) < 100
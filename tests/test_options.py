@@ -0,0 +1,22 @@
+import subprocess
+import sys
+import pytest
+import app
+
+def test_options_are_split_from_arguments():
+    args, options = app.parseOptions(['app.py', '--to=anm', '--jobs=4', 'input.fbx', '--archive', 'out'])
+
+    assert args == ['app.py', '--to=anm', 'input.fbx', 'out']
+    assert options == {'jobs': '4', 'archive': ''}
+
+@pytest.mark.parametrize('jobs', ['--jobs', '--jobs=', '--jobs=0', '--jobs=-2', '--jobs=two'])
+def test_invalid_jobs_are_rejected(jobs):
+    with pytest.raises(Exception, match='--jobs'):
+        app.parseOptions(['app.py', '--to=anm', jobs, 'input.fbx', 'out'])
+
+def test_invalid_jobs_print_the_usage(tmp_path):
+    result = subprocess.run([sys.executable, app.__file__, '--to=anm', '--jobs', 'input.fbx', str(tmp_path)],
+        capture_output=True, text=True, cwd=str(tmp_path))
+
+    assert result.stdout.startswith("ERROR: --jobs needs a number of worker processes of at least 1, got ''")
+    assert 'USAGE:' in result.stdout
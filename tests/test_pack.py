@@ -0,0 +1,60 @@
+import struct
+import pytest
+from core.ANM import ANM
+from core.Pack import Pack, PackWriter
+
+def makeAnm(blocks, frameCount = 10):
+    """
+    ANM of (bone name, block) pairs, blocks are stored in the given order
+    """
+    offsets = [0] * len(ANM.boneList)
+    data = b''
+    for boneName, block in blocks:
+        offsets[ANM.boneList.index(boneName)] = (0x94 + len(data)) // 4
+        data += block
+    header = struct.pack(f"<BBhH{len(offsets)}h", 0, 0, frameCount, 0, *offsets)
+    return header.ljust(0x94, b'\x00') + data
+
+def rotationBlock(frames):
+    return struct.pack(f"<hh{len(frames)}Q{len(frames)}h", 1, len(frames), *[3 << 60] * len(frames), *frames)
+
+def test_blocks_out_of_bone_order(tmp_path):
+    # BONE_HEAD block stored before the BONE_WAIST block
+    blocks = [('BONE_HEAD', rotationBlock([0, 5, 9]) + b'\x00\x00'), ('BONE_WAIST', rotationBlock([0, 9]))]
+    buffer = makeAnm(blocks)
+    (tmp_path / 'swapped.anm').write_bytes(buffer)
+
+    info = ANM.readInfo(buffer)
+    assert info == {'frameCount': 10, 'bones': ['BONE_WAIST', 'BONE_HEAD'], 'size': len(buffer)}
+    assert [entry['name'] for entry in Pack.fromPath(str(tmp_path)).entries] == ['swapped.anm']
+    assert set(ANM.fromBuffer('swapped.anm', buffer).tracks['BONE_HEAD'].rotationFrames) == {0, 5, 9}
+
+def test_negative_bone_offsets_are_skipped():
+    buffer = bytearray(makeAnm([('BONE_WAIST', rotationBlock([0, 9]))]))
+    struct.pack_into("<h", buffer, 6 + 2 * ANM.boneList.index('BONE_HEAD'), -8)
+
+    assert ANM.readInfo(bytes(buffer))['bones'] == ['BONE_WAIST']
+
+def writeArchive(path, buffers):
+    with open(path, 'wb') as stream:
+        writer = PackWriter(stream, len(buffers))
+        for name, buffer in buffers.items():
+            writer.add(name, buffer)
+        writer.close()
+
+def test_archive_entries_share_one_mapping(tmp_path):
+    buffer = makeAnm([('BONE_WAIST', rotationBlock([0, 9]))])
+    writeArchive(tmp_path / 'pack.afs', {'a.anm': buffer, 'b.anm': buffer})
+
+    pack = Pack.fromPath(str(tmp_path / 'pack.afs'))
+    assert [entry['name'] for entry in pack.entries] == ['a.anm', 'b.anm']
+    views = [pack.getBuffer(entry) for entry in pack.entries]
+    assert all(view.obj is pack.blob for view in views)
+    assert bytes(views[1]) == buffer
+
+def test_invalid_archive_entry_is_reported(tmp_path):
+    buffer = makeAnm([('BONE_WAIST', rotationBlock([0, 9]))])
+    writeArchive(tmp_path / 'pack.afs', {'a.anm': buffer, 'b.anm': b'\xff' * len(buffer), 'c.bin': b'\xff' * 16})
+
+    with pytest.raises(Exception, match='b.anm'):
+        Pack.fromPath(str(tmp_path / 'pack.afs'))
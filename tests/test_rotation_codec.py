@@ -0,0 +1,93 @@
+import io
+import struct
+import numpy as np
+import pytest
+from core.ANM import ANM
+from core.SPA import SPA
+
+# Below and above RotationCodec.minArraySize, for the pure Python and the NumPy paths
+keyCounts = [5, 40]
+
+def makeWords(count, nibble, seed):
+    words = np.random.default_rng(seed).integers(0, 1 << 60, count, dtype=np.uint64)
+    return words | np.uint64(nibble << 60)
+
+def makeRotations(count, seed):
+    # Mirrored SPA axes are encoded negated, so values stay within -89..89
+    return np.random.default_rng(seed).uniform(-89, 89, (count, 3)).tolist()
+
+def readAnmRotation(anm, word):
+    return anm.readRotation(io.BytesIO(struct.pack("<Q", word)))
+
+def readSpaRotation(spa, word):
+    # Decoding of SPA.read, nibble 1 swaps X and Y and mirrors X and Z
+    rotation1 = spa.getDegRotation((word & 0x0fffffffffffffff) >> 40)
+    rotation2 = spa.getDegRotation((word & 0x000000ffffffffff) >> 20)
+    rotation3 = spa.getDegRotation(word & 0x00000000000fffff)
+    if word >> 60 == 1:
+        return (-rotation2, rotation1, -rotation3)
+    return (rotation1, rotation2, rotation3)
+
+def getQuantized(animation, value, sign = 1):
+    return sign * animation.getDegRotation(round(animation.getRotation(sign * value)))
+
+@pytest.mark.parametrize('count', keyCounts)
+@pytest.mark.parametrize('nibble', range(16))
+def test_anm_decode_matches_read_rotation(count, nibble):
+    anm = ANM('test.anm')
+    words = makeWords(count, nibble, nibble)
+    expected = [readAnmRotation(anm, word) for word in words.tolist()]
+
+    assert anm.rotationCodec.decodeRotations(words).tolist() == [list(rotation) for rotation in expected]
+    assert anm.rotationCodec.decodeRotation(int(words[0])) == expected[0]
+
+@pytest.mark.parametrize('count', keyCounts)
+@pytest.mark.parametrize('nibble', range(16))
+def test_spa_decode_matches_get_deg_rotation(count, nibble):
+    spa = SPA('test.spa')
+    words = makeWords(count, nibble, nibble)
+    expected = [readSpaRotation(spa, word) for word in words.tolist()]
+
+    assert spa.rotationCodec.decodeRotations(words).tolist() == [list(rotation) for rotation in expected]
+    assert spa.rotationCodec.decodeRotation(int(words[0])) == expected[0]
+
+@pytest.mark.parametrize('count', keyCounts)
+def test_anm_encode_matches_get_rotation_bytes(count):
+    anm = ANM('test.anm')
+    rotations = makeRotations(count, count)
+    expected = [struct.unpack("<Q", anm.getRotationBytes(rotation))[0] for rotation in rotations]
+
+    assert anm.rotationCodec.encodeRotations(rotations).tolist() == expected
+
+@pytest.mark.parametrize('count', keyCounts)
+@pytest.mark.parametrize('nibble', range(16))
+def test_anm_encoded_nibbles_read_back(count, nibble):
+    anm = ANM('test.anm')
+    rotations = makeRotations(count, nibble)
+    words = anm.rotationCodec.encodeRotations(rotations, nibble).tolist()
+
+    assert [word >> 60 for word in words] == [nibble] * count
+    assert [readAnmRotation(anm, word) for word in words] == \
+        [tuple(getQuantized(anm, value) for value in rotation) for rotation in rotations]
+
+@pytest.mark.parametrize('count', keyCounts)
+def test_spa_encode_matches_reference_words(count):
+    spa = SPA('test.spa')
+    rotations = makeRotations(count, count)
+    # Packing of SPA.writeReference
+    expected = [0x3000000000000000 | round(spa.getRotation(x)) | round(spa.getRotation(y)) << 20 | \
+        round(spa.getRotation(z)) << 40 for x, y, z in rotations]
+
+    assert spa.rotationCodec.encodeRotations(rotations, 3, spa.writeAxisOrder).tolist() == expected
+
+@pytest.mark.parametrize('count', keyCounts)
+@pytest.mark.parametrize('nibble', range(16))
+def test_spa_encoded_nibbles_read_back(count, nibble):
+    spa = SPA('test.spa')
+    rotations = makeRotations(count, nibble)
+    words = spa.rotationCodec.encodeRotations(rotations, nibble).tolist()
+    signs = (-1, 1, -1) if nibble == 1 else (1, 1, 1)
+
+    assert [word >> 60 for word in words] == [nibble] * count
+    assert [readSpaRotation(spa, word) for word in words] == \
+        [tuple(getQuantized(spa, value, sign) for value, sign in zip(rotation, signs)) for rotation in rotations]
@@ -0,0 +1,62 @@
+import pytest
+import core.utils as ut
+from core.StringTable import StringTable
+
+names = ['anim_test.mb', 'BONE_HEAD', 'HEAD', 'BONE_NECK', 'EAD', 'BONE_HEAD', 'bone+l', 'NECK']
+startOffset = 0x40
+
+def roundTrip(table):
+    buffer = b'\xff' * startOffset + table.to_bytes()
+    read = StringTable()
+    read.read_buffer(buffer, startOffset)
+    return buffer, read
+
+@pytest.mark.parametrize('shareSuffixes', [False, True])
+def test_names_read_back(shareSuffixes):
+    table = StringTable()
+    table.build(names, startOffset, deduplicate=True, share_suffixes=shareSuffixes)
+    buffer, read = roundTrip(table)
+
+    for name in names:
+        offset = table.get_offset(name)
+        assert buffer[offset:].split(b'\x00')[0] == ut.s2b_name(name)
+        assert ut.b2s_name(read.get_string(offset)) == name
+        assert table.get_string(offset) == name
+    # Duplicates share one offset
+    assert sorted(table.offsets) == sorted(set(names))
+    assert len(set(table.offsets.values())) == len(set(names))
+
+def test_suffixes_share_storage():
+    table = StringTable()
+    table.build(names, startOffset, share_suffixes=True)
+    buffer, read = roundTrip(table)
+
+    assert buffer[startOffset:] == b'anim_test.mb\x00BONE_HEAD\x00BONE_NECK\x00bone|l\x00'
+    assert table.get_offset('HEAD') == table.get_offset('BONE_HEAD') + 5
+    assert table.get_offset('EAD') == table.get_offset('BONE_HEAD') + 6
+    assert table.get_offset('NECK') == table.get_offset('BONE_NECK') + 5
+    # Only stored names are found by the reader, suffixes are looked up in the name holding them
+    assert list(read.content.values()) == [b'anim_test.mb', b'BONE_HEAD', b'BONE_NECK', b'bone|l']
+    assert read.get_string(table.get_offset('EAD')) == b'EAD'
+
+def test_without_sharing_every_name_is_stored():
+    table = StringTable()
+    table.build(names, startOffset)
+    buffer, read = roundTrip(table)
+
+    assert len(buffer) - startOffset == sum(len(name) + 1 for name in names)
+    assert list(read.content.items()) == [(offset, ut.s2b_name(name)) for offset, name in table.content.items()]
+    # First of the duplicates
+    assert table.get_offset('BONE_HEAD') == startOffset + len('anim_test.mb') + 1
+    # Offsets inside a stored name give its suffix
+    assert read.get_string(table.get_offset('BONE_NECK') + 2) == b'NE_NECK'
+
+def test_lookup_errors():
+    table = StringTable()
+    table.build(names, startOffset, share_suffixes=True)
+    buffer, read = roundTrip(table)
+
+    with pytest.raises(Exception, match='Key not found'):
+        table.get_offset('BONE_TAIL')
+    with pytest.raises(KeyError):
+        read.get_string(startOffset - 1)